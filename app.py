@@ -1,10 +1,22 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, render_template, request, jsonify, redirect, url_for, Response, stream_with_context
 # 删除 from flask_sqlalchemy import SQLAlchemy，改为导入 models 里的 db
 from models import db as workflow_db, Product
+from stats_service import product_stats, dashboard_cache, invalidate_product_caches
+from migrations import check_schema, upgrade_schema, SchemaUpgradeError
+import search_index
+import wage_rates
+import material_prices
+from bulk_import import import_products, ImportFormatError
+import jobs
+from pagination import CursorError, decode_cursor, parse_limit, keyset_page, iter_keyset
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
 import plotly.graph_objs as go
 import plotly.utils
 import json
-from collections import Counter
+import csv
+import time
+import click
 
 # 导入工艺流程相关模块
 try:
@@ -23,10 +35,22 @@ workflow_db.init_app(app)
 # 注册工艺流程API蓝图
 if WORKFLOW_ENABLED:
     app.register_blueprint(workflow_bp)
+# 后台任务（提交/查询/下载/取消），线程数由 JOB_WORKERS 配置
+app.register_blueprint(jobs.jobs_bp)
 
 # 创建数据库表
 with app.app_context():
     workflow_db.create_all()
+    # 已存在的表不会自动补建新增的列和索引，缺失时提示执行 flask upgrade-db
+    pending_migrations = check_schema()
+    # 首次启用全文检索时为已有数据建立索引（回填要读取完整记录，待迁移时跳过，升级后下次启动再回填）
+    if not pending_migrations:
+        search_index.ensure_search_index()
+    # 城市工价表为空时写入内置工价
+    wage_rates.ensure_wage_rates()
+    # 没有价格历史的材料以当前单价回填一条记录
+    material_prices.ensure_price_history()
+    workflow_db.session.commit()
     # 初始化工艺流程数据库（不要再调用 workflow_db.init_app(app)）
     # 其它初始化代码...
 
@@ -49,15 +73,70 @@ with app.app_context():
         workflow_db.session.commit()
 
 
-def generate_charts():
+@app.cli.command('import-products')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--dry-run', is_flag=True, help='只校验不写入')
+@click.option('--errors', 'errors_path', type=click.Path(dir_okay=False), help='把错误明细写入 CSV 文件')
+def import_products_command(path, dry_run, errors_path):
+    """从 Excel/CSV 批量导入产品（按 SKU upsert）"""
+    started = time.perf_counter()
+    # 错误明细边导入边写入 CSV（报告中只保留前若干行）
+    errors_file = open(errors_path, 'w', newline='', encoding='utf-8-sig') if errors_path else None
+    try:
+        on_error = None
+        if errors_file:
+            writer = csv.writer(errors_file)
+            writer.writerow(['行号', 'SKU', '错误'])
+            on_error = lambda error: writer.writerow([error['row'], error['sku'] or '', '; '.join(error['errors'])])
+        with open(path, 'rb') as fileobj:
+            report = import_products(fileobj, path, dry_run=dry_run, on_error=on_error)
+    except ImportFormatError as e:
+        raise click.ClickException(str(e))
+    finally:
+        if errors_file:
+            errors_file.close()
+
+    print(f"{'✅ 校验完成' if dry_run else '✅ 导入完成'}: 共 {report.total} 行，新增 {report.inserted}，"
+          f"更新 {report.updated}，失败 {report.failed}，用时 {time.perf_counter() - started:.2f}s")
+    for error in report.errors[:20]:
+        print(f"   - 第 {error['row']} 行 {error['sku'] or ''}: {'; '.join(error['errors'])}")
+    if report.failed > 20:
+        print(f"   ... 另有 {report.failed - 20} 行错误" + (f"，详见 {errors_path}" if errors_path else ''))
+
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """重建材料、产品和工艺流程模板的全文索引"""
+    counts = search_index.rebuild_search_index()
+    workflow_db.session.commit()
+    if not counts:
+        print("⚠️ 当前 SQLite 不支持 FTS5，搜索将使用 LIKE 查询")
+        return
+    print(f"✅ 全文索引已重建: {', '.join(f'{entity} {count} 条' for entity, count in counts.items())}")
+
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """为已有数据库补建模型中新增的列和索引"""
+    try:
+        applied = upgrade_schema()
+    except SchemaUpgradeError as e:
+        print(f"❌ {e}")
+        return
+    for change in applied:
+        print(f"   - {change}")
+    print(f"✅ 数据库结构已更新，执行 {len(applied)} 项变更" if applied else "✅ 数据库结构已是最新")
+
+
+def generate_charts(stats=None):
     """生成多维度图表"""
-    products = Product.query.all()
-    product_data = [p.to_dict() for p in products]
+    if stats is None:
+        stats = product_stats()
 
     charts = {}
 
     # 1. 系列分布饼图
-    series_counts = Counter(p['series'] for p in product_data)
+    series_counts = stats['by_series']
     charts['series_pie'] = json.dumps({
         'data': [{
             'values': list(series_counts.values()),
@@ -72,7 +151,7 @@ def generate_charts():
     }, cls=plotly.utils.PlotlyJSONEncoder)
 
     # 2. 文件受控状态柱状图
-    file_control_counts = Counter(p['file_control'] for p in product_data)
+    file_control_counts = stats['by_file_control']
     charts['file_control_bar'] = json.dumps({
         'data': [{
             'x': list(file_control_counts.keys()),
@@ -89,7 +168,7 @@ def generate_charts():
     }, cls=plotly.utils.PlotlyJSONEncoder)
 
     # 3. 标准化落地状态柱状图
-    std_counts = Counter(p['standardization'] for p in product_data)
+    std_counts = stats['by_standardization']
     charts['standardization_bar'] = json.dumps({
         'data': [{
             'x': list(std_counts.keys()),
@@ -108,17 +187,24 @@ def generate_charts():
     return charts
 
 
+def build_dashboard_payload():
+    """统计数据和图表一起缓存"""
+    stats = product_stats()
+    return {'stats': stats, 'charts': generate_charts(stats)}
+
+
 # 路由
 @app.route('/')
 def dashboard():
     """主看板页面"""
-    charts = generate_charts()
-    products = Product.query.all()
+    payload = dashboard_cache.get(build_dashboard_payload)
+    stats = payload['stats']
+    charts = payload['charts']
 
     # 统计数据
-    total_products = len(products)
-    controlled_products = len([p for p in products if p.file_control == '已受控'])
-    standardized_products = len([p for p in products if p.standardization == '已落地'])
+    total_products = stats['total']
+    controlled_products = stats['by_file_control'].get('已受控', 0)
+    standardized_products = stats['by_standardization'].get('已落地', 0)
     
     # 获取工艺流程模板数量
     try:
@@ -154,7 +240,12 @@ def add_product():
             standardization=request.form['standardization']
         )
         workflow_db.session.add(product)
-        workflow_db.session.commit()
+        try:
+            invalidate_product_caches()
+            workflow_db.session.commit()
+        except IntegrityError:
+            workflow_db.session.rollback()
+            return render_template('add_product.html', error=f"SKU {request.form['sku']} 已存在"), 409
         return redirect(url_for('products'))
 
     return render_template('add_product.html')
@@ -171,7 +262,13 @@ def edit_product(id):
         product.sku = request.form['sku']
         product.file_control = request.form['file_control']
         product.standardization = request.form['standardization']
-        workflow_db.session.commit()
+        try:
+            invalidate_product_caches()
+            workflow_db.session.commit()
+        except IntegrityError:
+            workflow_db.session.rollback()
+            return render_template('edit_product.html', product=Product.query.get_or_404(id),
+                                   error=f"SKU {request.form['sku']} 已存在"), 409
         return redirect(url_for('products'))
 
     return render_template('edit_product.html', product=product)
@@ -182,87 +279,266 @@ def delete_product(id):
     """删除产品"""
     product = Product.query.get_or_404(id)
     workflow_db.session.delete(product)
+    invalidate_product_caches()
     workflow_db.session.commit()
     return redirect(url_for('products'))
 
 
+PRODUCT_COLUMNS = (Product.id, Product.series, Product.spu, Product.sku,
+                   Product.file_control, Product.standardization)
+PRODUCT_FILTERS = ('series', 'spu', 'file_control', 'standardization')
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def iter_products_json(query, cursor=None):
+    """以 JSON 数组格式分块输出全部产品"""
+    yield '['
+    first = True
+    for rows in iter_keyset(query, [Product.id], cursor=cursor):
+        chunk = ','.join(app.json.dumps(row._asdict()) for row in rows)
+        yield chunk if first else ',' + chunk
+        first = False
+    yield ']'
+
+
+def iter_products_ndjson(query, cursor=None):
+    """每行一个产品 JSON，按块输出"""
+    for rows in iter_keyset(query, [Product.id], cursor=cursor):
+        yield ''.join(app.json.dumps(row._asdict()) + '\n' for row in rows)
+
+
 @app.route('/api/products')
 def api_products():
-    """API接口获取产品数据"""
-    products = Product.query.all()
-    return jsonify([p.to_dict() for p in products])
+    """
+    API接口获取产品数据。
+    参数: series/spu/file_control/standardization 精确过滤；
+    limit/cursor 按 id 游标分页；format=ndjson 或 Accept: application/x-ndjson 时逐行流式输出。
+    不带分页参数时以 JSON 数组流式返回全部产品。
+    """
+    try:
+        query = workflow_db.session.query(*PRODUCT_COLUMNS)
+        for name in PRODUCT_FILTERS:
+            value = request.args.get(name)
+            if value:
+                query = query.filter(getattr(Product, name) == value)
+
+        cursor = request.args.get('cursor')
+        if cursor:
+            decode_cursor(cursor, [Product.id])
+
+        wants_ndjson = (request.args.get('format') == 'ndjson'
+                        or request.accept_mimetypes.best == NDJSON_MIMETYPE)
+        if wants_ndjson:
+            return Response(stream_with_context(iter_products_ndjson(query, cursor)), mimetype=NDJSON_MIMETYPE)
+
+        if cursor or request.args.get('limit'):
+            limit = parse_limit(request.args.get('limit'))
+            rows, next_cursor = keyset_page(query, [Product.id], cursor=cursor, limit=limit)
+            return jsonify({
+                'products': [row._asdict() for row in rows],
+                'next_cursor': next_cursor,
+                'limit': limit
+            })
+
+        return Response(stream_with_context(iter_products_json(query)), mimetype='application/json')
+    except CursorError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+MAX_REPORTED_IMPORT_ERRORS = 1000  # 导入接口最多返回的错误行数
+
+
+@app.route('/api/products/import', methods=['POST'])
+def import_products_api():
+    """
+    批量导入产品（上传 .xlsx 或 .csv，表头为字段名或导出文件的中文表头）。
+    按 SKU upsert，dry_run=1 时只校验不写入，返回逐行错误报告。
+    async=1 时保存文件后提交后台任务，立即返回任务ID，报告通过 /api/jobs/{id}/result 获取。
+    """
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({'error': '请上传文件'}), 400
+    dry_run = request.form.get('dry_run', request.args.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+    run_async = request.form.get('async', request.args.get('async', '')).lower() in ('1', 'true', 'yes')
+
+    try:
+        if run_async:
+            job = jobs.submit('product_import', {
+                'path': jobs.save_upload(upload), 'filename': upload.filename, 'dry_run': dry_run
+            })
+            return jobs.job_response(job, 202)
+        report = import_products(upload.stream, upload.filename, dry_run=dry_run)
+        return jsonify(report.to_dict(max_errors=MAX_REPORTED_IMPORT_ERRORS))
+    except ImportFormatError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        workflow_db.session.rollback()
+        return jsonify({'error': str(e)}), 500
 
 
 from flask import send_file
-from export_utils import export_to_excel
-from datetime import datetime
+from export_utils import (
+    EXPORT_COLUMNS, EXPORT_MIMETYPES, EXCEL_SYNC_MAX_ROWS, export_columns, export_filename, iter_export_rows,
+    export_excel_file, iter_csv
+)
+from urllib.parse import quote
 
 
 @app.route('/export')
 def export_products():
-    """导出产品数据"""
-    products = Product.query.all()
-    excel_file = export_to_excel(products)
-
-    filename = f"产品数据_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-
+    """
+    导出数据。
+    参数: entity=products|materials|cost_calculations, columns=逗号分隔的字段名, format=xlsx|csv
+    数据按批次从数据库流式读取，内存占用与行数无关。
+    async=1 时提交后台导出任务，立即返回任务ID，文件通过 /api/jobs/{id}/result 下载；
+    xlsx 超过 EXCEL_SYNC_MAX_ROWS 行时同样改为后台任务（返回 202），避免请求长时间无响应。
+    """
+    entity = request.args.get('entity', 'products')
+    export_format = request.args.get('format', 'xlsx')
+    columns = [name.strip() for name in request.args.get('columns', '').split(',') if name.strip()]
+
+    if export_format not in ('xlsx', 'csv'):
+        return jsonify({'error': f'不支持的导出格式: {export_format}'}), 400
+    try:
+        model, selected = export_columns(entity, columns)
+    except ValueError as e:
+        return jsonify({'error': str(e), 'available_columns': {
+            name: [field for field, _ in fields] for name, (_, fields) in EXPORT_COLUMNS.items()
+        }}), 400
+
+    run_async = request.args.get('async') in ('1', 'true')
+    if not run_async and export_format == 'xlsx':
+        run_async = workflow_db.session.query(func.count(model.id)).scalar() > EXCEL_SYNC_MAX_ROWS
+    if run_async:
+        job = jobs.submit('export', {'entity': entity, 'columns': columns, 'format': export_format})
+        return jobs.job_response(job, 202)
+
+    headers = [header for _, header in selected]
+    rows = iter_export_rows(model, selected)
+    filename = export_filename(entity, export_format)
+
+    if export_format == 'csv':
+        # CSV 边查询边发送，无需等待整个文件生成
+        response = Response(stream_with_context(iter_csv(headers, rows)), mimetype=EXPORT_MIMETYPES['csv'])
+        response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}"
+        return response
+
+    # xlsx 为 zip 格式，需写完后发送；写入只写工作簿，超过阈值的文件落到临时文件
     return send_file(
-        excel_file,
+        export_excel_file(headers, rows),
         as_attachment=True,
         download_name=filename,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        mimetype=EXPORT_MIMETYPES['xlsx']
     )
 
 
+@app.route('/api/search')
+def api_search():
+    """
+    统一搜索材料、产品和工艺流程模板，按相关度排序。
+    参数: q 关键词, types=materials,products,templates 限定范围, limit 返回条数
+    """
+    try:
+        keyword = request.args.get('q', '').strip()
+        types = [name.strip() for name in request.args.get('types', '').split(',') if name.strip()]
+        limit = request.args.get('limit', search_index.DEFAULT_SEARCH_LIMIT, type=int)
+
+        results = search_index.search(keyword, entities=types or None, limit=limit) if keyword else []
+        return jsonify({
+            'query': keyword,
+            'results': results,
+            'full_text': search_index.is_available()
+        })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/api/stats')
 def api_stats():
     """获取统计数据API"""
-    products = Product.query.all()
+    return jsonify(dashboard_cache.get(build_dashboard_payload)['stats'])
 
-    stats = {
-        'total': len(products),
-        'by_series': {},
-        'by_file_control': {},
-        'by_standardization': {},
-        'combinations': {}
-    }
 
-    for product in products:
-        # 按系列统计
-        stats['by_series'][product.series] = stats['by_series'].get(product.series, 0) + 1
+@app.route('/api/stats/cache')
+def api_stats_cache():
+    """看板缓存命中率和重建耗时"""
+    return jsonify(dashboard_cache.stats())
 
-        # 按文件受控状态统计
-        stats['by_file_control'][product.file_control] = stats['by_file_control'].get(product.file_control, 0) + 1
 
-        # 按标准化状态统计
-        stats['by_standardization'][product.standardization] = stats['by_standardization'].get(product.standardization,
-                                                                                               0) + 1
+BATCH_UPDATE_FIELDS = ('file_control', 'standardization')
+BATCH_UPDATE_CHUNK_SIZE = 500  # 每条 UPDATE 的 id 个数，低于 SQLite 参数上限
 
-        # 按状态组合统计
-        combo = f"{product.file_control}-{product.standardization}"
-        stats['combinations'][combo] = stats['combinations'].get(combo, 0) + 1
 
-    return jsonify(stats)
+def parse_product_ids(values):
+    """把请求中的 product_ids 转换为去重排序后的整数列表（接受整数或整数字符串），格式错误时抛出 ValueError"""
+    if not isinstance(values, list):
+        raise ValueError('product_ids 必须是列表')
+    product_ids = set()
+    for value in values:
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            raise ValueError(f'product_ids 中包含无效的ID: {value!r}')
+        try:
+            product_ids.add(int(value))
+        except ValueError:
+            raise ValueError(f'product_ids 中包含无效的ID: {value!r}') from None
+    return sorted(product_ids)
 
 
 @app.route('/batch_update', methods=['POST'])
 def batch_update():
-    """批量更新产品状态"""
-    data = request.get_json()
-    product_ids = data.get('product_ids', [])
-    updates = data.get('updates', {})
-
+    """
+    批量更新产品状态。
+    product_ids: 指定产品ID；filters: 按 series/spu/file_control/standardization 筛选；
+    两者同时提供时取交集。按 id 分块执行 UPDATE ... WHERE id IN (...)，返回实际匹配的行数。
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'message': '请求体必须是 JSON 对象'}), 400
+    filters = data.get('filters') or {}
+    updates = data.get('updates') or {}
+    if not isinstance(filters, dict) or not isinstance(updates, dict):
+        return jsonify({'success': False, 'message': 'filters 和 updates 必须是对象'}), 400
     try:
-        for product_id in product_ids:
-            product = Product.query.get(product_id)
-            if product:
-                if 'file_control' in updates:
-                    product.file_control = updates['file_control']
-                if 'standardization' in updates:
-                    product.standardization = updates['standardization']
+        product_ids = parse_product_ids(data.get('product_ids') or [])
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    updates = {key: value for key, value in updates.items() if key in BATCH_UPDATE_FIELDS}
+
+    if not updates:
+        return jsonify({'success': False, 'message': f"updates 中需包含 {'/'.join(BATCH_UPDATE_FIELDS)}"}), 400
+    unknown = [name for name in filters if name not in PRODUCT_FILTERS]
+    if unknown:
+        return jsonify({'success': False, 'message': f"未知的筛选条件: {', '.join(unknown)}"}), 400
+    if not product_ids and not filters:
+        return jsonify({'success': False, 'message': '请指定 product_ids 或 filters'}), 400
+
+    conditions = [getattr(Product, name) == value for name, value in filters.items()]
+    try:
+        matched = 0
+        if product_ids:
+            for start in range(0, len(product_ids), BATCH_UPDATE_CHUNK_SIZE):
+                chunk = product_ids[start:start + BATCH_UPDATE_CHUNK_SIZE]
+                result = workflow_db.session.execute(
+                    update(Product).where(Product.id.in_(chunk), *conditions).values(**updates),
+                    execution_options={'synchronize_session': False}
+                )
+                matched += result.rowcount
+        else:
+            result = workflow_db.session.execute(
+                update(Product).where(*conditions).values(**updates),
+                execution_options={'synchronize_session': False}
+            )
+            matched = result.rowcount
 
+        # 整批只失效一次缓存；状态字段不在全文索引中，无需重建索引
+        if matched:
+            invalidate_product_caches()
         workflow_db.session.commit()
-        return jsonify({'success': True, 'message': f'成功更新 {len(product_ids)} 个产品'})
+        return jsonify({'success': True, 'matched': matched, 'message': f'成功更新 {matched} 个产品'})
     except Exception as e:
         workflow_db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
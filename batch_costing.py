@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+工艺核价 - 无界面批量核价
+
+按工艺路线表为整个 BOM 计算各部件的工时与成本，不依赖 Qt，
+可在无显示环境的服务器上定时运行。
+
+用法:
+    python batch_costing.py BOM.xlsx -o 核价结果.xlsx
+    python batch_costing.py BOM.xlsx --routing 工艺路线.xlsx --city 东莞 -o 核价结果.xlsx
+
+BOM 表需包含 Component, a, b, c, d 列（可选 City 列）；
+工艺路线表需包含 Component, Process Path 列（可选 Process Parameters 列），
+每行表示一个部件的一道工艺，按出现顺序编号。
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from process_formulas import PROCESS_FORMULAS, WORK_PRICES, DEFAULT_WORK_PRICE, get_formula
+
+BOM_COLUMNS = ['Component', 'a', 'b', 'c', 'd']
+ROUTING_COLUMNS = ['Component', 'Process Path']
+RESULT_FIELDS = ['Process Path', 'Process Parameters', 'Process Time', 'Process Cost']
+DEFAULT_ROUTING_SHEET = 'Routing'
+
+
+def _check_columns(df, required, name):
+    missing = [col for col in required if col not in df.columns]
+    if missing:
+        raise ValueError(f"{name}缺少列: {', '.join(missing)}")
+
+
+def cost_bom(bom, routing, city=None, formulas=None, work_prices=None,
+             default_price=DEFAULT_WORK_PRICE):
+    """
+    为整个 BOM 计算工艺工时与成本。
+    bom: 部件表 DataFrame
+    routing: 工艺路线 DataFrame
+    city: 指定城市（覆盖 BOM 中的 City 列）
+    返回追加了 Process Path/Parameters/Time/Cost N 列及合计列的新 DataFrame
+    """
+    formulas = PROCESS_FORMULAS if formulas is None else formulas
+    work_prices = WORK_PRICES if work_prices is None else work_prices
+
+    _check_columns(bom, BOM_COLUMNS, 'BOM表')
+    _check_columns(routing, ROUTING_COLUMNS, '工艺路线表')
+
+    result = bom.reset_index(drop=True)
+    if city is not None or 'City' not in result.columns:
+        result['City'] = city
+
+    unknown_paths = sorted(set(routing['Process Path'].dropna()) - set(formulas))
+    if unknown_paths:
+        raise ValueError(f"以下工艺路径没有配置工时公式: {', '.join(map(str, unknown_paths))}")
+
+    routing = routing.dropna(subset=ROUTING_COLUMNS).copy()
+    if 'Process Parameters' not in routing.columns:
+        routing['Process Parameters'] = 0
+    routing['Process Parameters'] = pd.to_numeric(routing['Process Parameters']).fillna(0)
+    routing['_seq'] = routing.groupby('Component').cumcount() + 1
+
+    # 展开为 (BOM行, 工艺) 的长表，按工艺路径分组向量化求值
+    rows = result[BOM_COLUMNS + ['City']].rename_axis('_row').reset_index()
+    steps = rows.merge(routing[['Component', 'Process Path', 'Process Parameters', '_seq']],
+                       on='Component', how='inner')
+
+    times = np.zeros(len(steps))
+    for process_path, index in steps.groupby('Process Path').indices.items():
+        formula = get_formula(process_path, formulas)
+        group = steps.iloc[index]
+        times[index] = formula.evaluate(
+            a=group['a'].to_numpy(),
+            b=group['b'].to_numpy(),
+            c=group['c'].to_numpy(),
+            d=group['d'].to_numpy(),
+            parameters=group['Process Parameters'].to_numpy(dtype=float),
+        )
+
+    unknown_cities = sorted(set(steps['City'].dropna()) - set(work_prices))
+    for unknown in unknown_cities:
+        print(f"Warning: No work price for city '{unknown}', using default price {default_price}")
+    prices = steps['City'].map(work_prices).fillna(default_price).to_numpy(dtype=float)
+
+    steps['Process Time'] = times
+    steps['Process Cost'] = times * prices
+
+    if steps.empty:
+        result['Total Process Time'] = 0.0
+        result['Total Process Cost'] = 0.0
+        return result
+
+    # 转回宽表，列顺序与桌面端保存的格式一致
+    wide = steps.pivot(index='_row', columns='_seq', values=RESULT_FIELDS)
+    ordered = [(field, seq) for seq in sorted(steps['_seq'].unique()) for field in RESULT_FIELDS]
+    wide = wide[ordered]
+    wide.columns = [f'{field} {seq}' for field, seq in ordered]
+    result = result.join(wide)
+
+    totals = steps.groupby('_row')[['Process Time', 'Process Cost']].sum()
+    result['Total Process Time'] = totals['Process Time'].reindex(result.index, fill_value=0.0)
+    result['Total Process Cost'] = totals['Process Cost'].reindex(result.index, fill_value=0.0)
+    return result
+
+
+def cost_workbook(bom_path, output_path, routing_path=None, bom_sheet=0,
+                  routing_sheet=DEFAULT_ROUTING_SHEET, city=None):
+    """读取 BOM 工作簿和工艺路线表，核价后写出结果工作簿"""
+    bom = pd.read_excel(bom_path, sheet_name=bom_sheet)
+    routing = pd.read_excel(routing_path or bom_path, sheet_name=routing_sheet)
+    result = cost_bom(bom, routing, city=city)
+    result.to_excel(output_path, index=False)
+    return result
+
+
+def main(argv=None):
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='工艺核价批量计算（无界面）')
+    parser.add_argument('bom', help='BOM工作簿路径 (.xlsx)')
+    parser.add_argument('-o', '--output', required=True, help='输出工作簿路径')
+    parser.add_argument('--routing', help='工艺路线工作簿路径，默认与BOM同一工作簿')
+    parser.add_argument('--bom-sheet', default=0, help='BOM工作表名称，默认第一个工作表')
+    parser.add_argument('--routing-sheet', default=DEFAULT_ROUTING_SHEET,
+                        help=f'工艺路线工作表名称，默认 {DEFAULT_ROUTING_SHEET}')
+    parser.add_argument('--city', help='核价城市，覆盖BOM中的City列')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    try:
+        result = cost_workbook(args.bom, args.output, routing_path=args.routing,
+                               bom_sheet=args.bom_sheet, routing_sheet=args.routing_sheet,
+                               city=args.city)
+    except (ValueError, KeyError, FileNotFoundError) as e:
+        print(f"❌ 核价失败: {e}")
+        return 1
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ 已完成 {len(result)} 行核价，用时 {elapsed:.2f}s，结果已保存到 {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
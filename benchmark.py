@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+板式家具工艺流程管理系统 - 性能回归检查脚本
+
+在内存 SQLite 数据库上构造数据并调用接口，检查 SQL 语句数和耗时是否随数据规模失控。
+
+用法:
+    python benchmark.py                  # 运行全部检查
+    python benchmark.py cost-queries     # 只运行指定检查
+    python benchmark.py template-detail
+    python benchmark.py setup-time       # 含准备时间的模板连续计算（成本计划缓存不持有 ORM 对象）
+    python benchmark.py query-plans      # 检查各接口查询的 EXPLAIN QUERY PLAN
+    python benchmark.py search           # 全文检索：混写名称的命中，大量命中时的相关度排序
+"""
+
+import sys
+import time
+from contextlib import contextmanager
+
+from flask import Flask
+from sqlalchemy import event
+
+from models import db, WorkflowTemplate, WorkflowNode, NodeConnection, Material, NodeType
+from workflow_api import workflow_bp
+import search_index
+
+
+def create_app():
+    """创建使用内存数据库的应用实例"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    app.register_blueprint(workflow_bp)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+class QueryLog(list):
+    """执行过的 SQL 语句列表"""
+
+    def __init__(self):
+        super().__init__()
+        self.executed = []
+
+
+@contextmanager
+def count_queries():
+    """统计代码块内执行的 SQL 语句（statements.executed 保留单条执行语句的参数）"""
+    statements = QueryLog()
+    executed = statements.executed
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+        if not executemany:
+            executed.append((statement, parameters))
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def create_materials(count):
+    """创建测试材料，返回ID列表"""
+    materials = [
+        Material(code=f'BENCH-{i:06d}', name=f'测试材料{i}', category='板材',
+                 unit_price=100 + i % 50, waste_rate=0.05)
+        for i in range(count)
+    ]
+    db.session.add_all(materials)
+    db.session.commit()
+    return [material.id for material in materials]
+
+
+def create_linear_template(node_count, setup_time_minutes=None):
+    """创建一条 开始→工序×N→结束 的直线流程，返回模板ID"""
+    template = WorkflowTemplate(name=f'测试流程{node_count}', workflow_config={})
+    db.session.add(template)
+    db.session.flush()
+
+    nodes = [WorkflowNode(workflow_id=template.id, node_id='start', node_type=NodeType.START, name='开始')]
+    for i in range(node_count):
+        nodes.append(WorkflowNode(
+            workflow_id=template.id, node_id=f'n{i}', node_type=NodeType.CUTTING, name=f'工序{i}',
+            estimated_time_minutes=5 + i % 7, labor_cost_per_hour=40, machine_cost_per_hour=20,
+            setup_time_minutes=setup_time_minutes
+        ))
+    nodes.append(WorkflowNode(workflow_id=template.id, node_id='end', node_type=NodeType.END, name='结束'))
+    db.session.add_all(nodes)
+    db.session.flush()
+
+    db.session.add_all([
+        NodeConnection(workflow_id=template.id, source_node_id=source.id, target_node_id=target.id,
+                       connection_id=f'c_{source.node_id}_{target.node_id}', conditions={})
+        for source, target in zip(nodes, nodes[1:])
+    ])
+    db.session.commit()
+    return template.id
+
+
+def check_cost_queries(app):
+    """成本计算的 SQL 语句数不随材料数量增长"""
+    client = app.test_client()
+    with app.app_context():
+        material_ids = create_materials(200)
+        template_id = create_linear_template(5)
+
+    # 先预热成本计划缓存，之后每次计算的语句数应完全一致
+    client.post('/api/workflow/cost-calculation', json={'workflow_id': template_id})
+
+    counts = {}
+    for material_count in (1, 10, 200):
+        payload = {
+            'workflow_id': template_id,
+            'quantity': 10,
+            'materials': [{'material_id': mid, 'quantity': 2} for mid in material_ids[:material_count]]
+        }
+        with app.app_context():
+            with count_queries() as statements:
+                response = client.post('/api/workflow/cost-calculation', json=payload)
+        assert response.status_code == 200, response.get_json()
+        counts[material_count] = len(statements)
+        print(f"  材料数 {material_count:>4}: {len(statements)} 条SQL")
+
+    if len(set(counts.values())) != 1:
+        print(f"❌ 成本计算SQL语句数随材料数量变化: {counts}")
+        return False
+    return True
+
+
+# 模板详情单节点耗时的允许增幅：节点数增加 10 倍时单节点耗时不应超过该倍数（线性增长时不变，平方增长时约 10 倍）
+PER_NODE_LATENCY_GROWTH = 2.0
+
+
+def check_template_detail(app):
+    """模板详情的 SQL 语句数固定，耗时随节点数线性增长（单节点耗时不随规模上升）"""
+    client = app.test_client()
+    node_counts = (10, 100, 1000)
+    with app.app_context():
+        template_ids = {count: create_linear_template(count) for count in node_counts}
+
+    counts = {}
+    per_node = {}
+    for node_count, template_id in template_ids.items():
+        url = f'/api/workflow/templates/{template_id}'
+        with app.app_context():
+            with count_queries() as statements:
+                response = client.get(url)
+        assert response.status_code == 200, response.get_json()
+        counts[node_count] = len(statements)
+
+        timings = []
+        for _ in range(10):
+            started = time.perf_counter()
+            client.get(url)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        median_ms = timings[len(timings) // 2] * 1000
+        per_node[node_count] = median_ms / node_count
+        print(f"  节点数 {node_count:>5}: {len(statements)} 条SQL, 中位耗时 {median_ms:.1f}ms "
+              f"({median_ms / node_count * 1000:.1f}µs/节点)")
+
+    ok = True
+    if len(set(counts.values())) != 1:
+        print(f"❌ 模板详情SQL语句数随节点数量变化: {counts}")
+        ok = False
+    for smaller, larger in zip(node_counts, node_counts[1:]):
+        growth = per_node[larger] / per_node[smaller]
+        if growth > PER_NODE_LATENCY_GROWTH:
+            print(f"❌ 单节点耗时从 {smaller} 到 {larger} 个节点增长 {growth:.1f} 倍"
+                  f"（上限 {PER_NODE_LATENCY_GROWTH} 倍）")
+            ok = False
+    return ok
+
+
+def check_setup_time(app):
+    """含准备时间的模板：命中缓存的成本计划后，各成本接口的结果与首次计算一致"""
+    client = app.test_client()
+    with app.app_context():
+        material_ids = create_materials(5)
+        template_id = create_linear_template(5, setup_time_minutes=30)
+
+    materials = [{'material_id': mid, 'quantity': 2} for mid in material_ids]
+    requests = [
+        ('成本计算', '/api/workflow/cost-calculation',
+         {'workflow_id': template_id, 'quantity': 10, 'materials': materials}),
+        ('风险模拟', '/api/workflow/cost-simulation',
+         {'workflow_id': template_id, 'quantity': 10, 'materials': materials, 'scenarios': 1000, 'seed': 1}),
+        ('批量计算', '/api/workflow/cost-calculation/batch',
+         {'calculations': [{'workflow_id': template_id, 'quantity': 10, 'materials': materials}]}),
+        ('数量曲线', '/api/workflow/cost-curve',
+         {'workflow_id': template_id, 'materials': materials, 'quantities': [1, 10, 100]}),
+        ('交期排程', f'/api/workflow/templates/{template_id}/schedule?quantity=10', None),
+    ]
+
+    ok = True
+    for name, url, payload in requests:
+        results = []
+        for _ in range(2):
+            response = client.open(url, method='POST' if payload else 'GET', json=payload)
+            results.append((response.status_code, response.get_json()))
+        statuses = [status for status, _ in results]
+        print(f"  {'✓' if statuses == [200, 200] else '❌'} {name}: {statuses}")
+        if statuses != [200, 200]:
+            print(f"      {results[-1][1]}")
+            ok = False
+
+    # 准备时间每批计一次：10 件的人工+设备成本 = 30 分钟准备 + 10 × 单件工时
+    with app.app_context():
+        response = client.post('/api/workflow/cost-calculation', json={'workflow_id': template_id, 'quantity': 10})
+        if response.status_code != 200:
+            return False
+        summary = response.get_json()['cost_breakdown']['summary']
+        unit_minutes = sum(5 + i % 7 for i in range(5))
+        expected = (5 * 30 + unit_minutes * 10) / 60 * (40 + 20)
+        if abs(summary['labor_cost'] + summary['machine_cost'] - expected) > 1e-6:
+            print(f"❌ 准备时间计入有误: {summary['labor_cost'] + summary['machine_cost']} != {expected}")
+            ok = False
+    return ok
+
+
+# 查询计划检查的接口：(名称, 方法, URL, 请求体, 允许全表扫描的表)
+PLAN_PROBES = [
+    ('模板列表', 'GET', '/api/workflow/templates', None, ()),
+    ('模板列表-按状态', 'GET', '/api/workflow/templates?status=draft', None, ()),
+    ('模板列表-按系列', 'GET', '/api/workflow/templates?product_series=BENCH', None, ()),
+    ('模板详情', 'GET', '/api/workflow/templates/{template_id}', None, ()),
+    ('材料列表', 'GET', '/api/workflow/materials', None, ()),
+    ('材料列表-按类别', 'GET', '/api/workflow/materials?category=板材', None, ()),
+    ('材料列表-游标', 'GET', '/api/workflow/materials?limit=20', None, ()),
+    ('成本计算', 'POST', '/api/workflow/cost-calculation', '{cost_payload}', ()),
+    ('计算历史', 'GET', '/api/workflow/cost-calculations', None, ()),
+    ('计算历史-游标', 'GET', '/api/workflow/cost-calculations?limit=20', None, ()),
+    ('计算历史-含被取代', 'GET', '/api/workflow/cost-calculations?include_superseded=1', None, ()),
+    ('计算历史-按SKU', 'GET', '/api/workflow/cost-calculations?product_sku=BENCH-SKU&limit=20', None, ()),
+    ('计算历史-按流程', 'GET', '/api/workflow/cost-calculations?workflow_id={template_id}&limit=20', None, ()),
+    ('计算详情', 'GET', '/api/workflow/cost-calculations/{calculation_id}', None, ()),
+    ('成本趋势', 'GET', '/api/workflow/statistics/cost-trend?days=90', None, ()),
+]
+
+PLAN_WARNINGS = ('USE TEMP B-TREE FOR ORDER BY',)
+
+
+def explain(statement, parameters):
+    """返回一条语句的 EXPLAIN QUERY PLAN 明细"""
+    rows = db.session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters or ())
+    return [row[-1] for row in rows]
+
+
+def plan_problems(plan, allow_scan):
+    """查询计划中的全表扫描（未使用索引）和额外排序"""
+    problems = []
+    for detail in plan:
+        words = detail.split()
+        if words[0] == 'SCAN' and 'INDEX' not in detail and words[1] not in allow_scan:
+            problems.append(detail)
+        elif any(detail.startswith(warning) for warning in PLAN_WARNINGS):
+            problems.append(detail)
+    return problems
+
+
+def check_query_plans(app):
+    """各接口查询都应命中索引，不出现全表扫描或临时排序"""
+    client = app.test_client()
+    with app.app_context():
+        material_ids = create_materials(50)
+        template_id = create_linear_template(20)
+
+    cost_payload = {'workflow_id': template_id, 'product_sku': 'BENCH-SKU', 'quantity': 5,
+                    'materials': [{'material_id': mid, 'quantity': 1} for mid in material_ids[:5]]}
+    response = client.post('/api/workflow/cost-calculation', json=cost_payload)
+    assert response.status_code == 200, response.get_json()
+    context = {'template_id': template_id, 'calculation_id': response.get_json()['calculation_id']}
+
+    failed = False
+    for name, method, url, body, allow_scan in PLAN_PROBES:
+        url = url.format(**context)
+        payload = cost_payload if body == '{cost_payload}' else body
+        with app.app_context():
+            with count_queries() as statements:
+                response = client.open(url, method=method, json=payload)
+            assert response.status_code == 200, (url, response.get_json())
+
+            problems = []
+            seen = set()
+            for statement, parameters in statements.executed:
+                if not statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                    continue
+                if statement in seen:
+                    continue
+                seen.add(statement)
+                for detail in plan_problems(explain(statement, parameters), allow_scan):
+                    problems.append((detail, statement))
+
+        print(f"  {'❌' if problems else '✓'} {name}: {len(statements)} 条SQL")
+        for detail, statement in problems:
+            print(f"      {detail}")
+            print(f"        {' '.join(statement.split())[:200]}")
+        failed = failed or bool(problems)
+
+    return not failed
+
+
+# 全文检索：(查询词, 应命中的材料名称)
+SEARCH_PROBES = [
+    ('颗粒板3', '颗粒板3'),
+    ('18mm颗粒板', '18mm颗粒板'),
+    ('18mm', '18mm颗粒板'),
+    ('E1级', 'E1级颗粒板2440'),
+    ('2440颗粒板', 'E1级颗粒板2440'),
+]
+
+
+def check_search(app):
+    """
+    中文与字母数字混写的名称按任一部分或整体查询都能命中，限定实体时不返回其他实体；
+    命中很多时最相关的记录排在最前
+    """
+    with app.app_context():
+        if not search_index.is_available():
+            print("  - 当前 SQLite 不支持 FTS5，跳过")
+            return True
+        names = sorted({name for _, name in SEARCH_PROBES} | {'颗粒板'})
+        db.session.add_all([
+            Material(code=f'SEARCH-{i:03d}', name=name, category='板材', unit_price=100)
+            for i, name in enumerate(names)
+        ])
+        # 同名的工艺流程模板，限定只搜材料时不应出现
+        db.session.add_all([WorkflowTemplate(name=name, workflow_config={}) for name in names])
+        db.session.commit()
+
+        ok = True
+        for query, expected in SEARCH_PROBES:
+            results = search_index.search(query, ['materials'])
+            titles = [result['title'] for result in results]
+            found = expected in titles and all(result['entity'] == 'materials' for result in results)
+            print(f"  {'✓' if found else '❌'} {query}: {titles}")
+            ok = ok and found
+
+        # 最相关的记录最后写入（rowid 最大），排在大量命中记录之后
+        db.session.add_all([
+            Material(code=f'EDGE-{i:04d}', name=f'封边条{i}', category='封边', unit_price=1)
+            for i in range(1000)
+        ])
+        db.session.add(Material(code='EDGE-BEST', name='封边条 封边条 封边条', category='封边', unit_price=1))
+        db.session.commit()
+        titles = [result['title'] for result in search_index.search('封边条', ['materials'], limit=1)]
+        ranked = titles == ['封边条 封边条 封边条']
+        print(f"  {'✓' if ranked else '❌'} 相关度排序（1001 条命中）: {titles}")
+        ok = ok and ranked
+
+        try:
+            search_index.search('封边条', ['material'])
+            print("  ❌ 未知的实体名未报错")
+            ok = False
+        except ValueError as e:
+            print(f"  ✓ 未知的实体名: {e}")
+    return ok
+
+
+CHECKS = {
+    'cost-queries': check_cost_queries,
+    'template-detail': check_template_detail,
+    'setup-time': check_setup_time,
+    'query-plans': check_query_plans,
+    'search': check_search,
+}
+
+
+def main(argv=None):
+    """主函数"""
+    argv = sys.argv[1:] if argv is None else argv
+    names = argv or list(CHECKS)
+    unknown = [name for name in names if name not in CHECKS]
+    if unknown:
+        print(f"未知检查项: {', '.join(unknown)}，可选: {', '.join(CHECKS)}")
+        return 2
+
+    failed = []
+    for name in names:
+        print(f"▶ {name}")
+        app = create_app()
+        started = time.perf_counter()
+        ok = CHECKS[name](app)
+        print(f"  {'✅ 通过' if ok else '❌ 失败'} ({time.perf_counter() - started:.2f}s)")
+        if not ok:
+            failed.append(name)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
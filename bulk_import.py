@@ -0,0 +1,233 @@
+"""
+产品批量导入
+
+流式读取 Excel（只读模式）或 CSV，按批校验后以 SKU 为键 upsert：
+每批一条 INSERT ... ON CONFLICT(sku) DO UPDATE（products.sku 有唯一索引），并发导入或与新增产品同时进行
+也不会产生重复 SKU；插入/更新数按写入前的一条 IN 查询统计。
+每批一个事务。内存占用只与批大小有关；出错的行不导入，逐行返回错误原因。
+"""
+
+import csv
+import io
+import os
+from dataclasses import dataclass, field
+
+from openpyxl import load_workbook
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, Product
+import search_index
+from jobs import job_handler
+from stats_service import invalidate_product_caches
+
+IMPORT_FIELDS = ('series', 'spu', 'sku', 'file_control', 'standardization')
+IMPORT_CHUNK_SIZE = 2000
+MAX_REPORTED_ERRORS = 1000  # 导入报告中最多保留的错误行数（失败行数另行计数）
+MAX_FIELD_LENGTHS = {'series': 50, 'spu': 50, 'sku': 50, 'file_control': 20, 'standardization': 20}
+ALLOWED_VALUES = {
+    'file_control': ('已受控', '未受控'),
+    'standardization': ('已落地', '未落地'),
+}
+
+# 表头别名（与导出文件的中文表头一致，导出的文件可直接导回）
+HEADER_ALIASES = {
+    'series': 'series', '系列': 'series',
+    'spu': 'spu',
+    'sku': 'sku',
+    'file_control': 'file_control', '文件受控': 'file_control',
+    'standardization': 'standardization', '标准化落地': 'standardization',
+}
+
+
+class ImportFormatError(ValueError):
+    """导入文件格式不正确（类型不支持或缺少必需列）"""
+
+
+@dataclass
+class ImportReport:
+    """导入结果；错误明细只保留前 max_errors 行，内存占用与文件行数无关"""
+    total: int = 0
+    inserted: int = 0
+    updated: int = 0
+    failed: int = 0
+    errors: list = field(default_factory=list)  # [{'row': 行号, 'sku': ..., 'errors': [...]}]
+    dry_run: bool = False
+    max_errors: int = MAX_REPORTED_ERRORS
+
+    def add_error(self, error):
+        """记录一个失败行（超过上限时只计数）"""
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(error)
+
+    def to_dict(self, max_errors=None):
+        errors = self.errors if max_errors is None else self.errors[:max_errors]
+        return {
+            'total': self.total,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'failed': self.failed,
+            'dry_run': self.dry_run,
+            'errors': errors,
+            'errors_truncated': len(errors) < self.failed
+        }
+
+
+def _cell_text(value):
+    """单元格转文本：整数值的浮点数去掉 .0，空值为空字符串"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def iter_xlsx_rows(fileobj):
+    """只读模式逐行读取第一个工作表"""
+    wb = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        for row in wb.worksheets[0].iter_rows(values_only=True):
+            yield row
+    finally:
+        wb.close()
+
+
+def iter_csv_rows(fileobj):
+    """逐行读取 CSV（兼容带 BOM 的 UTF-8）"""
+    text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    try:
+        yield from csv.reader(text)
+    finally:
+        text.detach()
+
+
+def iter_records(fileobj, filename, aliases=HEADER_ALIASES, required=IMPORT_FIELDS):
+    """
+    按文件扩展名解析，逐条产出 (行号, {字段: 文本})。
+    aliases: 表头别名 -> 字段名（默认为产品字段，支持导出文件的中文表头）
+    required: 必需的列，缺少时抛出 ImportFormatError
+    """
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.xlsx':
+        rows = iter_xlsx_rows(fileobj)
+    elif extension == '.csv':
+        rows = iter_csv_rows(fileobj)
+    else:
+        raise ImportFormatError(f'不支持的文件类型: {extension or filename}，请上传 .xlsx 或 .csv')
+
+    header = next(rows, None)
+    if header is None:
+        raise ImportFormatError('文件为空')
+    columns = {}
+    for index, name in enumerate(header):
+        key = aliases.get(_cell_text(name).lower()) or aliases.get(_cell_text(name))
+        if key and key not in columns:
+            columns[key] = index
+    missing = [name for name in required if name not in columns]
+    if missing:
+        raise ImportFormatError(f"缺少列: {', '.join(missing)}")
+
+    for row_number, row in enumerate(rows, start=2):
+        if not any(_cell_text(value) for value in row):
+            continue
+        yield row_number, {
+            name: _cell_text(row[index]) if index < len(row) else ''
+            for name, index in columns.items()
+        }
+
+
+def validate_record(record):
+    """校验一行，返回错误列表"""
+    errors = []
+    for name in IMPORT_FIELDS:
+        value = record[name]
+        if not value:
+            errors.append(f'{name} 不能为空')
+        elif len(value) > MAX_FIELD_LENGTHS[name]:
+            errors.append(f'{name} 超过 {MAX_FIELD_LENGTHS[name]} 个字符')
+        elif name in ALLOWED_VALUES and value not in ALLOWED_VALUES[name]:
+            errors.append(f"{name} 只能是 {'/'.join(ALLOWED_VALUES[name])}")
+    return errors
+
+
+def upsert_products(records):
+    """
+    在当前事务中按 SKU upsert 一批已校验的产品（SKU 在批内不重复），返回 (插入数, 更新数)。
+    """
+    if not records:
+        return 0, 0
+    skus = [record['sku'] for record in records]
+    existing = {sku for (sku,) in db.session.query(Product.sku).filter(Product.sku.in_(skus))}
+
+    stmt = sqlite_insert(Product)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['sku'],
+        set_={name: stmt.excluded[name] for name in IMPORT_FIELDS if name != 'sku'}
+    ).returning(Product.id, sort_by_parameter_order=True)
+    product_ids = db.session.execute(stmt, records).scalars().all()
+
+    # Core 批量写入不触发 ORM 事件，直接用导入的字段值更新全文索引
+    search_index.index_records('products', [
+        dict(record, id=product_id) for record, product_id in zip(records, product_ids)
+    ])
+    updated = sum(1 for sku in skus if sku in existing)
+    return len(records) - updated, updated
+
+
+def import_products(fileobj, filename, chunk_size=IMPORT_CHUNK_SIZE, dry_run=False, on_chunk=None,
+                    on_error=None):
+    """
+    导入产品文件，返回 ImportReport。
+    每 chunk_size 行校验并提交一次；dry_run 时只校验不写入。
+    on_chunk: 每批提交后以 ImportReport 调用（用于汇报进度）
+    on_error: 每个失败行以错误明细调用（报告只保留前 MAX_REPORTED_ERRORS 行，需要全部错误时用它逐行输出）
+    文件格式错误时抛出 ImportFormatError。
+    """
+    report = ImportReport(dry_run=dry_run)
+    seen_rows = {}  # SKU -> 首次出现的行号，用于发现文件内重复
+    chunk = []
+
+    def flush():
+        if chunk and not dry_run:
+            inserted, updated = upsert_products(chunk)
+            # 缓存版本与本批数据在同一事务中提交，中途出错时已提交的批次也已使缓存失效
+            invalidate_product_caches()
+            db.session.commit()
+            report.inserted += inserted
+            report.updated += updated
+        chunk.clear()
+        if on_chunk:
+            on_chunk(report)
+
+    for row_number, record in iter_records(fileobj, filename):
+        report.total += 1
+        errors = validate_record(record)
+        first_row = seen_rows.get(record['sku'])
+        if first_row is not None:
+            errors.append(f"SKU 与第 {first_row} 行重复")
+        elif record['sku']:
+            seen_rows[record['sku']] = row_number
+
+        if errors:
+            error = {'row': row_number, 'sku': record['sku'] or None, 'errors': errors}
+            report.add_error(error)
+            if on_error:
+                on_error(error)
+            continue
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            flush()
+    flush()
+    return report
+
+
+@job_handler('product_import')
+def run_product_import(context, params):
+    """产品导入任务：params 为 path（jobs.save_upload 保存的文件）、filename、dry_run"""
+    try:
+        with open(params['path'], 'rb') as fileobj:
+            report = import_products(fileobj, params['filename'], dry_run=params.get('dry_run', False),
+                                     on_chunk=lambda report: context.progress(report.total))
+    finally:
+        os.remove(params['path'])
+    return report.to_dict(max_errors=MAX_REPORTED_ERRORS)
@@ -0,0 +1,213 @@
+"""
+多城市工费对比
+
+工时只取决于部件尺寸和工艺参数，与城市无关：先把 BOM 按工艺路线展开为 (BOM行, 工艺) 的工序，
+按工艺路径分组向量化计算全部工时，再汇总为 部件 × 工艺 的工时矩阵，
+与各城市工价向量做一次外积即得到 部件 × 工艺 × 城市 的工费矩阵，城市数不增加工时计算量。
+
+BOM 和工艺路线既可以是 DataFrame，也可以是 {列名: 列表} 的字典（不依赖 pandas）：
+BOM 需包含 Component, a, b, c, d 列；工艺路线需包含 Component, Process Path 列（可选 Process Parameters 列）。
+工艺路线默认按部件名挂到 BOM 中所有同名的行；带 Row 列（BOM 行号，从 0 开始，与结果中的 row 一致）时
+只挂到该行，同名部件的不同行可以有各自的工艺。
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from process_formulas import PROCESS_FORMULAS, get_formula
+
+BOM_COLUMNS = ('Component', 'a', 'b', 'c', 'd')
+ROUTING_COLUMNS = ('Component', 'Process Path')
+OPTIONAL_ROUTING_COLUMNS = ('Process Parameters', 'Row')
+
+# 上传文件的表头别名（不区分大小写，与桌面端导出的表头一致）
+BOM_ALIASES = {
+    'component': 'Component', '部件': 'Component',
+    'a': 'a', 'b': 'b', 'c': 'c', 'd': 'd',
+}
+ROUTING_ALIASES = {
+    'component': 'Component', '部件': 'Component',
+    'process path': 'Process Path', '工艺路径': 'Process Path',
+    'process parameters': 'Process Parameters', '工艺参数': 'Process Parameters',
+    'row': 'Row', '行号': 'Row',
+}
+
+
+def _column(table, name, dtype=None):
+    values = table[name]
+    if dtype is not None:
+        # 空单元格按缺失处理，非数字的文本报错
+        values = [np.nan if value in (None, '') else value for value in values]
+    try:
+        values = np.asarray(values, dtype=dtype)
+    except (TypeError, ValueError):
+        raise ValueError(f'列 {name} 含有非数字的值')
+    if values.ndim != 1:
+        raise ValueError(f'列 {name} 应为一维数据')
+    return values
+
+
+def table_from_records(records):
+    """把 [{列名: 值}, ...] 转为 {列名: 列表}（任一行出现过的列都保留，缺少的值为 None）"""
+    names = {}
+    for record in records:
+        names.update(dict.fromkeys(record))
+    return {name: [record.get(name) for record in records] for name in names}
+
+
+def _check_columns(table, required, name):
+    missing = [col for col in required if col not in table]
+    if missing:
+        raise ValueError(f"{name}缺少列: {', '.join(missing)}")
+
+
+def expand_steps(bom_components, routing_components):
+    """
+    按部件名（或 BOM 行号）把 BOM 行展开为工序，返回 (BOM行号, 工艺路线行号) 两个等长数组。
+    同一部件的工序按工艺路线中的出现顺序排列；工艺路线中没有的部件不产生工序。
+    """
+    names, codes = np.unique(np.concatenate([bom_components, routing_components]), return_inverse=True)
+    bom_codes = codes[:len(bom_components)]
+    routing_codes = codes[len(bom_components):]
+
+    order = np.argsort(routing_codes, kind='stable')
+    counts = np.bincount(routing_codes, minlength=len(names))
+    starts = np.cumsum(counts) - counts
+
+    steps_per_row = counts[bom_codes]
+    rows = np.repeat(np.arange(len(bom_components)), steps_per_row)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(steps_per_row) - steps_per_row, steps_per_row)
+    return rows, order[starts[bom_codes][rows] + offsets]
+
+
+@dataclass
+class CityComparison:
+    """对比结果：times 为 部件 × 工艺 的工时矩阵（秒），rates 为各城市工价（元/秒）"""
+    components: list
+    processes: list
+    cities: list
+    times: np.ndarray
+    rates: np.ndarray
+
+    @property
+    def costs(self):
+        """部件 × 工艺 × 城市 的工费矩阵"""
+        return self.times[:, :, None] * self.rates
+
+    @property
+    def component_costs(self):
+        """部件 × 城市"""
+        return np.outer(self.times.sum(axis=1), self.rates)
+
+    @property
+    def process_costs(self):
+        """工艺 × 城市"""
+        return np.outer(self.times.sum(axis=0), self.rates)
+
+    @property
+    def totals(self):
+        """各城市的 BOM 总工费"""
+        return self.times.sum() * self.rates
+
+    def to_dict(self, detail=False):
+        """城市按总工费升序；detail=True 时附带各部件在每个城市的工费"""
+        totals = self.totals
+        ranking = np.argsort(totals, kind='stable')
+        cities = [self.cities[index] for index in ranking]
+        process_costs = self.process_costs[:, ranking]
+        result = {
+            'cities': cities,
+            'rates': {city: float(self.rates[index]) for city, index in zip(cities, ranking)},
+            'total_time': float(self.times.sum()),
+            'totals': {city: float(totals[index]) for city, index in zip(cities, ranking)},
+            'cheapest': cities[0] if cities else None,
+            'processes': [
+                {'process_path': path, 'time': float(time),
+                 'costs': dict(zip(cities, costs.tolist()))}
+                for path, time, costs in zip(self.processes, self.times.sum(axis=0), process_costs)
+            ]
+        }
+        if detail:
+            component_costs = self.component_costs[:, ranking]
+            result['components'] = [
+                {'row': row, 'component': component, 'time': float(time), 'costs': costs}
+                for row, (component, time, costs) in enumerate(
+                    zip(self.components, self.times.sum(axis=1), component_costs.tolist())
+                )
+            ]
+        return result
+
+
+def compare_cities(bom, routing, rates, cities=None, formulas=None):
+    """
+    计算 BOM 在多个城市的工费（不访问数据库）。
+    rates: {城市: 元/秒}；cities: 参与对比的城市，默认 rates 中的全部城市
+    返回 CityComparison
+    """
+    formulas = PROCESS_FORMULAS if formulas is None else formulas
+    _check_columns(bom, BOM_COLUMNS, 'BOM表')
+    _check_columns(routing, ROUTING_COLUMNS, '工艺路线表')
+
+    cities = list(rates) if cities is None else list(cities)
+    unknown_cities = [city for city in cities if city not in rates]
+    if unknown_cities:
+        raise ValueError(f"以下城市没有工价: {', '.join(map(str, unknown_cities))}")
+
+    components = _column(bom, 'Component').astype(str)
+    sizes = {name: _column(bom, name, float) for name in 'abcd'}
+    for name, values in sizes.items():
+        missing = np.flatnonzero(np.isnan(values))
+        if len(missing):
+            raise ValueError(f'BOM表第 {missing[0] + 1} 行缺少 {name}')
+    routing_components = _column(routing, 'Component').astype(str)
+    paths = _column(routing, 'Process Path').astype(str)
+    if 'Process Parameters' in routing:
+        parameters = np.nan_to_num(_column(routing, 'Process Parameters', float))
+    else:
+        parameters = np.zeros(len(paths))
+
+    processes = sorted(set(paths.tolist()))
+    unknown_paths = [path for path in processes if path not in formulas]
+    if unknown_paths:
+        raise ValueError(f"以下工艺路径没有配置工时公式: {', '.join(unknown_paths)}")
+
+    if 'Row' in routing:
+        # 按 BOM 行号挂接工序，部件名须与该行一致
+        routing_rows = _column(routing, 'Row', float)
+        invalid = np.flatnonzero(~((routing_rows >= 0) & (routing_rows < len(components))
+                                   & (routing_rows % 1 == 0)))
+        if len(invalid):
+            raise ValueError(f'工艺路线表第 {invalid[0] + 1} 行的 Row 不是有效的BOM行号')
+        routing_rows = routing_rows.astype(int)
+        mismatched = np.flatnonzero(components[routing_rows] != routing_components)
+        if len(mismatched):
+            index = mismatched[0]
+            raise ValueError(f'工艺路线表第 {index + 1} 行的部件 {routing_components[index]} '
+                             f'与BOM表第 {routing_rows[index] + 1} 行（{components[routing_rows[index]]}）不一致')
+        rows, routes = expand_steps(np.arange(len(components)), routing_rows)
+    else:
+        rows, routes = expand_steps(components, routing_components)
+
+    # 全部工序的工时：每种工艺路径一次向量化求值
+    path_codes = np.searchsorted(processes, paths)[routes]
+    times = np.zeros(len(rows))
+    for code, path in enumerate(processes):
+        index = np.flatnonzero(path_codes == code)
+        if len(index):
+            step_rows = rows[index]
+            times[index] = get_formula(path, formulas).evaluate(
+                a=sizes['a'][step_rows], b=sizes['b'][step_rows], c=sizes['c'][step_rows],
+                d=sizes['d'][step_rows], parameters=parameters[routes[index]]
+            )
+
+    # 部件 × 工艺 工时矩阵（同一部件多次经过同一工艺时累加）
+    matrix = np.bincount(rows * len(processes) + path_codes, weights=times,
+                         minlength=len(components) * len(processes))
+    return CityComparison(
+        components=components.tolist(),
+        processes=processes,
+        cities=cities,
+        times=matrix.reshape(len(components), len(processes)),
+        rates=np.array([rates[city] for city in cities], dtype=float)
+    )
@@ -20,6 +20,10 @@ class Config:
     CACHE_TYPE = 'simple'
     CACHE_DEFAULT_TIMEOUT = 300
 
+    # 后台任务配置
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS') or 2)  # 任务线程数
+    JOB_RESULT_FOLDER = None  # 结果文件目录，默认 instance/job_results
+
 
 class DevelopmentConfig(Config):
     """开发环境配置"""
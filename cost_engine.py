@@ -0,0 +1,477 @@
+"""
+工艺流程成本计算引擎
+
+把成本计算拆成「批量加载」和「纯计算」两部分：模板、节点和材料按 ID 集合一次性加载，
+计算函数只处理已加载的对象，单次计算与批量计算共用同一套逻辑。
+"""
+
+import threading
+from collections import OrderedDict, defaultdict, namedtuple
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import insert
+
+from models import (
+    db, WorkflowTemplate, WorkflowNode, NodeConnection, Material, CostCalculation, MaterialUsage
+)
+from workflow_graph import WorkflowGraph, WorkflowGraphError
+from cost_rollup import update_daily_rollup
+import material_prices
+
+DEFAULT_OVERHEAD_RATE = 0.15  # 默认间接成本比例 15%
+DEFAULT_PLAN_CACHE_SIZE = 256  # 成本计划缓存的模板版本数
+MAX_CURVE_POINTS = 100000  # 数量-成本曲线单次请求的最大数量点数
+
+_SCHEDULE_TIME_FIELDS = ('duration_minutes', 'earliest_start', 'earliest_finish',
+                         'latest_start', 'latest_finish', 'slack_minutes')
+
+# 成本计划保存的节点快照。计划跨请求缓存，不能持有 ORM 对象（会话结束后访问属性会抛出 DetachedInstanceError）
+PlanNode = namedtuple('PlanNode', [
+    'id', 'node_id', 'name', 'node_type', 'estimated_time_minutes', 'labor_cost_per_hour',
+    'machine_cost_per_hour', 'setup_time_minutes', 'time_min_minutes', 'time_max_minutes'
+])
+
+
+def snapshot_node(node):
+    """把 WorkflowNode 复制为 PlanNode"""
+    return PlanNode(*(getattr(node, field) for field in PlanNode._fields))
+
+
+class CostPlan:
+    """
+    模板某一版本的单位成本计划。
+    只包含开始→结束路径上的节点，保存每个节点的单位人工/设备成本、成本分解骨架
+    和单件关键路径排程，计算时只需乘以数量。
+    节点的准备时间（setup_time_minutes）每批只计一次，成本 = 准备成本 + 单位成本 × 数量。
+    """
+
+    def __init__(self, template_id, updated_at, nodes, edges=()):
+        self.template_id = template_id
+        self.updated_at = updated_at
+        self.error = None
+        nodes = [snapshot_node(node) for node in nodes]
+        try:
+            graph = WorkflowGraph(nodes, edges)
+        except WorkflowGraphError as e:
+            self.error = str(e)
+            nodes = []
+            graph = WorkflowGraph(nodes, ())
+
+        active = graph.active_nodes()
+        self.skeleton = tuple((node.node_id, node.name, node.estimated_time_minutes) for node in active)
+        self.unit_labor = tuple((node.estimated_time_minutes / 60) * node.labor_cost_per_hour for node in active)
+        self.unit_machine = tuple((node.estimated_time_minutes / 60) * node.machine_cost_per_hour for node in active)
+        self.setup_times = tuple(node.setup_time_minutes or 0 for node in active)
+        self.setup_labor = tuple(
+            (setup / 60) * (node.labor_cost_per_hour or 0) for setup, node in zip(self.setup_times, active)
+        )
+        self.setup_machine = tuple(
+            (setup / 60) * (node.machine_cost_per_hour or 0) for setup, node in zip(self.setup_times, active)
+        )
+        # 成本风险模拟用：各节点的加工时间范围和每小时人工+设备费率
+        self.time_ranges = tuple((node.time_min_minutes, node.time_max_minutes) for node in active)
+        self.hourly_rates = tuple(
+            (node.labor_cost_per_hour or 0) + (node.machine_cost_per_hour or 0) for node in active
+        )
+        self.unreachable = [node.node_id for node in graph.unreachable_nodes()]
+        self.unit_schedule = graph.schedule({node.id: node.estimated_time_minutes for node in active})
+        # 有准备时间时各节点工时不再与数量成正比，排程需按数量重新计算（图中只有节点快照）
+        self._graph = graph
+        self._durations = tuple(
+            (node.id, setup, node.estimated_time_minutes or 0) for setup, node in zip(self.setup_times, active)
+        ) if any(self.setup_times) else ()
+
+    def check(self):
+        """流程图不合法时抛出 WorkflowGraphError"""
+        if self.error:
+            raise WorkflowGraphError(self.error)
+
+    def schedule(self, quantity, include_nodes=True):
+        """按数量放大单件排程（各工序按批次串行加工，时间与数量成正比，另加一次准备时间）"""
+        if self._durations:
+            result = self._graph.schedule({
+                node_id: setup + unit_time * quantity for node_id, setup, unit_time in self._durations
+            })
+            result['unreachable_nodes'] = list(self.unreachable)
+            if not include_nodes:
+                del result['nodes']
+            return result
+
+        unit = self.unit_schedule
+        result = {
+            'lead_time_minutes': unit['lead_time_minutes'] * quantity,
+            'critical_path': list(unit['critical_path']),
+            'unreachable_nodes': list(self.unreachable)
+        }
+        if include_nodes:
+            result['nodes'] = [
+                dict(item, **{key: item[key] * quantity for key in _SCHEDULE_TIME_FIELDS})
+                for item in unit['nodes']
+            ]
+        return result
+
+    def node_costs(self, quantity):
+        """按数量放大单位成本（加上准备成本），返回 (人工成本, 设备成本, 节点明细)"""
+        labor_cost = 0
+        machine_cost = 0
+        node_items = []
+
+        for (node_id, name, time_minutes), setup_time, unit_labor, unit_machine, setup_labor, setup_machine in zip(
+                self.skeleton, self.setup_times, self.unit_labor, self.unit_machine,
+                self.setup_labor, self.setup_machine):
+            node_labor_cost = setup_labor + unit_labor * quantity
+            node_machine_cost = setup_machine + unit_machine * quantity
+
+            labor_cost += node_labor_cost
+            machine_cost += node_machine_cost
+
+            node_items.append({
+                'node_id': node_id,
+                'name': name,
+                'time_minutes': time_minutes,
+                'setup_time_minutes': setup_time,
+                'labor_cost': node_labor_cost,
+                'machine_cost': node_machine_cost,
+                'total_cost': node_labor_cost + node_machine_cost
+            })
+
+        return labor_cost, machine_cost, node_items
+
+
+class CostPlanCache:
+    """进程内成本计划 LRU 缓存，键为 (模板ID, updated_at)"""
+
+    def __init__(self, maxsize=DEFAULT_PLAN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_plans(self, templates):
+        """
+        获取一组模板的成本计划，返回 {模板ID: CostPlan}。
+        未命中的模板用一条查询加载全部节点后再构建。
+        """
+        plans = {}
+        missing = []
+        with self._lock:
+            for template in templates:
+                key = (template.id, template.updated_at)
+                plan = self._plans.get(key)
+                if plan is None:
+                    self.misses += 1
+                    missing.append(template)
+                else:
+                    self.hits += 1
+                    self._plans.move_to_end(key)
+                    plans[template.id] = plan
+
+        if missing:
+            missing_ids = [template.id for template in missing]
+            nodes_by_template = defaultdict(list)
+            nodes = (
+                WorkflowNode.query
+                .filter(WorkflowNode.workflow_id.in_(missing_ids))
+                .order_by(WorkflowNode.id)
+                .all()
+            )
+            for node in nodes:
+                nodes_by_template[node.workflow_id].append(node)
+
+            edges_by_template = defaultdict(list)
+            edges = db.session.query(
+                NodeConnection.workflow_id, NodeConnection.source_node_id, NodeConnection.target_node_id
+            ).filter(NodeConnection.workflow_id.in_(missing_ids)).order_by(NodeConnection.id)
+            for workflow_id, source_id, target_id in edges:
+                edges_by_template[workflow_id].append((source_id, target_id))
+
+            with self._lock:
+                for template in missing:
+                    plan = CostPlan(template.id, template.updated_at,
+                                    nodes_by_template[template.id], edges_by_template[template.id])
+                    plans[template.id] = plan
+                    self._plans[(template.id, template.updated_at)] = plan
+                while len(self._plans) > self.maxsize:
+                    self._plans.popitem(last=False)
+                    self.evictions += 1
+
+        return plans
+
+    def get_plan(self, template):
+        """获取单个模板的成本计划"""
+        return self.get_plans([template])[template.id]
+
+    def invalidate(self, template_id=None):
+        """清除某个模板的全部版本，不指定则清空缓存"""
+        with self._lock:
+            if template_id is None:
+                self._plans.clear()
+                return
+            for key in [key for key in self._plans if key[0] == template_id]:
+                del self._plans[key]
+
+    def stats(self):
+        """缓存命中统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._plans),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0
+            }
+
+
+cost_plan_cache = CostPlanCache()
+
+
+def load_templates(template_ids):
+    """按ID集合加载工艺流程模板（不含节点，节点由成本计划缓存按需加载），返回 {id: template}"""
+    template_ids = set(template_ids)
+    if not template_ids:
+        return {}
+    templates = WorkflowTemplate.query.filter(WorkflowTemplate.id.in_(template_ids)).all()
+    return {template.id: template for template in templates}
+
+
+def load_materials(material_ids):
+    """按ID集合用一条 IN 查询加载材料，返回 {id: material}"""
+    material_ids = set(material_ids)
+    if not material_ids:
+        return {}
+    materials = Material.query.filter(Material.id.in_(material_ids)).all()
+    return {material.id: material for material in materials}
+
+
+def referenced_material_ids(materials_data):
+    """提取请求中引用的材料ID"""
+    return {item['material_id'] for item in materials_data or []}
+
+
+def load_prices(material_ids, price_date=None):
+    """按日期取材料历史价格，返回 {id: 单价}；未指定日期时返回 None（使用材料当前单价）"""
+    if price_date is None:
+        return None
+    return material_prices.prices_as_of(material_ids, price_date)
+
+
+def compute_material_lines(materials_data, materials, prices=None):
+    """
+    计算材料明细，未找到的材料跳过；明细同时用于成本分解和用量记录。
+    prices: {material_id: 单价}，缺少的材料使用当前单价
+    """
+    material_cost = 0
+    lines = []
+
+    for material_data in materials_data or []:
+        material = materials.get(material_data['material_id'])
+        if material:
+            planned_qty = material_data['quantity']
+            waste_qty = planned_qty * material.waste_rate
+            total_qty = planned_qty + waste_qty
+            unit_price = prices.get(material.id, material.unit_price) if prices else material.unit_price
+            cost = total_qty * unit_price
+
+            material_cost += cost
+
+            lines.append({
+                'material_id': material.id,
+                'name': material.name,
+                'planned_quantity': planned_qty,
+                'waste_quantity': waste_qty,
+                'total_quantity': total_qty,
+                'unit_price': unit_price,
+                'total_cost': cost
+            })
+
+    return material_cost, lines
+
+
+def compute_cost(plan, quantity, materials_data, materials, overhead_rate=DEFAULT_OVERHEAD_RATE,
+                 prices=None):
+    """
+    按成本计划计算一次工艺流程成本（不访问数据库）。
+    prices: 按日期取得的材料单价（见 load_prices），为 None 时使用材料当前单价
+    返回 dict: material_cost/labor_cost/machine_cost/overhead_cost/total_cost 及 cost_breakdown
+    """
+    plan.check()
+    labor_cost, machine_cost, node_items = plan.node_costs(quantity)
+    material_cost, material_lines = compute_material_lines(materials_data, materials, prices)
+
+    # 计算间接成本（按总成本的一定比例）
+    overhead_cost = (material_cost + labor_cost + machine_cost) * overhead_rate
+    total_cost = material_cost + labor_cost + machine_cost + overhead_cost
+
+    cost_breakdown = {
+        'nodes': node_items,
+        'materials': material_lines,
+        'summary': {
+            'material_cost': material_cost,
+            'labor_cost': labor_cost,
+            'machine_cost': machine_cost,
+            'overhead_cost': overhead_cost,
+            'total_cost': total_cost,
+            'unit_cost': total_cost / quantity if quantity > 0 else 0,
+            'quantity': quantity,
+            'overhead_rate': overhead_rate
+        },
+        'schedule': plan.schedule(quantity, include_nodes=False)
+    }
+
+    return {
+        'material_cost': material_cost,
+        'labor_cost': labor_cost,
+        'machine_cost': machine_cost,
+        'overhead_cost': overhead_cost,
+        'total_cost': total_cost,
+        'cost_breakdown': cost_breakdown
+    }
+
+
+def curve_quantities(quantities=None, start=None, stop=None, step=None, num=None, log=False):
+    """
+    数量-成本曲线的数量点（升序去重），返回 NumPy 数组。
+    quantities: 数量列表；或按 start/stop 生成区间（含 stop），step 为等差步长，
+    num 为点数（log=True 时按等比分布，便于覆盖 1~10000 这类跨数量级的区间）
+    """
+    if quantities is not None:
+        try:
+            points = np.asarray(quantities, dtype=float)
+        except (TypeError, ValueError):
+            raise ValueError('quantities 应为数字列表')
+    elif start is None or stop is None:
+        raise ValueError('请提供 quantities 列表或 start/stop 区间')
+    else:
+        start, stop = float(start), float(stop)
+        if start <= 0 or stop < start:
+            raise ValueError('数量区间应满足 0 < start ≤ stop')
+        if num is not None:
+            num = int(num)
+            if not 1 <= num <= MAX_CURVE_POINTS:
+                raise ValueError(f'num 应在 1 到 {MAX_CURVE_POINTS} 之间')
+            points = np.geomspace(start, stop, num) if log else np.linspace(start, stop, num)
+        else:
+            step = float(step or 1)
+            if step <= 0:
+                raise ValueError('step 必须大于 0')
+            count = int((stop - start) / step + 1e-9) + 1
+            if count > MAX_CURVE_POINTS:
+                raise ValueError(f'数量点数不能超过 {MAX_CURVE_POINTS}')
+            points = start + step * np.arange(count)
+
+    if points.ndim != 1 or not len(points):
+        raise ValueError('quantities 不能为空')
+    if len(points) > MAX_CURVE_POINTS:
+        raise ValueError(f'数量点数不能超过 {MAX_CURVE_POINTS}')
+    if not np.all(np.isfinite(points)) or np.any(points <= 0):
+        raise ValueError('数量必须大于 0')
+    return np.unique(points)
+
+
+def compute_cost_curve(plan, quantities, materials_data, materials, overhead_rate=DEFAULT_OVERHEAD_RATE,
+                       prices=None):
+    """
+    计算数量-成本曲线（不访问数据库，不保存）。
+    与 compute_cost 不同，materials_data 中的 quantity 为单件用量，按数量放大。
+    各成本项都是 准备成本 + 单位成本 × 数量 的线性函数，先汇总出两个系数，再对全部数量点做一次数组运算。
+    返回 dict: 各成本项与单位成本的数组（列表），以及节点、材料的固定/单位成本明细
+    """
+    plan.check()
+    quantities = np.asarray(quantities, dtype=float)
+    unit_material_cost, material_lines = compute_material_lines(materials_data, materials, prices)
+
+    labor_cost = sum(plan.setup_labor) + sum(plan.unit_labor) * quantities
+    machine_cost = sum(plan.setup_machine) + sum(plan.unit_machine) * quantities
+    material_cost = unit_material_cost * quantities
+    overhead_cost = (material_cost + labor_cost + machine_cost) * overhead_rate
+    total_cost = material_cost + labor_cost + machine_cost + overhead_cost
+    setup_cost = (sum(plan.setup_labor) + sum(plan.setup_machine)) * (1 + overhead_rate)
+
+    return {
+        'quantities': quantities.tolist(),
+        'material_cost': material_cost.tolist(),
+        'labor_cost': labor_cost.tolist(),
+        'machine_cost': machine_cost.tolist(),
+        'overhead_cost': overhead_cost.tolist(),
+        'total_cost': total_cost.tolist(),
+        'unit_cost': (total_cost / quantities).tolist(),
+        'summary': {
+            # 含间接成本：setup_cost 为每批固定成本，marginal_unit_cost 为每多做一件增加的成本
+            'setup_cost': setup_cost,
+            'marginal_unit_cost': (
+                unit_material_cost + sum(plan.unit_labor) + sum(plan.unit_machine)
+            ) * (1 + overhead_rate),
+            'overhead_rate': overhead_rate,
+            'points': len(quantities)
+        },
+        'nodes': [
+            {
+                'node_id': node_id,
+                'name': name,
+                'setup_time_minutes': setup_time,
+                'time_minutes': time_minutes,
+                'setup_cost': setup_labor + setup_machine,
+                'unit_cost': unit_labor + unit_machine
+            }
+            for (node_id, name, time_minutes), setup_time, unit_labor, unit_machine, setup_labor, setup_machine
+            in zip(plan.skeleton, plan.setup_times, plan.unit_labor, plan.unit_machine,
+                   plan.setup_labor, plan.setup_machine)
+        ],
+        'materials': material_lines
+    }
+
+
+def build_calculation(result, workflow_id, quantity, product_sku=None, calculation_date=None):
+    """根据计算结果创建 CostCalculation 对象（未加入会话），计算时间显式赋值以便同步写入日汇总"""
+    return CostCalculation(
+        workflow_id=workflow_id,
+        product_sku=product_sku,
+        quantity=quantity,
+        calculation_date=calculation_date or datetime.utcnow(),
+        material_cost=result['material_cost'],
+        labor_cost=result['labor_cost'],
+        machine_cost=result['machine_cost'],
+        overhead_cost=result['overhead_cost'],
+        total_cost=result['total_cost'],
+        cost_breakdown=result['cost_breakdown']
+    )
+
+
+def usage_rows(calculation_id, material_lines):
+    """把材料明细转换为 MaterialUsage 批量插入参数"""
+    return [
+        {
+            'cost_calculation_id': calculation_id,
+            'material_id': line['material_id'],
+            'planned_quantity': line['planned_quantity'],
+            'waste_quantity': line['waste_quantity'],
+            'unit_cost': line['unit_price'],
+            'total_cost': line['total_cost']
+        }
+        for line in material_lines
+    ]
+
+
+def save_calculations(pairs):
+    """
+    在当前事务中保存成本计算及材料用量，并累加成本日汇总。
+    pairs: [(CostCalculation, material_lines), ...]
+    先批量插入计算记录取得ID，再用一条 executemany 插入全部用量记录。
+    """
+    if not pairs:
+        return
+    db.session.add_all([calculation for calculation, _ in pairs])
+    db.session.flush()
+
+    rows = []
+    for calculation, material_lines in pairs:
+        rows.extend(usage_rows(calculation.id, material_lines))
+    if rows:
+        db.session.execute(insert(MaterialUsage), rows)
+
+    update_daily_rollup([calculation for calculation, _ in pairs])
@@ -0,0 +1,123 @@
+"""
+成本日汇总
+
+成本计算保存时在同一事务中把金额累加到 (日期, SKU, 工艺流程) 汇总行，
+成本趋势只读汇总表，查询量与计算记录数无关；rebuild_daily_rollup 用于历史数据回填。
+被重算取代的记录不计入汇总（重算时先减去旧记录再累加新记录）。
+"""
+
+from collections import defaultdict
+
+from sqlalchemy import func, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, CostCalculation, CostDailyRollup
+
+ROLLUP_SUMS = ('quantity', 'material_cost', 'labor_cost', 'machine_cost', 'overhead_cost', 'total_cost')
+COST_FIELDS = ('material_cost', 'labor_cost', 'machine_cost', 'overhead_cost', 'total_cost')
+GRANULARITIES = ('day', 'week', 'month')
+
+
+def rollup_rows(calculations, sign=1):
+    """把一组成本计算按 (日期, SKU, 工艺流程) 合并为汇总增量，sign=-1 时为扣减"""
+    rows = {}
+    for calculation in calculations:
+        key = (calculation.calculation_date.date(), calculation.product_sku or '', calculation.workflow_id)
+        row = rows.get(key)
+        if row is None:
+            row = rows[key] = {
+                'day': key[0], 'product_sku': key[1], 'workflow_id': key[2], 'count': 0,
+                **{field: 0 for field in ROLLUP_SUMS}
+            }
+        row['count'] += sign
+        for field in ROLLUP_SUMS:
+            row[field] += sign * (getattr(calculation, field) or 0)
+    return list(rows.values())
+
+
+def update_daily_rollup(calculations, sign=1):
+    """在当前事务中累加汇总行（一条 executemany 的 INSERT ... ON CONFLICT DO UPDATE）"""
+    rows = rollup_rows(calculations, sign)
+    if not rows:
+        return
+    stmt = sqlite_insert(CostDailyRollup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['day', 'product_sku', 'workflow_id'],
+        set_={
+            field: getattr(CostDailyRollup, field) + getattr(stmt.excluded, field)
+            for field in ('count',) + ROLLUP_SUMS
+        }
+    )
+    db.session.execute(stmt, rows)
+
+
+def rebuild_daily_rollup():
+    """清空并按全部成本计算记录重建汇总表，返回汇总行数（调用方负责提交）"""
+    day = func.date(CostCalculation.calculation_date)
+    sku = func.coalesce(CostCalculation.product_sku, '')
+    source = db.session.query(
+        day, sku, CostCalculation.workflow_id, func.count(CostCalculation.id),
+        *[func.coalesce(func.sum(getattr(CostCalculation, field)), 0) for field in ROLLUP_SUMS]
+    ).filter(
+        CostCalculation.calculation_date.isnot(None),
+        CostCalculation.superseded_by_id.is_(None)
+    ).group_by(day, sku, CostCalculation.workflow_id)
+
+    db.session.query(CostDailyRollup).delete(synchronize_session=False)
+    db.session.execute(insert(CostDailyRollup).from_select(
+        ['day', 'product_sku', 'workflow_id', 'count', *ROLLUP_SUMS], source
+    ))
+    return db.session.query(func.count()).select_from(CostDailyRollup).scalar()
+
+
+def _bucket(granularity):
+    """汇总日期所属的周期：日 / 周（周一） / 月（1号）"""
+    if granularity == 'week':
+        return func.date(CostDailyRollup.day, 'weekday 0', '-6 days')
+    if granularity == 'month':
+        return func.date(CostDailyRollup.day, 'start of month')
+    return func.date(CostDailyRollup.day)
+
+
+def cost_trend(start_day, end_day, granularity='day', product_sku=None, workflow_id=None, by_sku=False):
+    """
+    从汇总表读取成本趋势。
+    granularity: day/week/month
+    by_sku: 为 True 时额外按 SKU 拆分出各自的序列
+    返回 (总体序列, {SKU: 序列})
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity 只能是 {'/'.join(GRANULARITIES)}")
+
+    bucket = _bucket(granularity).label('bucket')
+    keys = [bucket, CostDailyRollup.product_sku] if by_sku else [bucket]
+    query = db.session.query(
+        *keys,
+        func.sum(CostDailyRollup.count),
+        *[func.sum(getattr(CostDailyRollup, field)) for field in COST_FIELDS]
+    ).filter(CostDailyRollup.day >= start_day, CostDailyRollup.day <= end_day)
+    if product_sku:
+        query = query.filter(CostDailyRollup.product_sku == product_sku)
+    if workflow_id:
+        query = query.filter(CostDailyRollup.workflow_id == workflow_id)
+
+    overall = {}
+    series = defaultdict(list)
+    for row in query.group_by(*keys).order_by(*keys):
+        date_key = row[0]
+        sku = row[1] if by_sku else None
+        count, *costs = row[len(keys):]
+        point = {'date': date_key, 'count': count, **dict(zip(COST_FIELDS, costs))}
+
+        if by_sku:
+            series[sku or None].append(dict(point))
+            total = overall.setdefault(date_key, {'date': date_key, 'count': 0,
+                                                  **{field: 0 for field in COST_FIELDS}})
+            total['count'] += count
+            for field, value in zip(COST_FIELDS, costs):
+                total[field] += value
+        else:
+            overall[date_key] = point
+
+    return list(overall.values()), dict(series)
+
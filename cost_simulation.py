@@ -0,0 +1,133 @@
+"""
+成本风险模拟（蒙特卡洛）
+
+对每个节点的加工时间、每种材料的单价和损耗率按各自的分布抽样，一次生成全部场景的矩阵，
+用 NumPy 数组运算得到单位成本分布，不逐场景循环：
+- 节点加工时间：设置了 time_min_minutes/time_max_minutes 时按三角分布（最短, 预估, 最长）抽样
+- 材料单价、损耗率：设置了 price_std/waste_rate_std 时按正态分布抽样（截断为非负）
+未设置分布参数的因素按固定值计算；节点准备时间按数量分摊到单位成本。
+
+各因素的贡献按其成本与总成本的协方差占总方差的比例计算，全部因素之和为 1。
+"""
+
+import numpy as np
+
+DEFAULT_SCENARIOS = 100000
+MAX_SCENARIOS = 1000000
+DEFAULT_BINS = 50
+MAX_BINS = 500
+DEFAULT_PERCENTILES = (5, 10, 25, 50, 75, 90, 95)
+
+
+def sample_node_times(plan, rng, scenarios):
+    """节点加工时间矩阵（场景 × 节点，分钟）"""
+    modes = np.array([time_minutes or 0 for _, _, time_minutes in plan.skeleton], dtype=float)
+    times = np.broadcast_to(modes, (scenarios, len(modes))).copy()
+    for index, (low, high) in enumerate(plan.time_ranges):
+        if low is None and high is None:
+            continue
+        mode = modes[index]
+        low = mode if low is None else low
+        high = mode if high is None else high
+        if not low <= mode <= high:
+            raise ValueError(f'节点 {plan.skeleton[index][1]} 的加工时间范围应满足 最短 ≤ 预估 ≤ 最长')
+        if low < high:
+            times[:, index] = rng.triangular(low, mode, high, scenarios)
+    return times
+
+
+def _normal(rng, mean, std, scenarios):
+    """按正态分布抽样并截断为非负；std 为 0 时返回常数列"""
+    if not std:
+        return np.full(scenarios, mean, dtype=float)
+    return np.maximum(rng.normal(mean, std, scenarios), 0)
+
+
+def material_drivers(materials_data, materials, prices=None):
+    """
+    把请求中的材料合并为模拟因素，返回 [(材料, 计划用量, 平均单价), ...]。
+    同一材料出现多次时用量相加；未找到的材料跳过（与 compute_material_lines 一致）。
+    """
+    quantities = {}
+    for item in materials_data or []:
+        material = materials.get(item['material_id'])
+        if material:
+            quantities[material.id] = quantities.get(material.id, 0) + item['quantity']
+    return [
+        (materials[material_id], quantity,
+         prices.get(material_id, materials[material_id].unit_price) if prices else materials[material_id].unit_price)
+        for material_id, quantity in quantities.items()
+    ]
+
+
+def simulate_cost(plan, quantity, materials_data, materials, overhead_rate, scenarios=DEFAULT_SCENARIOS,
+                  prices=None, seed=None, bins=DEFAULT_BINS, percentiles=DEFAULT_PERCENTILES):
+    """
+    模拟单位成本分布（不访问数据库）。
+    返回 dict: mean/std/percentiles/histogram/contributions（金额均为单位成本）
+    """
+    plan.check()
+    if quantity <= 0:
+        raise ValueError('quantity 必须大于 0')
+    if not 1 <= scenarios <= MAX_SCENARIOS:
+        raise ValueError(f'scenarios 应在 1 到 {MAX_SCENARIOS} 之间')
+    if not 1 <= bins <= MAX_BINS:
+        raise ValueError(f'bins 应在 1 到 {MAX_BINS} 之间')
+    if any(not 0 <= p <= 100 for p in percentiles):
+        raise ValueError('percentiles 应在 0 到 100 之间')
+
+    rng = np.random.default_rng(seed)
+
+    # 单位节点成本 = (加工时间 + 准备时间按数量分摊) × 每小时人工和设备费率
+    node_times = sample_node_times(plan, rng, scenarios) + np.array(plan.setup_times, dtype=float) / quantity
+    node_costs = node_times / 60 * np.array(plan.hourly_rates, dtype=float)
+
+    # 材料成本 = 计划用量 × (1 + 损耗率) × 单价
+    drivers = material_drivers(materials_data, materials, prices)
+    material_costs = np.empty((scenarios, len(drivers)))
+    for index, (material, planned_quantity, unit_price) in enumerate(drivers):
+        price = _normal(rng, unit_price, material.price_std, scenarios)
+        waste_rate = _normal(rng, material.waste_rate or 0, material.waste_rate_std, scenarios)
+        material_costs[:, index] = planned_quantity * (1 + waste_rate) * price
+    material_costs *= 1 / quantity  # 材料用量为整批用量，折算为单位成本
+
+    # 各因素的单位成本矩阵（场景 × 因素），间接成本按比例分摊到各因素
+    driver_costs = np.hstack([node_costs, material_costs]) * (1 + overhead_rate)
+    unit_costs = driver_costs.sum(axis=1)
+
+    counts, edges = np.histogram(unit_costs, bins=bins)
+    variance = unit_costs.var()
+    centered = unit_costs - unit_costs.mean()
+    covariance = (driver_costs - driver_costs.mean(axis=0)).T @ centered / scenarios
+
+    labels = [
+        {'type': 'node', 'id': node_id, 'name': name}
+        for node_id, name, _ in plan.skeleton
+    ] + [
+        {'type': 'material', 'id': material.id, 'name': material.name}
+        for material, _, _ in drivers
+    ]
+    contributions = [
+        dict(label, mean=float(mean), std=float(std),
+             variance_share=float(share / variance) if variance > 0 else 0.0)
+        for label, mean, std, share in zip(
+            labels, driver_costs.mean(axis=0), driver_costs.std(axis=0), covariance
+        )
+    ]
+    contributions.sort(key=lambda item: item['variance_share'], reverse=True)
+
+    return {
+        'scenarios': scenarios,
+        'quantity': quantity,
+        'overhead_rate': overhead_rate,
+        'mean': float(unit_costs.mean()),
+        'std': float(unit_costs.std()),
+        'min': float(unit_costs.min()),
+        'max': float(unit_costs.max()),
+        'percentiles': {
+            f'p{p:g}': float(value)
+            for p, value in zip(percentiles, np.percentile(unit_costs, percentiles))
+        },
+        'histogram': {'bin_edges': edges.tolist(), 'counts': counts.tolist()},
+        'contributions': contributions
+    }
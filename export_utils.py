@@ -1,26 +1,178 @@
+import csv
+import io
+import tempfile
+from datetime import datetime
+
 from openpyxl import Workbook
+from sqlalchemy import func, select
+
+from models import db, Product, Material, CostCalculation
+from jobs import job_handler
+
+# 可导出的数据及列定义: 实体 -> (模型, [(字段, 表头), ...])
+EXPORT_COLUMNS = {
+    'products': (Product, [
+        ('id', 'ID'),
+        ('series', '系列'),
+        ('spu', 'SPU'),
+        ('sku', 'SKU'),
+        ('file_control', '文件受控'),
+        ('standardization', '标准化落地'),
+    ]),
+    'materials': (Material, [
+        ('id', 'ID'),
+        ('code', '编码'),
+        ('name', '名称'),
+        ('category', '类别'),
+        ('thickness', '厚度(mm)'),
+        ('width', '宽度(mm)'),
+        ('length', '长度(mm)'),
+        ('unit_price', '单价'),
+        ('unit', '单位'),
+        ('supplier', '供应商'),
+        ('waste_rate', '损耗率'),
+        ('created_at', '创建时间'),
+    ]),
+    'cost_calculations': (CostCalculation, [
+        ('id', 'ID'),
+        ('workflow_id', '工艺流程ID'),
+        ('product_sku', '产品SKU'),
+        ('quantity', '数量'),
+        ('calculation_date', '计算时间'),
+        ('material_cost', '材料成本'),
+        ('labor_cost', '人工成本'),
+        ('machine_cost', '设备成本'),
+        ('overhead_cost', '间接成本'),
+        ('total_cost', '总成本'),
+    ]),
+}
+
+# 导出文件名前缀
+EXPORT_NAMES = {
+    'products': '产品数据',
+    'materials': '材料数据',
+    'cost_calculations': '成本计算记录',
+}
+
+EXPORT_MIMETYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+EXPORT_CHUNK_SIZE = 1000  # 每次从数据库取出的行数
+SPOOL_MAX_SIZE = 8 * 1024 * 1024  # 超过 8MB 的导出文件落盘
+# 同步导出 xlsx 的最大行数，超过时 /export 改为提交后台导出任务（xlsx 需整个写完才能发送）
+EXCEL_SYNC_MAX_ROWS = 50000
+
+
+def export_columns(entity, columns=None):
+    """
+    返回 (模型, [(字段, 表头), ...])。
+    columns: 需要导出的字段名列表，为空时导出全部列
+    """
+    if entity not in EXPORT_COLUMNS:
+        raise ValueError(f"不支持导出的数据类型: {entity}")
+    model, available = EXPORT_COLUMNS[entity]
+    if not columns:
+        return model, available
+
+    lookup = dict(available)
+    unknown = [name for name in columns if name not in lookup]
+    if unknown:
+        raise ValueError(f"未知的导出列: {', '.join(unknown)}")
+    return model, [(name, lookup[name]) for name in columns]
+
+
+def export_filename(entity, export_format):
+    """导出文件名：数据名称_时间戳.格式"""
+    return f"{EXPORT_NAMES[entity]}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+
+
+def iter_export_rows(model, columns, chunk_size=EXPORT_CHUNK_SIZE):
+    """按主键顺序分批流式读取指定列，不构造 ORM 对象"""
+    stmt = (
+        select(*[getattr(model, name) for name, _ in columns])
+        .order_by(model.id)
+        .execution_options(stream_results=True, yield_per=chunk_size)
+    )
+    for row in db.session.execute(stmt):
+        yield tuple(row)
+
+
+def write_excel(headers, rows, fileobj):
+    """以只写模式逐行写入 Excel，内存占用与行数无关"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(headers)
+    for row in rows:
+        ws.append(row)
+    wb.save(fileobj)
+
+
+def export_excel_file(headers, rows):
+    """
+    生成 Excel 到临时文件（小文件留在内存），返回已定位到开头的文件对象。
+    xlsx 是 zip 格式，整个文件写完才能发送第一个字节，行数较多时应走后台导出任务（见 EXCEL_SYNC_MAX_ROWS）。
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    write_excel(headers, rows, spooled)
+    spooled.seek(0)
+    return spooled
+
+
+def iter_csv(headers, rows, chunk_size=EXPORT_CHUNK_SIZE):
+    """逐块生成 CSV 字节流（带 BOM 便于 Excel 识别中文）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(headers)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(['' if value is None else value for value in row])
+        if count % chunk_size == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+@job_handler('export')
+def run_export(context, params):
+    """导出任务：params 为 entity、columns、format（xlsx/csv），结果文件通过任务下载接口获取"""
+    entity = params.get('entity', 'products')
+    export_format = params.get('format', 'xlsx')
+    if export_format not in EXPORT_MIMETYPES:
+        raise ValueError(f'不支持的导出格式: {export_format}')
+    model, selected = export_columns(entity, params.get('columns'))
+    context.progress(0, db.session.query(func.count(model.id)).scalar())
+
+    exported = 0
+
+    def rows():
+        nonlocal exported
+        for row in iter_export_rows(model, selected):
+            exported += 1
+            if exported % EXPORT_CHUNK_SIZE == 0:
+                context.progress(exported)
+            yield row
+
+    headers = [header for _, header in selected]
+    path = context.result_file(export_filename(entity, export_format), EXPORT_MIMETYPES[export_format])
+    with open(path, 'wb') as out:
+        if export_format == 'csv':
+            for chunk in iter_csv(headers, rows()):
+                out.write(chunk)
+        else:
+            write_excel(headers, rows(), out)
+    context.progress(exported)
+    return {'rows': exported}
+
 
 def export_to_excel(data, filename):
     """
     将数据导出为 Excel 文件。
     data: list of dict
-    filename: 导出的文件名
+    filename: 导出的文件名或文件对象
     """
-    wb = Workbook()
-    ws = wb.active
-    
-    if not data:
-        wb.save(filename)
-        return
-    
-    # 写入表头
-    headers = list(data[0].keys())
-    for col, header in enumerate(headers, 1):
-        ws.cell(row=1, column=col, value=header)
-    
-    # 写入数据
-    for row, item in enumerate(data, 2):
-        for col, header in enumerate(headers, 1):
-            ws.cell(row=row, column=col, value=item.get(header, ''))
-    
-    wb.save(filename)
\ No newline at end of file
+    headers = list(data[0].keys()) if data else []
+    rows = ([item.get(header, '') for header in headers] for item in data)
+    write_excel(headers, rows, filename)
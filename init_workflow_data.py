@@ -11,8 +11,10 @@ sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 from flask import Flask
 from models import (
     db, WorkflowTemplate, WorkflowNode, NodeConnection,
-    Material, ProcessTemplate, NodeType, ProcessStatus
+    Material, ProcessTemplate, NodeType, ProcessStatus, CityWageRate
 )
+import wage_rates
+import material_prices
 import json
 from datetime import datetime
 
@@ -443,6 +445,9 @@ def main():
         init_materials()
         init_process_templates()
         init_workflow_templates()
+        wage_rates.ensure_wage_rates()
+        db.session.flush()
+        material_prices.ensure_price_history()
         
         # 提交事务
         try:
@@ -460,6 +465,7 @@ def main():
         print(f"工艺流程数量: {WorkflowTemplate.query.count()}")
         print(f"工艺节点数量: {WorkflowNode.query.count()}")
         print(f"节点连接数量: {NodeConnection.query.count()}")
+        print(f"城市工价数量: {CityWageRate.query.count()}")
         
         return True
 
@@ -0,0 +1,443 @@
+"""
+后台任务
+
+批量成本计算、重算、导出和导入等耗时操作提交为任务，在进程内的线程池中执行，
+请求只写入一条任务记录就返回任务ID，响应时间与数据量无关。
+任务状态、进度、耗时和结果摘要保存在 jobs 表中，结果文件写到 instance/job_results 下，通过下载接口获取。
+
+处理函数用 @job_handler('类型') 注册，签名为 handler(context, params)，返回值保存为任务结果摘要。
+取消是协作式的：处理函数在每批之间调用 context.progress() / context.check_cancelled()，
+收到取消请求时抛出 JobCancelled，已提交的批次保留。
+@job_handler('类型', exclusive=True) 的任务在数据库中互斥：领取任务的条件更新要求没有同类任务在运行，
+判断和写入在同一条 UPDATE 中完成（SQLite 的写事务串行执行），因此多个进程、多个线程之间同类任务也只执行一个；
+领取不到时任务保持待执行并立即释放线程（不占用线程池），同类任务结束后由执行它的进程重新提交最早的待执行任务，
+其他进程中的同类任务结束时由心跳线程定期补交。
+
+线程池在应用收到第一个请求时启动（调试模式下重载器的父进程不会执行任务），启动时重新排队未开始的任务。
+运行中的任务记录执行进程（主机名:进程号），线程池定期为本进程的任务写心跳；
+执行进程已退出（同一主机上进程号不存在，或是本进程重启前的任务）或心跳超时的任务标记为失败，
+多个进程共用一个数据库时不会误判其他进程正在执行的任务。
+"""
+
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+from flask import Blueprint, current_app, jsonify, request, send_file
+from sqlalchemy import select, update
+from sqlalchemy.orm import aliased
+
+from models import db, Job
+
+DEFAULT_JOB_WORKERS = 2
+DEFAULT_LIST_LIMIT = 50
+MAX_LIST_LIMIT = 500
+CANCEL_CHECK_INTERVAL = 1.0  # 两次检查取消标记的最短间隔（秒）
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled')
+HEARTBEAT_INTERVAL = 30  # 运行中任务的心跳间隔（秒）
+HEARTBEAT_TIMEOUT = 120  # 心跳超过该时长未更新的运行中任务视为中断（秒）
+
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/api/jobs')
+
+# 任务类型 -> (处理函数, 是否互斥)；互斥的任务类型同一时间只执行一个（跨进程）
+_handlers = {}
+_runner_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    """任务已被取消"""
+
+
+def job_handler(kind, exclusive=False):
+    """注册任务处理函数；exclusive=True 时同类任务串行执行（由数据库中的领取条件保证）"""
+    def decorator(func):
+        _handlers[kind] = (func, exclusive)
+        return func
+    return decorator
+
+
+def _now():
+    return datetime.utcnow()
+
+
+def worker_id():
+    """当前进程的标识（主机名:进程号），fork 出的工作进程各不相同"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _process_exists(pid):
+    if os.name == 'nt':
+        return True  # Windows 上 os.kill(pid, 0) 会发送 CTRL_C_EVENT，只按心跳判断
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def result_folder(app=None):
+    """结果文件目录（JOB_RESULT_FOLDER，默认 instance/job_results）"""
+    app = app or current_app
+    folder = app.config.get('JOB_RESULT_FOLDER') or os.path.join(app.instance_path, 'job_results')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+class JobContext:
+    """传给处理函数的任务上下文：汇报进度、检查取消、登记结果文件"""
+
+    def __init__(self, job_id, folder):
+        self.job_id = job_id
+        self.folder = folder
+        self.result_path = None
+        self.result_filename = None
+        self.result_mimetype = None
+        self._checked_at = 0
+
+    def _write(self, **values):
+        # 单独的连接写入进度，不影响处理函数自身的事务；调用前应先提交本批数据
+        with db.engine.begin() as connection:
+            connection.execute(update(Job).where(Job.id == self.job_id).values(**values))
+
+    def progress(self, processed, total=None):
+        """更新进度，同时检查取消标记"""
+        values = {'processed': processed}
+        if total is not None:
+            values['total'] = total
+        self._write(**values)
+        self.check_cancelled(force=True)
+
+    def check_cancelled(self, force=False):
+        """收到取消请求时抛出 JobCancelled（默认每秒最多查询一次）"""
+        if not force and time.monotonic() - self._checked_at < CANCEL_CHECK_INTERVAL:
+            return
+        self._checked_at = time.monotonic()
+        with db.engine.connect() as connection:
+            cancelled = connection.execute(
+                select(Job.cancel_requested).where(Job.id == self.job_id)
+            ).scalar()
+        if cancelled:
+            raise JobCancelled()
+
+    def result_file(self, filename, mimetype):
+        """登记结果文件，返回写入路径；filename 为下载时的文件名"""
+        self.result_path = os.path.join(self.folder, f'{self.job_id}{os.path.splitext(filename)[1]}')
+        self.result_filename = filename
+        self.result_mimetype = mimetype
+        return self.result_path
+
+
+def _is_exclusive(kind):
+    return _handlers.get(kind, (None, False))[1]
+
+
+def _claim(job_id, kind, owner):
+    """
+    条件更新领取待执行的任务，返回是否领取成功。
+    互斥的任务类型另要求没有同类任务在运行，判断和写入在同一条语句中完成。
+    """
+    now = _now()
+    stmt = update(Job).where(Job.id == job_id, Job.status == 'pending')
+    if _is_exclusive(kind):
+        other = aliased(Job)
+        stmt = stmt.where(~select(other.id).where(other.kind == kind, other.status == 'running').exists())
+    claimed = db.session.execute(
+        stmt.values(status='running', started_at=now, owner=owner, heartbeat_at=now)
+    ).rowcount
+    db.session.commit()
+    return bool(claimed)
+
+
+def _run(runner, job_id):
+    """在线程池中执行一个任务"""
+    with runner.app.app_context():
+        # 已取消或已被领取的任务直接跳过（先登记，心跳线程不会把刚领取的任务判为中断）
+        runner.running.add(job_id)
+        kind = db.session.execute(select(Job.kind).where(Job.id == job_id)).scalar()
+        if not _claim(job_id, kind, runner.owner):
+            # 互斥任务在同类任务运行时保持待执行，不占用线程，同类任务结束后重新提交
+            runner.running.discard(job_id)
+            db.session.remove()
+            return
+
+        params = db.session.execute(select(Job.params).where(Job.id == job_id)).scalar() or {}
+        context = JobContext(job_id, result_folder(runner.app))
+        values = {}
+        try:
+            if kind not in _handlers:
+                raise LookupError(f'未知的任务类型: {kind}')
+            handler, _ = _handlers[kind]
+            values['result'] = handler(context, params)
+            values['status'] = 'completed'
+        except JobCancelled:
+            db.session.rollback()
+            values['status'] = 'cancelled'
+        except Exception as e:
+            db.session.rollback()
+            values.update(status='failed', error=str(e))
+        finally:
+            db.session.remove()
+
+        if values['status'] == 'completed' and context.result_path:
+            values.update(result_path=context.result_path, result_filename=context.result_filename,
+                          result_mimetype=context.result_mimetype)
+        elif context.result_path and os.path.exists(context.result_path):
+            os.remove(context.result_path)
+        context._write(finished_at=_now(), **values)
+        runner.running.discard(job_id)
+        if _is_exclusive(kind):
+            runner.submit_waiting([kind])
+
+
+class JobRunner:
+    """应用的任务线程池（附带一个心跳线程）"""
+
+    def __init__(self, app):
+        self.app = app
+        self.owner = worker_id()
+        self.running = set()  # 本进程正在执行的任务ID
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(app.config.get('JOB_WORKERS') or os.environ.get('JOB_WORKERS') or DEFAULT_JOB_WORKERS),
+            thread_name_prefix='job'
+        )
+        threading.Thread(target=self._heartbeat_loop, name='job-heartbeat', daemon=True).start()
+
+    def submit(self, job_id):
+        self.executor.submit(_run, self, job_id)
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            try:
+                with self.app.app_context():
+                    self.heartbeat()
+                    self.fail_interrupted()
+                    self.submit_waiting()
+            except Exception as e:
+                # 数据库暂时不可用时下一轮再试
+                self.app.logger.warning(f'任务心跳失败: {e}')
+
+    def heartbeat(self):
+        """更新本进程运行中任务的心跳时间"""
+        if not self.running:
+            return
+        with db.engine.begin() as connection:
+            connection.execute(
+                update(Job).where(Job.id.in_(list(self.running)), Job.status == 'running')
+                .values(heartbeat_at=_now())
+            )
+
+    def is_interrupted(self, owner, heartbeat_at, now):
+        """运行中的任务是否已中断：心跳超时，或执行进程在本机且已不存在（含本进程重启前领取的任务）"""
+        if heartbeat_at is None or now - heartbeat_at > timedelta(seconds=HEARTBEAT_TIMEOUT):
+            return True
+        host, _, pid = (owner or '').rpartition(':')
+        if host != socket.gethostname() or not pid.isdigit():
+            return False
+        if owner == self.owner:
+            return True
+        return not _process_exists(int(pid))
+
+    def fail_interrupted(self):
+        """把已中断的运行中任务标记为失败，返回任务数"""
+        now = _now()
+        running = db.session.execute(
+            select(Job.id, Job.owner, Job.heartbeat_at).where(Job.status == 'running')
+        ).all()
+        interrupted = [
+            job_id for job_id, owner, heartbeat_at in running
+            if job_id not in self.running and self.is_interrupted(owner, heartbeat_at, now)
+        ]
+        if interrupted:
+            db.session.execute(
+                update(Job).where(Job.id.in_(interrupted), Job.status == 'running')
+                .values(status='failed', error='执行进程已退出或心跳超时，任务中断', finished_at=now)
+            )
+        db.session.commit()
+        return len(interrupted)
+
+    def submit_waiting(self, kinds=None):
+        """互斥的任务类型没有运行中的任务时，提交该类型最早的待执行任务；返回提交数"""
+        kinds = [kind for kind in (kinds or _handlers) if _is_exclusive(kind)]
+        submitted = 0
+        for kind in kinds:
+            running = db.session.execute(
+                select(Job.id).where(Job.kind == kind, Job.status == 'running').limit(1)
+            ).first()
+            job_id = None if running else db.session.execute(
+                select(Job.id).where(Job.kind == kind, Job.status == 'pending')
+                .order_by(Job.created_at).limit(1)
+            ).scalar()
+            if job_id is not None:
+                self.submit(job_id)
+                submitted += 1
+        db.session.commit()
+        return submitted
+
+    def recover(self):
+        """启动时处理中断的任务：已中断的运行中任务标记为失败，未开始的重新排队"""
+        self.fail_interrupted()
+        pending = db.session.execute(
+            select(Job.id).where(Job.status == 'pending').order_by(Job.created_at)
+        ).scalars().all()
+        for job_id in pending:
+            self.submit(job_id)
+
+
+def get_runner():
+    """返回当前应用的任务线程池，首次调用时启动"""
+    app = current_app._get_current_object()
+    with _runner_lock:
+        runner = app.extensions.get('jobs')
+        if runner is None:
+            if db.engine.dialect.name == 'sqlite':
+                # 任务线程与请求并发读写同一数据库文件，WAL 模式下读写互不阻塞
+                with db.engine.connect() as connection:
+                    connection.exec_driver_sql('PRAGMA journal_mode=WAL')
+            runner = app.extensions['jobs'] = JobRunner(app)
+            runner.recover()
+    return runner
+
+
+@jobs_bp.before_app_request
+def _start_runner():
+    if 'jobs' not in current_app.extensions:
+        get_runner()
+
+
+def submit(kind, params=None):
+    """提交任务，返回已提交的 Job"""
+    if kind not in _handlers:
+        raise ValueError(f'未知的任务类型: {kind}')
+    job = Job(id=uuid.uuid4().hex, kind=kind, status='pending', params=params or {},
+              processed=0, created_at=_now())
+    db.session.add(job)
+    db.session.commit()
+    get_runner().submit(job.id)
+    return job
+
+
+def save_upload(upload):
+    """把上传文件保存到结果目录，返回路径（供导入任务在后台读取，处理函数负责删除）"""
+    path = os.path.join(result_folder(), f'upload_{uuid.uuid4().hex}{os.path.splitext(upload.filename)[1]}')
+    with open(path, 'wb') as out:
+        shutil.copyfileobj(upload.stream, out)
+    return path
+
+
+def cancel(job):
+    """取消任务：未开始的直接取消，运行中的设置取消标记，返回是否接受取消"""
+    if job.status in FINISHED_STATUSES:
+        return False
+    if job.status == 'pending':
+        cancelled = db.session.execute(
+            update(Job).where(Job.id == job.id, Job.status == 'pending')
+            .values(status='cancelled', finished_at=_now(), cancel_requested=True)
+        ).rowcount
+        if cancelled:
+            db.session.commit()
+            return True
+    db.session.execute(update(Job).where(Job.id == job.id).values(cancel_requested=True))
+    db.session.commit()
+    return True
+
+
+def purge_jobs(older_than):
+    """删除结束时间早于 older_than 的任务记录及结果文件，返回删除数"""
+    jobs = Job.query.filter(Job.status.in_(FINISHED_STATUSES), Job.finished_at < older_than).all()
+    for job in jobs:
+        if job.result_path and os.path.exists(job.result_path):
+            os.remove(job.result_path)
+        db.session.delete(job)
+    db.session.commit()
+    return len(jobs)
+
+
+def job_response(job, status_code=200):
+    """任务状态响应（附带结果下载地址）"""
+    data = job.to_dict()
+    data['status_url'] = f'{jobs_bp.url_prefix}/{job.id}'
+    data['result_url'] = f'{jobs_bp.url_prefix}/{job.id}/result'
+    return jsonify(data), status_code
+
+
+# ============= 任务接口 =============
+
+@jobs_bp.route('', methods=['POST'])
+def submit_job():
+    """提交任务，请求体: {kind, params}"""
+    try:
+        data = request.get_json() or {}
+        job = submit(data.get('kind'), data.get('params'))
+        return job_response(job, 202)
+    except ValueError as e:
+        return jsonify({'error': str(e), 'kinds': sorted(_handlers)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
+@jobs_bp.route('', methods=['GET'])
+def list_jobs():
+    """最近的任务，可按 kind、status 筛选"""
+    limit = max(1, min(request.args.get('limit', DEFAULT_LIST_LIMIT, type=int), MAX_LIST_LIMIT))
+    query = Job.query
+    if request.args.get('kind'):
+        query = query.filter(Job.kind == request.args['kind'])
+    if request.args.get('status'):
+        query = query.filter(Job.status == request.args['status'])
+    jobs = query.order_by(Job.created_at.desc()).limit(limit).all()
+    return jsonify({'jobs': [job.to_dict() for job in jobs]})
+
+
+@jobs_bp.route('/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """任务状态、进度和耗时"""
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return job_response(job)
+
+
+@jobs_bp.route('/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """下载任务结果：有结果文件时返回文件，否则返回结果摘要"""
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    if job.status != 'completed':
+        return jsonify({'error': f'任务尚未完成（{job.status}）', 'status': job.status}), 409
+    if job.result_path:
+        if not os.path.exists(job.result_path):
+            return jsonify({'error': '结果文件已清理'}), 410
+        return send_file(job.result_path, as_attachment=True, download_name=job.result_filename,
+                         mimetype=job.result_mimetype)
+    return jsonify(job.result)
+
+
+@jobs_bp.route('/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """取消任务"""
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    if not cancel(job):
+        return jsonify({'error': f'任务已结束（{job.status}）'}), 409
+    db.session.refresh(job)
+    return job_response(job, 202)
+
+
+@jobs_bp.cli.command('purge')
+@click.option('--days', default=7, show_default=True, help='删除结束超过指定天数的任务')
+def purge_jobs_command(days):
+    """清理已结束的旧任务及其结果文件"""
+    count = purge_jobs(_now() - timedelta(days=days))
+    print(f"✅ 已清理 {count} 个任务")
@@ -0,0 +1,364 @@
+"""
+材料价格表导入与历史价格查询
+
+供应商价格表按材料编码 upsert：新编码创建材料，已有编码更新规格信息，
+每行价格按生效日期写入 material_prices 历史表；材料当前单价同步为今天生效的价格。
+整个文件单次流式读取，按批提交。
+
+按日期查询价格走 (material_id, effective_date) 唯一索引，每个材料一次索引查找。
+启用价格历史之前已有的材料没有历史记录，启动时以当前单价回填一条最早的记录（ensure_price_history），
+按任意日期取价都有结果，不会静默退回当前单价。
+"""
+
+import os
+from datetime import date, datetime
+
+from sqlalchemy import func, insert, literal, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import aliased
+
+from models import db, Material, MaterialPrice
+from bulk_import import ImportReport, MAX_REPORTED_ERRORS, iter_records
+import search_index
+from jobs import job_handler
+
+PRICE_LIST_CHUNK_SIZE = 2000
+DEFAULT_UNIT = '张'
+DEFAULT_WASTE_RATE = 0.05
+BACKFILL_EFFECTIVE_DATE = date(2000, 1, 1)  # 回填价格的生效日期（早于任何计价日期）
+BACKFILL_SOURCE = 'materials.unit_price'
+
+# 表头别名（与材料导出文件的中文表头一致）
+PRICE_LIST_ALIASES = {
+    'code': 'code', '编码': 'code', '材料编码': 'code',
+    'unit_price': 'unit_price', 'price': 'unit_price', '单价': 'unit_price',
+    'effective_date': 'effective_date', '生效日期': 'effective_date',
+    'name': 'name', '名称': 'name',
+    'category': 'category', '类别': 'category',
+    'thickness': 'thickness', '厚度(mm)': 'thickness',
+    'width': 'width', '宽度(mm)': 'width',
+    'length': 'length', '长度(mm)': 'length',
+    'unit': 'unit', '单位': 'unit',
+    'supplier': 'supplier', '供应商': 'supplier',
+    'waste_rate': 'waste_rate', '损耗率': 'waste_rate',
+}
+REQUIRED_COLUMNS = ('code', 'unit_price')
+TEXT_FIELDS = ('name', 'category', 'unit', 'supplier')
+NUMBER_FIELDS = ('thickness', 'width', 'length', 'waste_rate')
+
+
+def parse_date(value):
+    """解析 YYYY-MM-DD（也接受带时间的写法），空值返回 None"""
+    if value in (None, ''):
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value).strip()[:10])
+    except ValueError:
+        raise ValueError(f'日期格式应为 YYYY-MM-DD: {value}')
+
+
+def prices_as_of(material_ids, as_of):
+    """
+    查询一组材料在指定日期生效的价格，返回 {material_id: unit_price}。
+    该日期之前没有价格记录的材料不在结果中。
+    """
+    material_ids = set(material_ids)
+    if not material_ids:
+        return {}
+    earlier = aliased(MaterialPrice)
+    latest_date = (
+        select(func.max(earlier.effective_date))
+        .where(earlier.material_id == MaterialPrice.material_id, earlier.effective_date <= as_of)
+        .scalar_subquery()
+    )
+    rows = db.session.query(MaterialPrice.material_id, MaterialPrice.unit_price).filter(
+        MaterialPrice.material_id.in_(material_ids),
+        MaterialPrice.effective_date == latest_date
+    )
+    return dict(rows)
+
+
+def price_history(material_id):
+    """某个材料的全部价格记录（按生效日期倒序）"""
+    return (MaterialPrice.query.filter_by(material_id=material_id)
+            .order_by(MaterialPrice.effective_date.desc()).all())
+
+
+def record_price(material, effective_date=None, source=None):
+    """为单个材料写入一条价格记录（同日已有记录时覆盖）"""
+    upsert_prices([{
+        'material_id': material.id,
+        'effective_date': effective_date or date.today(),
+        'unit_price': material.unit_price,
+        'supplier': material.supplier,
+        'source': source
+    }])
+
+
+def upsert_prices(rows):
+    """在当前事务中写入价格历史，(材料, 生效日期) 已存在时覆盖价格"""
+    if not rows:
+        return
+    stmt = sqlite_insert(MaterialPrice)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['material_id', 'effective_date'],
+        set_={'unit_price': stmt.excluded.unit_price, 'supplier': stmt.excluded.supplier,
+              'source': stmt.excluded.source}
+    )
+    db.session.execute(stmt, [dict(row, created_at=datetime.utcnow()) for row in rows])
+
+
+def ensure_price_history():
+    """为没有任何价格记录的材料写入一条以当前单价回填的记录（单条 INSERT ... SELECT），返回写入数"""
+    has_price = select(MaterialPrice.id).where(MaterialPrice.material_id == Material.id).exists()
+    missing = select(
+        Material.id, literal(BACKFILL_EFFECTIVE_DATE), Material.unit_price, Material.supplier,
+        literal(BACKFILL_SOURCE), literal(datetime.utcnow())
+    ).where(~has_price, Material.unit_price.isnot(None))
+    return db.session.execute(insert(MaterialPrice).from_select(
+        ['material_id', 'effective_date', 'unit_price', 'supplier', 'source', 'created_at'], missing
+    )).rowcount
+
+
+def sync_current_prices(material_ids, today=None):
+    """
+    把材料当前单价更新为今天生效的历史价格（没有已生效记录的材料保持不变），
+    返回单价实际发生变化的材料ID集合。
+    """
+    today = today or date.today()
+    current = (
+        select(MaterialPrice.unit_price)
+        .where(MaterialPrice.material_id == Material.id, MaterialPrice.effective_date <= today)
+        .order_by(MaterialPrice.effective_date.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    has_price = (
+        select(MaterialPrice.id)
+        .where(MaterialPrice.material_id == Material.id, MaterialPrice.effective_date <= today)
+        .exists()
+    )
+    result = db.session.execute(
+        update(Material)
+        .where(Material.id.in_(material_ids), has_price, Material.unit_price.is_distinct_from(current))
+        .values(unit_price=current)
+        .returning(Material.id),
+        execution_options={'synchronize_session': False}
+    )
+    return set(result.scalars())
+
+
+def validate_price_record(record, default_date):
+    """校验并转换一行价格数据，返回 (数据, 错误列表)"""
+    errors = []
+    data = {'code': record['code']}
+    if not record['code']:
+        errors.append('code 不能为空')
+    elif len(record['code']) > 50:
+        errors.append('code 超过 50 个字符')
+
+    try:
+        data['unit_price'] = float(record['unit_price'])
+        if data['unit_price'] < 0:
+            errors.append('unit_price 不能为负数')
+    except ValueError:
+        errors.append(f"unit_price 不是数字: {record['unit_price']}")
+
+    try:
+        data['effective_date'] = parse_date(record.get('effective_date')) or default_date
+    except ValueError as e:
+        errors.append(str(e))
+
+    for name in TEXT_FIELDS:
+        if record.get(name):
+            data[name] = record[name]
+    for name in NUMBER_FIELDS:
+        if record.get(name):
+            try:
+                data[name] = float(record[name])
+            except ValueError:
+                errors.append(f"{name} 不是数字: {record[name]}")
+    return data, errors
+
+
+def existing_codes(records):
+    """一条 IN 查询取出本批已存在的材料编码，返回 {编码: 材料ID}"""
+    codes = {record['code'] for record in records}
+    return dict(db.session.query(Material.code, Material.id).filter(Material.code.in_(codes)))
+
+
+def split_new_materials(records, existing, today=None):
+    """
+    找出需要新建的材料，返回 ({编码: 规格行}, 无法新建的行 [(行, 错误)])。
+    同一新编码在本批中出现多次时只创建一次，取最后一行带名称的规格。
+    新材料必须有今天已生效的价格：materials.unit_price 不能为空，
+    只有未来价格时无法给出当前单价，这些行报错，待价格生效后再导入。
+    """
+    today = today or date.today()
+    effective = {record['code'] for record in records
+                 if record['code'] not in existing and record['effective_date'] <= today}
+    new_materials = {}
+    for record in records:
+        if record['code'] in effective and record.get('name'):
+            new_materials[record['code']] = record
+    skipped = []
+    for record in records:
+        if record['code'] in existing or record['code'] in new_materials:
+            continue
+        if record['code'] not in effective:
+            skipped.append((record, f"新材料没有已生效的价格（生效日期 {record['effective_date'].isoformat()}）"))
+        else:
+            skipped.append((record, '新材料需提供 name'))
+    return new_materials, skipped
+
+
+def upsert_price_chunk(records, source=None, today=None):
+    """
+    在当前事务中写入一批已校验的价格行，返回 (新建材料数, 更新材料数, 无法新建材料被跳过的行, 需重算的材料ID)。
+    需重算的材料：当前单价变化、损耗率被更新，或写入了今天以前生效的价格（影响按历史日期计价的计算）。
+    """
+    today = today or date.today()
+    existing = existing_codes(records)
+    new_materials, skipped = split_new_materials(records, existing, today)
+
+    if new_materials:
+        rows = [
+            {
+                'code': code,
+                'name': record['name'],
+                'category': record.get('category'),
+                'thickness': record.get('thickness'),
+                'width': record.get('width'),
+                'length': record.get('length'),
+                'unit_price': record['unit_price'],
+                'unit': record.get('unit', DEFAULT_UNIT),
+                'supplier': record.get('supplier'),
+                'waste_rate': record.get('waste_rate', DEFAULT_WASTE_RATE),
+            }
+            for code, record in new_materials.items()
+        ]
+        result = db.session.execute(
+            insert(Material).returning(Material.id, sort_by_parameter_order=True), rows
+        )
+        ids = list(result.scalars())
+        for row, material_id in zip(rows, ids):
+            existing[row['code']] = material_id
+            row['id'] = material_id
+        # Core 批量写入不触发 ORM 事件，直接写入全文索引
+        search_index.index_records('materials', rows)
+
+    # 已有材料只更新价格表中提供的规格字段
+    spec_updates = [
+        {'id': existing[record['code']],
+         **{name: record[name] for name in TEXT_FIELDS + NUMBER_FIELDS if name in record}}
+        for record in records
+        if record['code'] in existing and record['code'] not in new_materials
+        and any(name in record for name in TEXT_FIELDS + NUMBER_FIELDS)
+    ]
+    if spec_updates:
+        db.session.execute(update(Material), spec_updates)
+        reindexed = {row['id'] for row in spec_updates if 'name' in row or 'supplier' in row}
+        search_index.reindex('materials', sorted(reindexed))
+
+    priced = [record for record in records if record['code'] in existing]
+    upsert_prices([
+        {
+            'material_id': existing[record['code']],
+            'effective_date': record['effective_date'],
+            'unit_price': record['unit_price'],
+            'supplier': record.get('supplier'),
+            'source': source
+        }
+        for record in priced
+    ])
+    touched = {existing[record['code']] for record in priced}
+    changed = sync_current_prices(touched, today)
+    changed |= {row['id'] for row in spec_updates if 'waste_rate' in row}
+    changed |= {existing[record['code']] for record in priced
+                if record['code'] not in new_materials and record['effective_date'] < today}
+
+    updated = len(touched) - len(new_materials)
+    return len(new_materials), updated, skipped, changed
+
+
+def import_price_list(fileobj, filename, effective_date=None, chunk_size=PRICE_LIST_CHUNK_SIZE,
+                      dry_run=False, on_chunk=None, on_materials_changed=None):
+    """
+    导入供应商价格表，返回 ImportReport（inserted 为新建材料数，updated 为更新价格的已有材料数）。
+    effective_date: 文件中没有生效日期列时使用的日期，默认今天
+    on_chunk: 每批提交后以 ImportReport 调用（用于汇报进度）
+    on_materials_changed: 导入结束（包括中途出错）时以已提交批次中需重算的材料ID集合调用，
+    用于提交重算任务；没有变化时不调用
+    """
+    default_date = effective_date or date.today()
+    report = ImportReport(dry_run=dry_run)
+    seen_rows = {}  # (编码, 生效日期) -> 首次出现的行号
+    chunk = []
+    row_numbers = {}
+    changed = set()  # 已提交批次中需重算的材料ID
+
+    def flush():
+        if not chunk:
+            return
+        if dry_run:
+            _, skipped = split_new_materials(chunk, existing_codes(chunk))
+        else:
+            inserted, updated, skipped, chunk_changed = upsert_price_chunk(chunk, source=filename)
+            db.session.commit()
+            changed.update(chunk_changed)
+            report.inserted += inserted
+            report.updated += updated
+        for record, error in skipped:
+            report.add_error({'row': row_numbers[id(record)], 'code': record['code'], 'errors': [error]})
+        chunk.clear()
+        row_numbers.clear()
+        if on_chunk:
+            on_chunk(report)
+
+    try:
+        records = iter_records(fileobj, filename, aliases=PRICE_LIST_ALIASES, required=REQUIRED_COLUMNS)
+        for row_number, record in records:
+            report.total += 1
+            data, errors = validate_price_record(record, default_date)
+            key = (data['code'], data.get('effective_date'))
+            if key in seen_rows:
+                errors.append(f'同一编码和生效日期与第 {seen_rows[key]} 行重复')
+            elif data['code']:
+                seen_rows[key] = row_number
+
+            if errors:
+                report.add_error({'row': row_number, 'code': data['code'] or None, 'errors': errors})
+                continue
+            chunk.append(data)
+            row_numbers[id(data)] = row_number
+            if len(chunk) >= chunk_size:
+                flush()
+        flush()
+    finally:
+        # 已提交的批次即使后续出错也已生效，需要重算
+        if changed and on_materials_changed:
+            db.session.rollback()
+            on_materials_changed(changed)
+
+    report.errors.sort(key=lambda error: error['row'])
+    return report
+
+
+@job_handler('price_list_import')
+def run_price_list_import(context, params):
+    """价格表导入任务：params 为 path（jobs.save_upload 保存的文件）、filename、effective_date、dry_run"""
+    import recalculation  # recalculation 依赖本模块的 parse_date，在此处导入以避免循环导入
+    try:
+        with open(params['path'], 'rb') as fileobj:
+            report = import_price_list(
+                fileobj, params['filename'], effective_date=parse_date(params.get('effective_date')),
+                dry_run=params.get('dry_run', False), on_chunk=lambda report: context.progress(report.total),
+                on_materials_changed=lambda material_ids: recalculation.schedule_recalculation(material_ids)
+            )
+    finally:
+        os.remove(params['path'])
+    return report.to_dict(max_errors=MAX_REPORTED_ERRORS)
@@ -0,0 +1,113 @@
+"""
+数据库结构迁移
+
+db.create_all() 只会创建缺失的表，已存在的表不会补建 models 中新增的索引和列。
+这里对比模型定义与实际数据库结构，列出差异并补齐：新增列用 ALTER TABLE ADD COLUMN，
+缺失的索引用 CREATE INDEX。只做增量变更，不删除或修改已有的列和索引。
+唯一索引建立前先检查已有数据，存在重复值时报错并列出重复值，需人工处理后再升级。
+"""
+
+from sqlalchemy import func, inspect, select
+from sqlalchemy.schema import CreateColumn
+
+from models import db
+
+
+def _existing_tables(inspector):
+    return set(inspector.get_table_names())
+
+
+def missing_columns():
+    """已存在的表中缺少的模型列，返回 [(表名, Column), ...]"""
+    inspector = inspect(db.engine)
+    tables = _existing_tables(inspector)
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        missing.extend((table.name, column) for column in table.columns if column.name not in existing)
+    return missing
+
+
+def missing_indexes():
+    """已存在的表中缺少的模型索引，返回 [Index, ...]"""
+    inspector = inspect(db.engine)
+    tables = _existing_tables(inspector)
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        missing.extend(index for index in sorted(table.indexes, key=lambda i: i.name)
+                       if index.name not in existing)
+    return missing
+
+
+class SchemaUpgradeError(RuntimeError):
+    """已有数据不满足新增的约束，无法自动升级"""
+
+
+def duplicate_values(index, limit=5):
+    """唯一索引的列在已有数据中重复的值（最多 limit 组），返回 [(值..., 行数), ...]"""
+    columns = list(index.columns)
+    stmt = (
+        select(*columns, func.count())
+        .group_by(*columns)
+        .having(func.count() > 1)
+        .limit(limit)
+    )
+    with db.engine.connect() as conn:
+        return [tuple(row) for row in conn.execute(stmt)]
+
+
+def pending_changes():
+    """待执行的迁移说明列表，为空表示数据库结构与模型一致"""
+    changes = [f"ADD COLUMN {table}.{column.name}" for table, column in missing_columns()]
+    changes.extend(
+        f"CREATE {'UNIQUE ' if index.unique else ''}INDEX {index.name} ON {index.table.name} "
+        f"({', '.join(col.name for col in index.columns)})"
+        for index in missing_indexes()
+    )
+    return changes
+
+
+def upgrade_schema():
+    """
+    补齐缺失的列和索引，返回已执行的变更说明。
+    新增列不能是主键或唯一列；NOT NULL 列需设置 server_default 才能加到已有数据的表上。
+    新增唯一索引的列已有重复值时抛出 SchemaUpgradeError，不执行任何变更。
+    """
+    new_columns = {(table, column.name) for table, column in missing_columns()}
+    for index in missing_indexes():
+        # 新增的列全为空，不会重复
+        checkable = index.unique and not any((index.table.name, col.name) in new_columns for col in index.columns)
+        duplicates = duplicate_values(index) if checkable else []
+        if duplicates:
+            values = '; '.join(f"{', '.join(map(str, row[:-1]))}（{row[-1]} 行）" for row in duplicates)
+            raise SchemaUpgradeError(
+                f"无法创建唯一索引 {index.name}：{index.table.name} 中存在重复值 {values}，请先合并或修改这些记录"
+            )
+
+    applied = []
+    with db.engine.begin() as conn:
+        for table, column in missing_columns():
+            ddl = CreateColumn(column).compile(dialect=conn.dialect)
+            conn.exec_driver_sql(f'ALTER TABLE "{table}" ADD COLUMN {ddl}')
+            applied.append(f"ADD COLUMN {table}.{column.name}")
+
+    db.metadata.create_all(db.engine)  # 先前不存在的表（及其索引）
+    for index in missing_indexes():
+        index.create(db.engine)
+        applied.append(f"CREATE INDEX {index.name} ON {index.table.name}")
+    return applied
+
+
+def check_schema():
+    """启动时检查数据库结构，存在待执行迁移时打印提示，返回待执行变更列表"""
+    changes = pending_changes()
+    if changes:
+        print(f"⚠️ 数据库结构落后于模型定义（{len(changes)} 项），请执行 flask upgrade-db:")
+        for change in changes:
+            print(f"   - {change}")
+    return changes
@@ -5,9 +5,25 @@ from enum import Enum
 
 db = SQLAlchemy()
 
+
+def wants_field(fields, name):
+    """fields 为空表示返回全部字段"""
+    return not fields or name in fields
+
+
+def select_fields(data, fields):
+    """按稀疏字段集过滤 to_dict 结果"""
+    if not fields:
+        return data
+    return {key: value for key, value in data.items() if key in fields}
+
 # 添加产品表 Product
 class Product(db.Model):
     __tablename__ = 'products'
+    __table_args__ = (
+        db.Index('ix_products_series_status', 'series', 'file_control', 'standardization'),  # 看板分组统计
+        db.Index('uq_products_sku', 'sku', unique=True),  # SKU 唯一，批量导入按 SKU upsert
+    )
     id = db.Column(db.Integer, primary_key=True)
     series = db.Column(db.String(50), nullable=False)
     spu = db.Column(db.String(50), nullable=False)
@@ -15,15 +31,15 @@ class Product(db.Model):
     file_control = db.Column(db.String(20), nullable=False)  # 已受控/未受控
     standardization = db.Column(db.String(20), nullable=False)  # 已落地/未落地
 
-    def to_dict(self):
-        return {
+    def to_dict(self, fields=None):
+        return select_fields({
             'id': self.id,
             'series': self.series,
             'spu': self.spu,
             'sku': self.sku,
             'file_control': self.file_control,
             'standardization': self.standardization
-        }
+        }, fields)
 
 class ProcessStatus(Enum):
     DRAFT = "draft"
@@ -43,6 +59,10 @@ class NodeType(Enum):
 # 工艺流程主表
 class WorkflowTemplate(db.Model):
     __tablename__ = 'workflow_templates'
+    __table_args__ = (
+        db.Index('ix_workflow_templates_status_updated_at', 'status', 'updated_at'),
+        db.Index('ix_workflow_templates_series_updated_at', 'product_series', 'updated_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -55,34 +75,38 @@ class WorkflowTemplate(db.Model):
     workflow_config = db.Column(db.JSON)  # 存储节点和连接配置
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     created_by = db.Column(db.String(50))
     
     # 关联关系
     nodes = db.relationship('WorkflowNode', backref='workflow', lazy=True, cascade='all, delete-orphan')
     cost_calculations = db.relationship('CostCalculation', backref='workflow', lazy=True)
 
-    def to_dict(self):
-        return {
+    def to_dict(self, fields=None, nodes_count=None):
+        data = {
             'id': self.id,
             'name': self.name,
             'description': self.description,
             'product_series': self.product_series,
             'version': self.version,
             'status': self.status.value,
-            'workflow_config': self.workflow_config,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat(),
-            'created_by': self.created_by,
-            'nodes_count': len(self.nodes)
+            'created_by': self.created_by
         }
+        # 以下字段可能触发额外加载，只在需要时读取
+        if wants_field(fields, 'workflow_config'):
+            data['workflow_config'] = self.workflow_config
+        if wants_field(fields, 'nodes_count'):
+            data['nodes_count'] = len(self.nodes) if nodes_count is None else nodes_count
+        return select_fields(data, fields)
 
 # 工艺节点表
 class WorkflowNode(db.Model):
     __tablename__ = 'workflow_nodes'
     
     id = db.Column(db.Integer, primary_key=True)
-    workflow_id = db.Column(db.Integer, db.ForeignKey('workflow_templates.id'), nullable=False)
+    workflow_id = db.Column(db.Integer, db.ForeignKey('workflow_templates.id'), nullable=False, index=True)
     
     node_id = db.Column(db.String(50), nullable=False)  # 前端生成的唯一ID
     node_type = db.Column(db.Enum(NodeType), nullable=False)
@@ -100,6 +124,11 @@ class WorkflowNode(db.Model):
     estimated_time_minutes = db.Column(db.Float, default=0)  # 预估加工时间
     labor_cost_per_hour = db.Column(db.Float, default=0)     # 人工成本/小时
     machine_cost_per_hour = db.Column(db.Float, default=0)   # 设备成本/小时
+    setup_time_minutes = db.Column(db.Float)                 # 准备时间（每批一次，与数量无关）
+    
+    # 成本风险模拟：加工时间按三角分布（最短, 预估, 最长）抽样，未设置时视为固定值
+    time_min_minutes = db.Column(db.Float)
+    time_max_minutes = db.Column(db.Float)
     
     # 关联关系
     input_connections = db.relationship('NodeConnection', 
@@ -109,8 +138,8 @@ class WorkflowNode(db.Model):
                                        foreign_keys='NodeConnection.source_node_id', 
                                        backref='source_node', lazy=True)
 
-    def to_dict(self):
-        return {
+    def to_dict(self, fields=None):
+        return select_fields({
             'id': self.id,
             'node_id': self.node_id,
             'workflow_id': self.workflow_id,
@@ -121,15 +150,18 @@ class WorkflowNode(db.Model):
             'process_params': self.process_params,
             'estimated_time_minutes': self.estimated_time_minutes,
             'labor_cost_per_hour': self.labor_cost_per_hour,
-            'machine_cost_per_hour': self.machine_cost_per_hour
-        }
+            'machine_cost_per_hour': self.machine_cost_per_hour,
+            'setup_time_minutes': self.setup_time_minutes,
+            'time_min_minutes': self.time_min_minutes,
+            'time_max_minutes': self.time_max_minutes
+        }, fields)
 
 # 节点连接表
 class NodeConnection(db.Model):
     __tablename__ = 'node_connections'
     
     id = db.Column(db.Integer, primary_key=True)
-    workflow_id = db.Column(db.Integer, db.ForeignKey('workflow_templates.id'), nullable=False)
+    workflow_id = db.Column(db.Integer, db.ForeignKey('workflow_templates.id'), nullable=False, index=True)
     
     source_node_id = db.Column(db.Integer, db.ForeignKey('workflow_nodes.id'), nullable=False)
     target_node_id = db.Column(db.Integer, db.ForeignKey('workflow_nodes.id'), nullable=False)
@@ -139,19 +171,23 @@ class NodeConnection(db.Model):
     # 连接条件和规则
     conditions = db.Column(db.JSON)  # 连接条件配置
 
-    def to_dict(self):
-        return {
+    def to_dict(self, fields=None):
+        return select_fields({
             'id': self.id,
             'connection_id': self.connection_id,
             'workflow_id': self.workflow_id,
             'source_node_id': self.source_node_id,
             'target_node_id': self.target_node_id,
             'conditions': self.conditions
-        }
+        }, fields)
 
 # 材料定义表
 class Material(db.Model):
     __tablename__ = 'materials'
+    __table_args__ = (
+        db.Index('ix_materials_created_at_id', 'created_at', 'id'),  # 材料列表游标分页
+        db.Index('ix_materials_category_created_at_id', 'category', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     code = db.Column(db.String(50), unique=True, nullable=False)
@@ -171,10 +207,14 @@ class Material(db.Model):
     # 损耗率
     waste_rate = db.Column(db.Float, default=0.05)  # 默认5%损耗
     
+    # 成本风险模拟：单价和损耗率按正态分布抽样的标准差，未设置时视为固定值
+    price_std = db.Column(db.Float)
+    waste_rate_std = db.Column(db.Float)
+    
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    def to_dict(self):
-        return {
+    def to_dict(self, fields=None):
+        return select_fields({
             'id': self.id,
             'code': self.code,
             'name': self.name,
@@ -185,12 +225,75 @@ class Material(db.Model):
             'unit_price': self.unit_price,
             'unit': self.unit,
             'supplier': self.supplier,
-            'waste_rate': self.waste_rate
+            'waste_rate': self.waste_rate,
+            'price_std': self.price_std,
+            'waste_rate_std': self.waste_rate_std
+        }, fields)
+
+# 材料价格历史表（按生效日期记录，用于按任意日期核价）
+class MaterialPrice(db.Model):
+    __tablename__ = 'material_prices'
+    __table_args__ = (
+        # 同时用于按日期查询生效价格（material_id = ? AND effective_date <= ? 取最大）
+        db.UniqueConstraint('material_id', 'effective_date', name='uq_material_prices_material_date'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    material_id = db.Column(db.Integer, db.ForeignKey('materials.id'), nullable=False)
+    effective_date = db.Column(db.Date, nullable=False)  # 生效日期
+    unit_price = db.Column(db.Float, nullable=False)
+    supplier = db.Column(db.String(100))
+    source = db.Column(db.String(200))  # 来源（如价格表文件名）
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self, fields=None):
+        return select_fields({
+            'id': self.id,
+            'material_id': self.material_id,
+            'effective_date': self.effective_date.isoformat(),
+            'unit_price': self.unit_price,
+            'supplier': self.supplier,
+            'source': self.source,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }, fields)
+
+# 城市工价表（按生效日期保存历史，见 wage_rates.py）
+class CityWageRate(db.Model):
+    __tablename__ = 'city_wage_rates'
+    __table_args__ = (
+        # 同时用于按日期查询生效工价（city = ? AND effective_date <= ? 取最大）
+        db.UniqueConstraint('city', 'effective_date', name='uq_city_wage_rates_city_date'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    city = db.Column(db.String(50), nullable=False)
+    effective_date = db.Column(db.Date, nullable=False)  # 生效日期
+    rate_per_second = db.Column(db.Float, nullable=False)  # 工价（元/秒）
+    source = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'city': self.city,
+            'effective_date': self.effective_date.isoformat(),
+            'rate_per_second': self.rate_per_second,
+            'rate_per_hour': self.rate_per_second * 3600,
+            'source': self.source,
+            'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
 # 成本计算表
 class CostCalculation(db.Model):
     __tablename__ = 'cost_calculations'
+    __table_args__ = (
+        db.Index('ix_cost_calculations_date_id', 'calculation_date', 'id'),  # 计算历史游标分页
+        # 计算历史默认只列出未被重算取代的记录（superseded_by_id IS NULL），按时间顺序直接读取，不需要额外排序；
+        # 首列同时用于按 superseded_by_id 的外键查找
+        db.Index('ix_cost_calculations_superseded_date_id', 'superseded_by_id', 'calculation_date', 'id'),
+        db.Index('ix_cost_calculations_workflow_date_id', 'workflow_id', 'calculation_date', 'id'),
+        db.Index('ix_cost_calculations_sku_date_id', 'product_sku', 'calculation_date', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     workflow_id = db.Column(db.Integer, db.ForeignKey('workflow_templates.id'), nullable=False)
@@ -210,11 +313,15 @@ class CostCalculation(db.Model):
     # 详细成本分解JSON
     cost_breakdown = db.Column(db.JSON)  # 详细成本分解数据
     
+    # 重算链：材料价格或工艺参数变化后重新计算时，新记录指向被取代的旧记录
+    supersedes_id = db.Column(db.Integer, db.ForeignKey('cost_calculations.id'))
+    superseded_by_id = db.Column(db.Integer, db.ForeignKey('cost_calculations.id'))
+    
     # 关联关系
     material_usages = db.relationship('MaterialUsage', backref='cost_calculation', lazy=True)
 
-    def to_dict(self):
-        return {
+    def to_dict(self, fields=None):
+        return select_fields({
             'id': self.id,
             'workflow_id': self.workflow_id,
             'product_sku': self.product_sku,
@@ -226,16 +333,18 @@ class CostCalculation(db.Model):
             'overhead_cost': self.overhead_cost,
             'total_cost': self.total_cost,
             'unit_cost': self.total_cost / self.quantity if self.quantity > 0 else 0,
+            'supersedes_id': self.supersedes_id,
+            'superseded_by_id': self.superseded_by_id,
             'cost_breakdown': self.cost_breakdown
-        }
+        }, fields)
 
 # 材料用量表
 class MaterialUsage(db.Model):
     __tablename__ = 'material_usages'
     
     id = db.Column(db.Integer, primary_key=True)
-    cost_calculation_id = db.Column(db.Integer, db.ForeignKey('cost_calculations.id'), nullable=False)
-    material_id = db.Column(db.Integer, db.ForeignKey('materials.id'), nullable=False)
+    cost_calculation_id = db.Column(db.Integer, db.ForeignKey('cost_calculations.id'), nullable=False, index=True)
+    material_id = db.Column(db.Integer, db.ForeignKey('materials.id'), nullable=False, index=True)
     
     # 用量信息
     planned_quantity = db.Column(db.Float, nullable=False)  # 计划用量
@@ -249,17 +358,48 @@ class MaterialUsage(db.Model):
     # 关联材料信息
     material = db.relationship('Material', backref='usages')
 
-    def to_dict(self):
-        return {
+    def to_dict(self, fields=None):
+        return select_fields({
             'id': self.id,
             'material_id': self.material_id,
-            'material_name': self.material.name if self.material else None,
+            'material_name': (self.material.name if self.material else None)
+            if wants_field(fields, 'material_name') else None,
             'planned_quantity': self.planned_quantity,
             'actual_quantity': self.actual_quantity,
             'waste_quantity': self.waste_quantity,
             'unit_cost': self.unit_cost,
             'total_cost': self.total_cost
-        }
+        }, fields)
+
+# 成本日汇总表（按 日期+SKU+工艺流程 累计，随成本计算在同一事务中更新）
+class CostDailyRollup(db.Model):
+    __tablename__ = 'cost_daily_rollups'
+    
+    day = db.Column(db.Date, primary_key=True)
+    product_sku = db.Column(db.String(50), primary_key=True, default='')  # 未关联SKU时为空字符串
+    workflow_id = db.Column(db.Integer, db.ForeignKey('workflow_templates.id'), primary_key=True)
+    
+    count = db.Column(db.Integer, nullable=False, default=0)      # 计算次数
+    quantity = db.Column(db.Integer, nullable=False, default=0)   # 生产数量合计
+    material_cost = db.Column(db.Float, nullable=False, default=0)
+    labor_cost = db.Column(db.Float, nullable=False, default=0)
+    machine_cost = db.Column(db.Float, nullable=False, default=0)
+    overhead_cost = db.Column(db.Float, nullable=False, default=0)
+    total_cost = db.Column(db.Float, nullable=False, default=0)
+
+    def to_dict(self, fields=None):
+        return select_fields({
+            'day': self.day.isoformat(),
+            'product_sku': self.product_sku or None,
+            'workflow_id': self.workflow_id,
+            'count': self.count,
+            'quantity': self.quantity,
+            'material_cost': self.material_cost,
+            'labor_cost': self.labor_cost,
+            'machine_cost': self.machine_cost,
+            'overhead_cost': self.overhead_cost,
+            'total_cost': self.total_cost
+        }, fields)
 
 # 工艺参数模板表
 class ProcessTemplate(db.Model):
@@ -280,8 +420,8 @@ class ProcessTemplate(db.Model):
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    def to_dict(self):
-        return {
+    def to_dict(self, fields=None):
+        return select_fields({
             'id': self.id,
             'node_type': self.node_type.value,
             'name': self.name,
@@ -290,4 +430,86 @@ class ProcessTemplate(db.Model):
             'default_time_minutes': self.default_time_minutes,
             'default_labor_cost_per_hour': self.default_labor_cost_per_hour,
             'default_machine_cost_per_hour': self.default_machine_cost_per_hour
-        }
\ No newline at end of file
+        }, fields)
+
+# 缓存版本表（多进程共享的缓存失效计数器）
+class CacheVersion(db.Model):
+    __tablename__ = 'cache_versions'
+
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @classmethod
+    def current(cls, name):
+        """读取当前版本号，不存在时为 0"""
+        return db.session.query(cls.version).filter(cls.name == name).scalar() or 0
+
+    @classmethod
+    def bump(cls, name):
+        """在当前事务中把版本号加一，随业务数据一起提交"""
+        updated = cls.query.filter(cls.name == name).update(
+            {cls.version: cls.version + 1, cls.updated_at: datetime.utcnow()},
+            synchronize_session=False
+        )
+        if not updated:
+            db.session.add(cls(name=name, version=1))
+
+# 后台任务表（任务状态、进度和结果，见 jobs.py）
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status_created_at', 'status', 'created_at'),
+        db.Index('ix_jobs_kind_created_at', 'kind', 'created_at'),
+    )
+
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  # 任务类型，对应 jobs.job_handler 注册的处理函数
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending/running/completed/failed/cancelled
+    params = db.Column(db.JSON)
+
+    # 进度（total 未知时为空）
+    total = db.Column(db.Integer)
+    processed = db.Column(db.Integer, default=0)
+    cancel_requested = db.Column(db.Boolean, default=False)
+
+    # 结果：result 为处理函数返回的摘要，结果文件通过下载接口获取
+    result = db.Column(db.JSON)
+    result_path = db.Column(db.String(500))
+    result_filename = db.Column(db.String(200))
+    result_mimetype = db.Column(db.String(100))
+    error = db.Column(db.Text)
+
+    # 执行任务的进程（主机名:进程号）和最近一次心跳，用于判断运行中的任务是否已中断
+    owner = db.Column(db.String(100))
+    heartbeat_at = db.Column(db.DateTime)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        queued_until = self.started_at or self.finished_at
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'params': self.params,
+            'total': self.total,
+            'processed': self.processed,
+            'progress': self.processed / self.total if self.total else None,
+            'cancel_requested': bool(self.cancel_requested),
+            'result': self.result,
+            'has_result_file': bool(self.result_path),
+            'result_filename': self.result_filename,
+            'error': self.error,
+            'owner': self.owner,
+            'heartbeat_at': self.heartbeat_at.isoformat() if self.heartbeat_at else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            # 排队耗时和执行耗时（秒）
+            'queue_seconds': (queued_until - self.created_at).total_seconds() if queued_until else None,
+            'run_seconds': (self.finished_at - self.started_at).total_seconds()
+            if self.started_at and self.finished_at else None
+        }
@@ -0,0 +1,154 @@
+"""
+游标（keyset）分页工具
+
+按排序列的取值而不是 OFFSET 定位下一页：每页只需一条 `WHERE (排序列) > (上一页末行) LIMIT n`
+查询，配合索引时深翻页与第一页代价相同。游标对客户端不透明（base64 编码的排序列取值）。
+"""
+
+import base64
+import json
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = 1000  # 流式输出时每次查询的行数
+
+
+class CursorError(ValueError):
+    """分页游标不合法"""
+
+
+def encode_cursor(values):
+    """把末行的排序列取值编码为不透明游标"""
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, columns):
+    """解码游标，并按排序列类型还原取值"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise CursorError('无效的分页游标')
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise CursorError('无效的分页游标')
+
+    decoded = []
+    for column, value in zip(columns, values):
+        if value is not None and column.type.python_type is datetime:
+            try:
+                value = datetime.fromisoformat(value)
+            except (ValueError, TypeError):
+                raise CursorError('无效的分页游标')
+        decoded.append(value)
+    return decoded
+
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE):
+    """解析每页条数，限制在 1..MAX_PAGE_SIZE"""
+    try:
+        limit = int(value) if value not in (None, '') else default
+    except (TypeError, ValueError):
+        raise CursorError('limit 必须是整数')
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def keyset_after(columns, values, descending=False):
+    """排在游标之后的行的过滤条件（多列时使用行值比较）"""
+    if len(columns) == 1:
+        left, right = columns[0], values[0]
+    else:
+        left, right = tuple_(*columns), tuple_(*values)
+    return left < right if descending else left > right
+
+
+def _ordered(query, columns, descending):
+    return query.order_by(*[column.desc() if descending else column for column in columns])
+
+
+def _row_key(row, columns):
+    return [getattr(row, column.key) for column in columns]
+
+
+def keyset_page(query, columns, cursor=None, limit=DEFAULT_PAGE_SIZE, descending=False):
+    """
+    取一页数据。
+    columns: 排序列（最后一列须唯一，一般为主键）
+    返回 (rows, next_cursor)，没有下一页时 next_cursor 为 None
+    """
+    if cursor:
+        query = query.filter(keyset_after(columns, decode_cursor(cursor, columns), descending))
+    rows = _ordered(query, columns, descending).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(_row_key(rows[-1], columns))
+
+
+def iter_keyset(query, columns, cursor=None, chunk_size=STREAM_CHUNK_SIZE, descending=False):
+    """
+    按游标分块遍历全部结果，每块一条查询，块之间不占用数据库游标。
+    依次产出每块的行列表。
+    """
+    values = decode_cursor(cursor, columns) if cursor else None
+    while True:
+        chunk_query = query if values is None else query.filter(keyset_after(columns, values, descending))
+        rows = _ordered(chunk_query, columns, descending).limit(chunk_size).all()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        values = _row_key(rows[-1], columns)
+
+
+class CountCache:
+    """
+    缓存 COUNT(*) 结果，在有效期内复用，用作近似总数。
+    避免游标分页时每一页都做一次全表计数。
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def count(self, key, query):
+        """返回缓存的计数，过期后重新统计"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._counts.get(key)
+        if cached and cached[1] > now:
+            return cached[0]
+        total = query.order_by(None).count()
+        with self._lock:
+            self._counts[key] = (total, now + self.ttl)
+        return total
+
+    def clear(self):
+        """清空全部缓存计数"""
+        with self._lock:
+            self._counts.clear()
+
+
+count_cache = CountCache()
+
+
+def count_total(mode, key, query):
+    """
+    按 total 参数统计总数。
+    mode: exact 精确计数 / approx 缓存计数 / none 不统计（返回 None）
+    """
+    if mode == 'exact':
+        return query.order_by(None).count()
+    if mode == 'approx':
+        return count_cache.count(key, query)
+    if mode in (None, '', 'none'):
+        return None
+    raise CursorError(f'total 参数只能是 exact、approx 或 none: {mode}')
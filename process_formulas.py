@@ -0,0 +1,192 @@
+"""
+工艺工时公式引擎
+
+将工艺路径的工时公式解析为受限的表达式树并缓存编译结果，
+同一公式既可按单行标量求值，也可对整列 NumPy 数组一次性向量化求值。
+"""
+
+import ast
+from functools import lru_cache
+
+import numpy as np
+
+# 工艺路径工时公式（变量: a 长, b 宽, c 厚, d 数量, parameters 工艺参数）
+PROCESS_FORMULAS = {
+    '电子锯开料': '(a+b)*2*5.76/1000*c/15*d',
+    'CNC开料': 'parameters/50+15*d',
+    '排钻': 'parameters*20*d',
+    '数控排钻': 'parameters*3+15*d',
+    '锣槽': 'parameters/180+12*d',
+    '铣型': 'parameters*d',
+    '机器封边': '(a+b)*2/1000*28.8*d',
+    '人工封边': 'parameters/1000*40*d',
+    '空心板': '864*d if (a+b) > 1600 else 720*d if (a+b) > 1100 else 576*d if (a+b) > 700 else 432*d',
+    '假厚板': '345*d if (a+b) > 1600 else 288*d if (a+b) > 1100 else 230*d if (a+b) > 700 else 172*d',
+    '栅格门': '445*d if (a+b) > 1600 else 388*d if (a+b) > 1100 else 330*d if (a+b) > 700 else 272*d',
+    '装饰件': 'parameters*d',
+    '芯板门': '167.8*d if (a+b) > 1600 else 152.8*d if (a+b) > 1100 else 137.8*d if (a+b) > 700 else 122.8*d',
+    '其他拼装': 'parameters*d',
+    '导轨': 'parameters*d',
+    '脚钉': 'parameters*10*d',
+    '002公扣': 'parameters*15*d',
+    '002母扣': 'parameters*10*d',
+    '螺丝': 'parameters*8*d',
+    '其他预装': 'parameters*d',
+    'logo': '12*d',
+    '字母标': '6*d',
+    '清洁': 'a*b/1000*20*d',
+    '修边': '(a+b)*2/1000*28.8*d',
+    '修色': '(a+b)*2/1000*28.8*d',
+    # ... 添加其他工艺路径的公式 ...
+}
+
+# 各城市工价（元/秒）
+WORK_PRICES = {
+    '东莞': 0.006694444,
+    '惠州': 0.00625,
+    '杭州': 0.008138889,
+    '苏州': 0.008083333,
+    '宁波': 0.008027778,
+    '无锡': 0.008,
+    '南京': 0.007916667,
+    '青岛': 0.007277778,
+    '保定': 0.006861111,
+    '佛山': 0.006777778,
+    '沈阳': 0.006722222,
+    '长春': 0.006694444,
+    '柳州': 0.006416667,
+    '合肥': 0.006138889,
+}
+
+# 未配置城市时使用的默认工价
+DEFAULT_WORK_PRICE = 0.007
+
+# 需要输入工艺参数的工艺路径
+PROCESS_PATHS_REQUIRE_PARAMETERS = [
+    'CNC开料',
+    '排钻',
+    '数控排钻',
+    '锣槽',
+    '铣型',
+    '人工封边',
+    '其他拼装',
+    '导轨',
+    '脚钉',
+    '002公扣',
+    '002母扣',
+    '螺丝',
+    '其他预装'
+]
+
+FORMULA_VARIABLES = ('a', 'b', 'c', 'd', 'parameters')
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.IfExp, ast.Compare, ast.BoolOp,
+    ast.Name, ast.Load, ast.Constant,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.UAdd, ast.USub,
+    ast.Gt, ast.GtE, ast.Lt, ast.LtE, ast.Eq, ast.NotEq,
+    ast.And, ast.Or,
+)
+
+
+class FormulaError(ValueError):
+    """工时公式不合法"""
+
+
+class _Vectorize(ast.NodeTransformer):
+    """把条件表达式改写为逐元素的 NumPy 运算"""
+
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        return ast.Call(func=ast.Name(id='_where', ctx=ast.Load()),
+                        args=[node.test, node.body, node.orelse], keywords=[])
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        func = '_and' if isinstance(node.op, ast.And) else '_or'
+        result = node.values[0]
+        for value in node.values[1:]:
+            result = ast.Call(func=ast.Name(id=func, ctx=ast.Load()),
+                              args=[result, value], keywords=[])
+        return result
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if len(node.ops) == 1:
+            return node
+        # 链式比较 a < b < c 拆成 (a < b) & (b < c)
+        parts = []
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            parts.append(ast.Compare(left=left, ops=[op], comparators=[right]))
+            left = right
+        return self.visit_BoolOp(ast.BoolOp(op=ast.And(), values=parts))
+
+
+class ProcessFormula:
+    """已编译的工时公式，标量与向量两种求值方式结果一致"""
+
+    def __init__(self, expression):
+        self.expression = expression
+        try:
+            tree = ast.parse(expression.strip(), mode='eval')
+        except SyntaxError as e:
+            raise FormulaError(f"公式语法错误: {expression!r} ({e.msg})") from None
+
+        for node in ast.walk(tree):
+            if not isinstance(node, _ALLOWED_NODES):
+                raise FormulaError(f"公式包含不允许的语法 {type(node).__name__}: {expression!r}")
+            if isinstance(node, ast.Name) and node.id not in FORMULA_VARIABLES:
+                raise FormulaError(f"公式包含未知变量 {node.id!r}: {expression!r}")
+            if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+                raise FormulaError(f"公式只允许数值常量: {expression!r}")
+
+        self.variables = frozenset(
+            node.id for node in ast.walk(tree) if isinstance(node, ast.Name)
+        )
+        vector_tree = ast.fix_missing_locations(_Vectorize().visit(tree))
+        self._vector_code = compile(vector_tree, f'<formula {expression}>', 'eval')
+
+    def __repr__(self):
+        return f"ProcessFormula({self.expression!r})"
+
+    def __call__(self, a=0, b=0, c=0, d=0, parameters=0):
+        """单行标量求值（走同一份向量化代码，除以零等边界情况与整列求值一致）"""
+        return float(self.evaluate(a=a, b=b, c=c, d=d, parameters=parameters))
+
+    def evaluate(self, a=0, b=0, c=0, d=0, parameters=0):
+        """
+        整列向量化求值，返回与输入广播后形状一致的数组。
+        除以零不抛异常：按浮点规则得到 inf（0/0 为 nan），条件表达式未选中分支中的除零不影响结果。
+        """
+        namespace = {
+            '__builtins__': {},
+            '_where': np.where,
+            '_and': np.logical_and,
+            '_or': np.logical_or,
+            'a': np.asarray(a, dtype=float),
+            'b': np.asarray(b, dtype=float),
+            'c': np.asarray(c, dtype=float),
+            'd': np.asarray(d, dtype=float),
+            'parameters': np.asarray(parameters, dtype=float),
+        }
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = eval(self._vector_code, namespace)
+        shape = np.broadcast_shapes(*(namespace[name].shape for name in FORMULA_VARIABLES))
+        return np.broadcast_to(result, shape)
+
+
+@lru_cache(maxsize=256)
+def compile_formula(expression):
+    """解析并缓存工时公式"""
+    return ProcessFormula(expression)
+
+
+def get_formula(process_path, formulas=None):
+    """按工艺路径获取已编译的公式"""
+    formulas = PROCESS_FORMULAS if formulas is None else formulas
+    if process_path not in formulas:
+        raise FormulaError(f"工艺路径 {process_path!r} 没有配置工时公式")
+    return compile_formula(formulas[process_path])
+
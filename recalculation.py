@@ -0,0 +1,172 @@
+"""
+成本计算后台重算
+
+材料单价/损耗率或工艺节点参数变化后，已保存的成本计算会过期。依赖关系直接走已有索引：
+材料 -> material_usages.material_id -> 成本计算；节点 -> workflow_nodes.workflow_id -> cost_calculations.workflow_id。
+
+材料价格表导入、材料修改和工艺模板修改在提交后调用 schedule_recalculation，有受影响的记录时自动提交重算任务；
+也可以通过 POST /api/workflow/recalculations 手动提交。
+重算作为后台任务执行（见 jobs.py），只处理受影响且未被取代的计算记录，按批加载、计算并提交：
+新记录的 supersedes_id 指向旧记录，旧记录写入 superseded_by_id，成本日汇总同步扣减旧值、累加新值。
+"""
+
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import or_, select
+
+from models import db, CostCalculation, MaterialUsage, WorkflowNode
+import cost_engine
+from cost_rollup import update_daily_rollup
+from material_prices import parse_date
+import jobs
+from jobs import job_handler
+
+RECALC_CHUNK_SIZE = 500
+MAX_REPORTED_FAILURES = 100  # 任务结果中最多保留的失败明细
+
+
+def affected_query(material_ids=(), workflow_ids=(), node_ids=()):
+    """依赖这些材料、工艺流程或节点且尚未被取代的成本计算ID查询；没有指定任何ID时返回 None"""
+    material_ids = set(material_ids or ())
+    workflow_ids = set(workflow_ids or ())
+    if node_ids:
+        workflow_ids |= {
+            workflow_id for (workflow_id,) in
+            db.session.query(WorkflowNode.workflow_id).filter(WorkflowNode.id.in_(set(node_ids))).distinct()
+        }
+
+    conditions = []
+    if material_ids:
+        conditions.append(CostCalculation.id.in_(
+            select(MaterialUsage.cost_calculation_id).where(MaterialUsage.material_id.in_(material_ids))
+        ))
+    if workflow_ids:
+        conditions.append(CostCalculation.workflow_id.in_(workflow_ids))
+    if not conditions:
+        return None
+    return db.session.query(CostCalculation.id).filter(
+        or_(*conditions), CostCalculation.superseded_by_id.is_(None)
+    )
+
+
+def affected_calculation_ids(material_ids=(), workflow_ids=(), node_ids=()):
+    """返回依赖这些材料、工艺流程或节点且尚未被取代的成本计算ID（升序）"""
+    query = affected_query(material_ids, workflow_ids, node_ids)
+    if query is None:
+        return []
+    return [calculation_id for (calculation_id,) in query.order_by(CostCalculation.id)]
+
+
+def schedule_recalculation(material_ids=(), workflow_ids=(), node_ids=()):
+    """
+    数据变更提交后调用：存在受影响的计算记录时提交重算任务并返回 Job，否则返回 None。
+    jobs.submit 会提交当前会话，因此必须在变更本身提交之后调用。
+    """
+    material_ids = sorted(set(material_ids or ()))
+    workflow_ids = sorted(set(workflow_ids or ()))
+    node_ids = sorted(set(node_ids or ()))
+    query = affected_query(material_ids, workflow_ids, node_ids)
+    if query is None or query.first() is None:
+        return None
+    return jobs.submit('recalculation', {
+        'material_ids': material_ids, 'workflow_ids': workflow_ids, 'node_ids': node_ids
+    })
+
+
+def overhead_rate(calculation):
+    """取原计算使用的间接成本比例（早期记录未保存比例时按金额反推）"""
+    summary = (calculation.cost_breakdown or {}).get('summary') or {}
+    if summary.get('overhead_rate') is not None:
+        return summary['overhead_rate']
+    base = (calculation.material_cost or 0) + (calculation.labor_cost or 0) + (calculation.machine_cost or 0)
+    return (calculation.overhead_cost or 0) / base if base else cost_engine.DEFAULT_OVERHEAD_RATE
+
+
+def recalculate_chunk(calculation_ids):
+    """
+    在当前事务中重算一批计算记录（已被取代的跳过），返回 (新记录数, 失败明细)。
+    按原记录的数量、材料用量、间接成本比例和计价日期重新计算，计算时间沿用原记录。
+    """
+    calculations = CostCalculation.query.filter(
+        CostCalculation.id.in_(calculation_ids), CostCalculation.superseded_by_id.is_(None)
+    ).all()
+    if not calculations:
+        return 0, []
+
+    materials_data = defaultdict(list)
+    usages = db.session.query(
+        MaterialUsage.cost_calculation_id, MaterialUsage.material_id, MaterialUsage.planned_quantity
+    ).filter(MaterialUsage.cost_calculation_id.in_([calculation.id for calculation in calculations]))
+    for calculation_id, material_id, planned_quantity in usages:
+        materials_data[calculation_id].append({'material_id': material_id, 'quantity': planned_quantity})
+
+    material_ids = {item['material_id'] for items in materials_data.values() for item in items}
+    materials = cost_engine.load_materials(material_ids)
+    templates = cost_engine.load_templates(calculation.workflow_id for calculation in calculations)
+    plans = cost_engine.cost_plan_cache.get_plans(templates.values())
+    prices = {}  # 计价日期 -> {材料ID: 单价}
+
+    recalculated_at = datetime.utcnow().isoformat()
+    pairs = []
+    replaced = []
+    failures = []
+    for old in calculations:
+        try:
+            plan = plans.get(old.workflow_id)
+            if plan is None:
+                raise LookupError(f'工艺流程模板 {old.workflow_id} 不存在')
+            price_date = ((old.cost_breakdown or {}).get('summary') or {}).get('price_date')
+            if price_date not in prices:
+                prices[price_date] = cost_engine.load_prices(material_ids, parse_date(price_date))
+            result = cost_engine.compute_cost(
+                plan, old.quantity, materials_data.get(old.id), materials, overhead_rate(old),
+                prices[price_date]
+            )
+        except Exception as e:
+            failures.append({'calculation_id': old.id, 'error': str(e)})
+            continue
+
+        summary = result['cost_breakdown']['summary']
+        if price_date:
+            summary['price_date'] = price_date
+        summary['recalculated_at'] = recalculated_at
+        calculation = cost_engine.build_calculation(
+            result, old.workflow_id, old.quantity, old.product_sku, calculation_date=old.calculation_date
+        )
+        calculation.supersedes_id = old.id
+        pairs.append((calculation, result['cost_breakdown']['materials']))
+        replaced.append(old)
+
+    # 旧记录退出汇总，新记录在保存时累加
+    update_daily_rollup(replaced, sign=-1)
+    cost_engine.save_calculations(pairs)
+    for old, (calculation, _) in zip(replaced, pairs):
+        old.superseded_by_id = calculation.id
+    return len(pairs), failures
+
+
+@job_handler('recalculation', exclusive=True)
+def run_recalculation(context, params):
+    """
+    重算任务处理函数（见 jobs.py）。同类任务在数据库中互斥领取，多个进程之间也串行执行，
+    同一条记录不会被两个任务同时取代。
+    params: material_ids / workflow_ids / node_ids，可选 chunk_size
+    """
+    calculation_ids = affected_calculation_ids(
+        params.get('material_ids'), params.get('workflow_ids'), params.get('node_ids')
+    )
+    chunk_size = params.get('chunk_size') or RECALC_CHUNK_SIZE
+    context.progress(0, len(calculation_ids))
+
+    summary = {'affected': len(calculation_ids), 'recalculated': 0, 'failed': 0, 'failures': []}
+    for start in range(0, len(calculation_ids), chunk_size):
+        chunk = calculation_ids[start:start + chunk_size]
+        recalculated, failures = recalculate_chunk(chunk)
+        db.session.commit()
+        db.session.expunge_all()
+        summary['recalculated'] += recalculated
+        summary['failed'] += len(failures)
+        summary['failures'].extend(failures[:MAX_REPORTED_FAILURES - len(summary['failures'])])
+        context.progress(start + len(chunk))
+    return summary
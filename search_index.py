@@ -0,0 +1,320 @@
+"""
+全文检索
+
+材料、产品和工艺流程模板共用一张 SQLite FTS5 索引表，按相关度排序。
+SQLite 自带分词器把连续的中文当作一个词，因此中文在写入前切成二元组（bigram）
+和单字两列：多字查询按二元组短语匹配（「颗粒」可命中「颗粒板」），单字查询匹配单字列；
+英文和数字交给 FTS5 的 unicode61 分词，按前缀匹配（「screw」可命中「SCREW-4X16」）。
+写入和查询时都先在中文与字母数字的交界处切开（「18mm颗粒板」→「18mm」+「颗粒板」），
+两边切法一致，混写的名称按各自部分分别命中。
+
+ORM 写入在 flush 后同步更新索引（同一事务）；绕过 ORM 的批量写入需调用 reindex()。
+SQLite 未编译 FTS5 时自动退回 LIKE 查询。
+"""
+
+import re
+import weakref
+from types import SimpleNamespace
+
+from sqlalchemy import event, inspect, literal, literal_column, or_, select, table, column
+from sqlalchemy.exc import OperationalError
+
+from models import db, Material, Product, WorkflowTemplate, CacheVersion
+
+INDEX_TABLE = 'search_index'
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+REINDEX_CHUNK_SIZE = 1000
+
+# 索引格式版本（记录在 cache_versions 中），分词方式变化时加一，启动时自动重建旧格式的索引
+INDEX_FORMAT_KEY = 'search_index_format'
+INDEX_FORMAT = 2
+
+_CJK_RUN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+_WORD = re.compile(r'[^\W_]+')  # 与 unicode61 的词字符一致（字母和数字）
+
+# 实体 -> (模型, 编号, 索引字段, 标题函数, 副标题函数)
+ENTITIES = {
+    'materials': (Material, 1, ('name', 'code', 'supplier'),
+                  lambda m: m.name, lambda m: m.code),
+    'products': (Product, 2, ('series', 'spu', 'sku'),
+                 lambda p: p.sku, lambda p: f'{p.series} / {p.spu}'),
+    'templates': (WorkflowTemplate, 3, ('name', 'description'),
+                  lambda t: t.name, lambda t: t.product_series),
+}
+_ENTITY_BY_MODEL = {model: name for name, (model, *_rest) in ENTITIES.items()}
+
+# bm25 各列权重（与建表列顺序一致），实体列只用于过滤，不参与评分；
+# 以 rank MATCH 传给 FTS5，ORDER BY rank LIMIT 由 FTS5 在内部完成排序
+RANK_FUNCTION = 'bm25(0, 0, 0, 0, 1.0, 1.0, 0.5)'
+
+search_table = table(
+    INDEX_TABLE,
+    column('rowid'), column('entity'), column('entity_id'), column('title'), column('subtitle'),
+    column('text'), column('bigrams'), column('unigrams'),
+)
+
+# 已建好索引表的数据库引擎
+_available = weakref.WeakKeyDictionary()
+
+
+def cjk_bigrams(text):
+    """中文连续片段切成二元组，单字片段保留单字"""
+    grams = []
+    for run in _CJK_RUN.findall(text or ''):
+        if len(run) == 1:
+            grams.append(run)
+        else:
+            grams.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return ' '.join(grams)
+
+
+def cjk_unigrams(text):
+    """中文逐字切分"""
+    return ' '.join(''.join(_CJK_RUN.findall(text or '')))
+
+
+def words(text):
+    """中文以外的词（中文片段视为分隔符，「颗粒板3」→ ['3']），写入 text 列和构造查询共用"""
+    return _WORD.findall(_CJK_RUN.sub(' ', text or ''))
+
+
+def build_match_query(query, entities=None):
+    """
+    把用户输入转换为 FTS5 查询表达式，各词之间为 AND；entities 限定实体范围。
+    没有可检索的词时返回 None。
+    """
+    terms = []
+    for word in words(query):
+        terms.append(f'text : "{word.lower()}"*')
+    for run in _CJK_RUN.findall(query or ''):
+        if len(run) == 1:
+            terms.append(f'unigrams : "{run}"')
+        else:
+            terms.append(f'bigrams : "{cjk_bigrams(run)}"')
+    if not terms:
+        return None
+    if entities:
+        terms.append('(' + ' OR '.join(f'entity : "{entity}"' for entity in entities) + ')')
+    return ' AND '.join(terms)
+
+
+def _rowid(entity, entity_id):
+    return entity_id * 4 + ENTITIES[entity][1]
+
+
+def index_row(entity, obj):
+    """生成一条索引记录"""
+    _, _, fields, title, subtitle = ENTITIES[entity]
+    text = ' '.join(str(getattr(obj, field)) for field in fields if getattr(obj, field))
+    return {
+        'rowid': _rowid(entity, obj.id),
+        'entity': entity,
+        'entity_id': obj.id,
+        'title': title(obj),
+        'subtitle': subtitle(obj),
+        'text': ' '.join(words(text)),
+        'bigrams': cjk_bigrams(text),
+        'unigrams': cjk_unigrams(text),
+    }
+
+
+def create_search_index(connection):
+    """创建 FTS5 索引表，返回是否可用"""
+    try:
+        connection.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {INDEX_TABLE} USING fts5("
+            "entity, entity_id UNINDEXED, title UNINDEXED, subtitle UNINDEXED, "
+            "text, bigrams, unigrams, tokenize = 'unicode61')"
+        )
+    except OperationalError:
+        _available[connection.engine] = False
+        return False
+    _available[connection.engine] = True
+    return True
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _after_create(target, connection, **kw):
+    create_search_index(connection)
+
+
+def is_available(engine=None):
+    """当前数据库是否已启用全文索引"""
+    engine = engine or db.engine
+    if engine not in _available:
+        with engine.connect() as connection:
+            _available[engine] = bool(connection.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (INDEX_TABLE,)
+            ).first())
+    return _available[engine]
+
+
+def _write(connection, entity, objects=(), deleted_ids=()):
+    """删除旧索引记录并写入新记录"""
+    rowids = [_rowid(entity, obj.id) for obj in objects] + [_rowid(entity, i) for i in deleted_ids]
+    if rowids:
+        connection.execute(search_table.delete().where(search_table.c.rowid.in_(rowids)))
+    rows = [index_row(entity, obj) for obj in objects]
+    if rows:
+        connection.execute(search_table.insert(), rows)
+
+
+def _changed(obj, fields):
+    state = inspect(obj)
+    return any(state.attrs[field].history.has_changes() for field in fields)
+
+
+def _after_flush(session, flush_context):
+    """flush 后在同一事务中同步索引"""
+    touched = {}
+    deleted = {}
+    for obj in session.new:
+        entity = _ENTITY_BY_MODEL.get(type(obj))
+        if entity:
+            touched.setdefault(entity, []).append(obj)
+    for obj in session.dirty:
+        entity = _ENTITY_BY_MODEL.get(type(obj))
+        if entity and _changed(obj, ENTITIES[entity][2]):
+            touched.setdefault(entity, []).append(obj)
+    for obj in session.deleted:
+        entity = _ENTITY_BY_MODEL.get(type(obj))
+        if entity:
+            deleted.setdefault(entity, []).append(obj.id)
+    if not touched and not deleted:
+        return
+
+    connection = session.connection()
+    if not is_available(connection.engine):
+        return
+    for entity in set(touched) | set(deleted):
+        _write(connection, entity, touched.get(entity, ()), deleted.get(entity, ()))
+
+
+def reindex(entity, ids):
+    """重建指定记录的索引（用于绕过 ORM 的批量写入），不存在的ID视为已删除"""
+    ids = list(ids)
+    if not ids or not is_available():
+        return
+    model = ENTITIES[entity][0]
+    connection = db.session.connection()
+    for start in range(0, len(ids), REINDEX_CHUNK_SIZE):
+        chunk = ids[start:start + REINDEX_CHUNK_SIZE]
+        objects = model.query.filter(model.id.in_(chunk)).all()
+        found = {obj.id for obj in objects}
+        _write(connection, entity, objects, [i for i in chunk if i not in found])
+
+
+def index_records(entity, records):
+    """用已有的字段值直接写入索引（records 为含 id 和索引字段的 dict），省去回查数据库"""
+    if not records or not is_available():
+        return
+    _write(db.session.connection(), entity, [SimpleNamespace(**record) for record in records])
+
+
+def _mark_index_format():
+    """记录当前索引格式版本（随重建一起提交）"""
+    db.session.merge(CacheVersion(name=INDEX_FORMAT_KEY, version=INDEX_FORMAT))
+
+
+def rebuild_search_index():
+    """清空并重建全部索引，返回 {实体: 记录数}（调用方负责提交）"""
+    connection = db.session.connection()
+    create_search_index(connection)
+    if not is_available():
+        return {}
+    _mark_index_format()
+    connection.execute(search_table.delete())
+    counts = {}
+    for entity, (model, *_rest) in ENTITIES.items():
+        counts[entity] = 0
+        last_id = 0
+        while True:
+            objects = (model.query.filter(model.id > last_id)
+                       .order_by(model.id).limit(REINDEX_CHUNK_SIZE).all())
+            if not objects:
+                break
+            connection.execute(search_table.insert(), [index_row(entity, obj) for obj in objects])
+            counts[entity] += len(objects)
+            last_id = objects[-1].id
+            db.session.expunge_all()
+    return counts
+
+
+def ensure_search_index():
+    """
+    索引为空而数据表中已有数据（首次升级），或索引是旧的分词格式时自动重建，返回是否执行了重建。
+    """
+    if not is_available():
+        return False
+    if CacheVersion.current(INDEX_FORMAT_KEY) >= INDEX_FORMAT:
+        if db.session.execute(select(search_table.c.rowid).limit(1)).first():
+            return False
+    if not any(db.session.query(model.id).first() for model, *_rest in ENTITIES.values()):
+        _mark_index_format()
+        return False
+    rebuild_search_index()
+    return True
+
+
+def match_ids(entity, query):
+    """
+    返回匹配记录ID的子查询，可用于 model.id.in_(...)。
+    不能使用全文索引时返回 None，由调用方退回 LIKE 查询。
+    """
+    match = build_match_query(query, [entity])
+    if match is None or not is_available():
+        return None
+    return select(search_table.c.entity_id).where(_matches(match))
+
+
+def _matches(match):
+    return literal_column(INDEX_TABLE).op('MATCH')(match)
+
+
+def like_filter(entity, query):
+    """LIKE 兜底查询条件"""
+    model, _, fields, _, _ = ENTITIES[entity]
+    return or_(*[getattr(model, field).contains(query) for field in fields])
+
+
+def search(query, entities=None, limit=DEFAULT_SEARCH_LIMIT):
+    """
+    跨实体检索，按相关度排序；entities 含未知的实体名时抛出 ValueError。
+    返回 [{'entity', 'id', 'title', 'subtitle', 'score'}, ...]
+    """
+    entities = list(entities or ENTITIES)
+    unknown = [entity for entity in entities if entity not in ENTITIES]
+    if unknown:
+        raise ValueError(f"未知的搜索类型: {', '.join(map(str, unknown))}")
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+    match = build_match_query(query, entities if len(entities) < len(ENTITIES) else None)
+    if match is not None and is_available():
+        # 全部命中记录按 bm25 排序，只返回前 limit 条
+        rank = literal_column('rank')
+        stmt = (
+            select(search_table.c.entity, search_table.c.entity_id, search_table.c.title,
+                   search_table.c.subtitle, rank)
+            .where(_matches(match), rank.op('MATCH')(literal(RANK_FUNCTION)))
+            .order_by(rank)
+            .limit(limit)
+        )
+        return [
+            {'entity': entity, 'id': entity_id, 'title': title, 'subtitle': subtitle, 'score': -rank}
+            for entity, entity_id, title, subtitle, rank in db.session.execute(stmt)
+        ]
+
+    results = []
+    for entity in entities:
+        if not query:
+            break
+        model, _, _, title, subtitle = ENTITIES[entity]
+        for obj in model.query.filter(like_filter(entity, query)).limit(limit - len(results)):
+            results.append({'entity': entity, 'id': obj.id, 'title': title(obj),
+                            'subtitle': subtitle(obj), 'score': None})
+        if len(results) >= limit:
+            break
+    return results
+
+
+event.listen(db.session, 'after_flush', _after_flush)
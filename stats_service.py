@@ -0,0 +1,125 @@
+"""
+产品统计服务
+
+看板和 /api/stats 共用的统计数据，全部在 SQL 端分组计数，
+内存占用只与分组数量有关，与产品总数无关。
+渲染好的看板数据按产品版本号缓存，产品写入时递增版本号使各进程缓存失效。
+"""
+
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import func
+
+from models import db, Product, CacheVersion
+
+PRODUCTS_CACHE_KEY = 'products'
+DEFAULT_CACHE_TTL = 300  # 秒，版本号之外的兜底过期时间
+
+
+def product_stats():
+    """
+    按 系列 × 文件受控 × 标准化落地 分组计数，再汇总出各维度统计。
+    返回 dict: total, by_series, by_file_control, by_standardization, combinations
+    """
+    rows = (
+        db.session.query(
+            Product.series,
+            Product.file_control,
+            Product.standardization,
+            func.count(Product.id)
+        )
+        .group_by(Product.series, Product.file_control, Product.standardization)
+        .order_by(Product.series, Product.file_control, Product.standardization)
+        .all()
+    )
+
+    stats = {
+        'total': 0,
+        'by_series': {},
+        'by_file_control': {},
+        'by_standardization': {},
+        'combinations': {}
+    }
+    for series, file_control, standardization, count in rows:
+        stats['total'] += count
+        stats['by_series'][series] = stats['by_series'].get(series, 0) + count
+        stats['by_file_control'][file_control] = stats['by_file_control'].get(file_control, 0) + count
+        stats['by_standardization'][standardization] = stats['by_standardization'].get(standardization, 0) + count
+
+        # 按状态组合统计
+        combo = f"{file_control}-{standardization}"
+        stats['combinations'][combo] = stats['combinations'].get(combo, 0) + count
+
+    return stats
+
+
+def invalidate_product_caches():
+    """产品数据变更后调用：在当前事务中递增版本号，并清空本进程缓存"""
+    CacheVersion.bump(PRODUCTS_CACHE_KEY)
+    dashboard_cache.clear()
+
+
+class VersionedCache:
+    """
+    进程内缓存单个计算结果。
+    每次读取比较数据库中的版本号，版本变化或超过 TTL 时重建。
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self._lock = threading.Lock()
+        self._value = None
+        self._version = None
+        self._built_at = 0
+        self.hits = 0
+        self.misses = 0
+        self.last_rebuild_ms = 0
+        self.total_rebuild_ms = 0
+
+    def _ttl(self):
+        return current_app.config.get('CACHE_DEFAULT_TIMEOUT', DEFAULT_CACHE_TTL)
+
+    def get(self, builder):
+        """返回缓存值，失效时调用 builder() 重建"""
+        version = CacheVersion.current(self.key)
+        with self._lock:
+            fresh = (self._value is not None and self._version == version
+                     and time.monotonic() - self._built_at < self._ttl())
+            if fresh:
+                self.hits += 1
+                return self._value
+
+            self.misses += 1
+            started = time.perf_counter()
+            self._value = builder()
+            self.last_rebuild_ms = (time.perf_counter() - started) * 1000
+            self.total_rebuild_ms += self.last_rebuild_ms
+            self._version = version
+            self._built_at = time.monotonic()
+            return self._value
+
+    def clear(self):
+        """清空本进程缓存"""
+        with self._lock:
+            self._value = None
+            self._version = None
+
+    def stats(self):
+        """命中率和重建耗时"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'key': self.key,
+                'version': self._version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0,
+                'last_rebuild_ms': self.last_rebuild_ms,
+                'avg_rebuild_ms': self.total_rebuild_ms / self.misses if self.misses else 0,
+                'age_seconds': time.monotonic() - self._built_at if self._value is not None else None
+            }
+
+
+dashboard_cache = VersionedCache(PRODUCTS_CACHE_KEY)
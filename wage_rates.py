@@ -0,0 +1,116 @@
+"""
+城市工价
+
+各城市的工价（元/秒）按生效日期保存在 city_wage_rates 表中，首次启动时用 process_formulas.WORK_PRICES 初始化。
+按日期查询走 (city, effective_date) 唯一索引，每个城市一次索引查找。
+
+桌面端不运行 Flask 应用，通过 read_wage_rates() 直接读取同一个数据库文件，读取失败时使用内置工价。
+"""
+
+from datetime import date, datetime
+
+from sqlalchemy import create_engine, func, inspect, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import aliased
+
+from models import db, CityWageRate
+from material_prices import parse_date
+from process_formulas import WORK_PRICES
+
+SEED_EFFECTIVE_DATE = date(2000, 1, 1)  # 内置工价的生效日期（早于任何计价日期）
+SEED_SOURCE = 'process_formulas.WORK_PRICES'
+
+
+def _rates_query(as_of, cities=None):
+    """指定日期各城市生效工价的查询（city, rate_per_second）"""
+    earlier = aliased(CityWageRate)
+    latest_date = (
+        select(func.max(earlier.effective_date))
+        .where(earlier.city == CityWageRate.city, earlier.effective_date <= as_of)
+        .scalar_subquery()
+    )
+    query = select(CityWageRate.city, CityWageRate.rate_per_second).where(
+        CityWageRate.effective_date == latest_date
+    )
+    if cities:
+        query = query.where(CityWageRate.city.in_(set(cities)))
+    return query.order_by(CityWageRate.city)
+
+
+def wage_rates_as_of(as_of=None, cities=None):
+    """
+    查询指定日期（默认今天）生效的工价，返回 {城市: 元/秒}。
+    该日期之前没有工价记录的城市不在结果中。
+    """
+    return dict(db.session.execute(_rates_query(as_of or date.today(), cities)).all())
+
+
+def wage_rate_history(city):
+    """某个城市的全部工价记录（按生效日期倒序）"""
+    return (CityWageRate.query.filter_by(city=city)
+            .order_by(CityWageRate.effective_date.desc()).all())
+
+
+def upsert_wage_rates(rows):
+    """在当前事务中写入工价，(城市, 生效日期) 已存在时覆盖"""
+    if not rows:
+        return
+    stmt = sqlite_insert(CityWageRate)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['city', 'effective_date'],
+        set_={'rate_per_second': stmt.excluded.rate_per_second, 'source': stmt.excluded.source}
+    )
+    db.session.execute(stmt, [dict(row, created_at=datetime.utcnow()) for row in rows])
+
+
+def validate_wage_rate(record):
+    """校验并转换一条工价，返回 (数据, 错误列表)"""
+    errors = []
+    city = str(record.get('city') or '').strip()
+    data = {'city': city, 'source': record.get('source')}
+    if not city:
+        errors.append('city 不能为空')
+    elif len(city) > 50:
+        errors.append('city 超过 50 个字符')
+
+    try:
+        data['rate_per_second'] = float(record['rate_per_second'])
+        if data['rate_per_second'] < 0:
+            errors.append('rate_per_second 不能为负数')
+    except KeyError:
+        errors.append('rate_per_second 不能为空')
+    except (TypeError, ValueError):
+        errors.append(f"rate_per_second 不是数字: {record['rate_per_second']}")
+
+    try:
+        data['effective_date'] = parse_date(record.get('effective_date')) or date.today()
+    except ValueError as e:
+        errors.append(str(e))
+    return data, errors
+
+
+def ensure_wage_rates():
+    """工价表为空时写入内置工价，返回写入的城市数"""
+    if db.session.query(CityWageRate.id).first() is not None:
+        return 0
+    upsert_wage_rates([
+        {'city': city, 'effective_date': SEED_EFFECTIVE_DATE, 'rate_per_second': rate, 'source': SEED_SOURCE}
+        for city, rate in WORK_PRICES.items()
+    ])
+    return len(WORK_PRICES)
+
+
+def read_wage_rates(database_uri, as_of=None):
+    """
+    不依赖 Flask 应用读取数据库中的生效工价（供桌面端使用）。
+    数据库或工价表不存在、表为空时返回 None。
+    """
+    engine = create_engine(database_uri)
+    try:
+        if not inspect(engine).has_table(CityWageRate.__tablename__):
+            return None
+        with engine.connect() as connection:
+            rates = dict(connection.execute(_rates_query(as_of or date.today())).all())
+        return rates or None
+    finally:
+        engine.dispose()
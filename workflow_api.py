@@ -3,15 +3,42 @@ from flask_sqlalchemy import SQLAlchemy
 from models import (
     db, WorkflowTemplate, WorkflowNode, NodeConnection, 
     Material, CostCalculation, MaterialUsage, ProcessTemplate,
-    NodeType, ProcessStatus
+    NodeType, ProcessStatus, Job, wants_field
 )
+from bulk_import import iter_records
+import cost_engine
+import cost_rollup
+import cost_simulation
+import city_comparison
+import material_prices
+import wage_rates
+import recalculation
+import jobs
+from jobs import job_handler
+import search_index
+from workflow_graph import WorkflowGraphError
+from pagination import CursorError, parse_limit, keyset_page, count_total
 import json
+import time
 from datetime import datetime
+import click
 from sqlalchemy import func
+from sqlalchemy.orm import defer
 
 # 创建蓝图
 workflow_bp = Blueprint('workflow', __name__, url_prefix='/api/workflow')
 
+# 批量成本计算单次请求上限（后台任务按此大小分批提交）
+MAX_BATCH_CALCULATIONS = 5000
+MAX_ASYNC_BATCH_CALCULATIONS = 200000
+
+# 价格表导入接口最多返回的错误行数
+MAX_REPORTED_IMPORT_ERRORS = 1000
+
+# 游标分页的排序列，与 models 中的复合索引一致
+MATERIAL_ORDER = [Material.created_at, Material.id]
+COST_CALCULATION_ORDER = [CostCalculation.calculation_date, CostCalculation.id]
+
 # ============= 工艺流程模板管理 =============
 
 @workflow_bp.route('/templates', methods=['GET'])
@@ -22,8 +49,21 @@ def get_workflow_templates():
         per_page = request.args.get('per_page', 10, type=int)
         status = request.args.get('status')
         product_series = request.args.get('product_series')
+        fields = parse_fields(request.args.get('fields'))
+        
+        # 节点数量用一条分组子查询在 SQL 端统计
+        node_counts = db.session.query(
+            WorkflowNode.workflow_id,
+            func.count(WorkflowNode.id).label('nodes_count')
+        ).group_by(WorkflowNode.workflow_id).subquery()
         
-        query = WorkflowTemplate.query
+        query = db.session.query(
+            WorkflowTemplate, func.coalesce(node_counts.c.nodes_count, 0)
+        ).outerjoin(node_counts, node_counts.c.workflow_id == WorkflowTemplate.id)
+        
+        # 未请求流程配置时不从数据库读取该 JSON 列
+        if not wants_field(fields, 'workflow_config'):
+            query = query.options(defer(WorkflowTemplate.workflow_config))
         
         if status:
             query = query.filter(WorkflowTemplate.status == ProcessStatus(status))
@@ -35,7 +75,10 @@ def get_workflow_templates():
         )
         
         return jsonify({
-            'templates': [template.to_dict() for template in templates.items],
+            'templates': [
+                template.to_dict(fields=fields, nodes_count=nodes_count)
+                for template, nodes_count in templates.items
+            ],
             'total': templates.total,
             'pages': templates.pages,
             'current_page': page
@@ -43,6 +86,32 @@ def get_workflow_templates():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def parse_fields(value):
+    """解析 fields=a,b,c 稀疏字段集参数，未指定时返回 None"""
+    if not value:
+        return None
+    return {field.strip() for field in value.split(',') if field.strip()}
+
+def wants_cursor():
+    """请求带 cursor 或 limit 参数时使用游标分页"""
+    return 'cursor' in request.args or 'limit' in request.args
+
+def cursor_listing(query, order_columns, items_key, fields, count_key):
+    """
+    游标分页列表（按排序列倒序，最新的在前）。
+    total=exact|approx|none 控制是否统计总数，默认不统计。
+    """
+    limit = parse_limit(request.args.get('limit'))
+    rows, next_cursor = keyset_page(
+        query, order_columns, cursor=request.args.get('cursor'), limit=limit, descending=True
+    )
+    return {
+        items_key: [row.to_dict(fields=fields) for row in rows],
+        'next_cursor': next_cursor,
+        'limit': limit,
+        'total': count_total(request.args.get('total'), count_key, query)
+    }
+
 @workflow_bp.route('/templates', methods=['POST'])
 def create_workflow_template():
     """创建工艺流程模板"""
@@ -75,17 +144,13 @@ def get_workflow_template(template_id):
     try:
         template = WorkflowTemplate.query.get_or_404(template_id)
         
-        # 获取关联的节点和连接
-        nodes = [node.to_dict() for node in template.nodes]
-        connections = []
-        
-        for node in template.nodes:
-            for conn in node.output_connections:
-                connections.append(conn.to_dict())
+        # 节点和连接各用一条查询按 workflow_id 取出，避免逐节点加载连接
+        nodes = WorkflowNode.query.filter_by(workflow_id=template_id).order_by(WorkflowNode.id).all()
+        connections = NodeConnection.query.filter_by(workflow_id=template_id).order_by(NodeConnection.id).all()
         
-        result = template.to_dict()
-        result['nodes'] = nodes
-        result['connections'] = connections
+        result = template.to_dict(nodes_count=len(nodes))
+        result['nodes'] = [node.to_dict() for node in nodes]
+        result['connections'] = [conn.to_dict() for conn in connections]
         
         return jsonify(result)
     except Exception as e:
@@ -112,62 +177,284 @@ def update_workflow_template(template_id):
             
         template.updated_at = datetime.utcnow()
         
-        # 更新节点信息
-        if 'nodes' in data:
-            # 删除原有节点
-            WorkflowNode.query.filter_by(workflow_id=template_id).delete()
-            NodeConnection.query.filter_by(workflow_id=template_id).delete()
-            
-            # 创建新节点
-            for node_data in data['nodes']:
-                node = WorkflowNode(
-                    workflow_id=template_id,
-                    node_id=node_data['node_id'],
-                    node_type=NodeType(node_data['node_type']),
-                    name=node_data['name'],
-                    description=node_data.get('description'),
-                    position_x=node_data['position']['x'],
-                    position_y=node_data['position']['y'],
-                    process_params=node_data.get('process_params', {}),
-                    estimated_time_minutes=node_data.get('estimated_time_minutes', 0),
-                    labor_cost_per_hour=node_data.get('labor_cost_per_hour', 0),
-                    machine_cost_per_hour=node_data.get('machine_cost_per_hour', 0)
-                )
-                db.session.add(node)
-        
-        # 更新连接信息
-        if 'connections' in data:
-            for conn_data in data['connections']:
-                # 查找源节点和目标节点的数据库ID
-                source_node = WorkflowNode.query.filter_by(
-                    workflow_id=template_id, 
-                    node_id=conn_data['source_node_id']
-                ).first()
-                target_node = WorkflowNode.query.filter_by(
-                    workflow_id=template_id,
-                    node_id=conn_data['target_node_id']
-                ).first()
-                
-                if source_node and target_node:
-                    connection = NodeConnection(
-                        workflow_id=template_id,
-                        source_node_id=source_node.id,
-                        target_node_id=target_node.id,
-                        connection_id=conn_data['connection_id'],
-                        conditions=conn_data.get('conditions', {})
-                    )
-                    db.session.add(connection)
+        # 按 node_id / connection_id 与已有数据比对，只写入增删改的部分
+        if 'nodes' in data or 'connections' in data:
+            sync_workflow_graph(template_id, data.get('nodes'), data.get('connections'))
         
         db.session.commit()
+        cost_engine.cost_plan_cache.invalidate(template_id)
+        result = {
+            'message': '工艺流程模板更新成功',
+            'template': template.to_dict()
+        }
+        # 节点费率、工时或图结构可能变化，已保存的计算提交后台重算
+        job = recalculation.schedule_recalculation(workflow_ids=[template_id])
+        result['recalculation_job_id'] = job.id if job else None
         
-        return jsonify({
+        return jsonify(result)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@workflow_bp.route('/templates/<int:template_id>/schedule', methods=['GET'])
+def get_workflow_schedule(template_id):
+    """获取工艺流程关键路径、交期和各节点松弛时间"""
+    try:
+        quantity = request.args.get('quantity', 1, type=float)
+        template = WorkflowTemplate.query.get_or_404(template_id)
+        plan = cost_engine.cost_plan_cache.get_plan(template)
+        plan.check()
+        
+        result = plan.schedule(quantity)
+        result['template_id'] = template_id
+        result['quantity'] = quantity
+        return jsonify(result)
+    except WorkflowGraphError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@workflow_bp.route('/templates/<int:template_id>', methods=['PATCH'])
+def patch_workflow_template(template_id):
+    """按操作列表增量修改工艺流程（移动节点、修改费率、增删节点和连接）"""
+    try:
+        template = WorkflowTemplate.query.get_or_404(template_id)
+        data = request.get_json()
+        
+        apply_graph_operations(template_id, data.get('operations', []))
+        template.updated_at = datetime.utcnow()
+        
+        db.session.commit()
+        cost_engine.cost_plan_cache.invalidate(template_id)
+        result = {
             'message': '工艺流程模板更新成功',
             'template': template.to_dict()
-        })
+        }
+        # 节点费率、工时或图结构可能变化，已保存的计算提交后台重算
+        job = recalculation.schedule_recalculation(workflow_ids=[template_id])
+        result['recalculation_job_id'] = job.id if job else None
+        
+        return jsonify(result)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+# 可增量修改的节点字段及缺省值
+NODE_FIELD_DEFAULTS = {
+    'name': None,
+    'description': None,
+    'process_params': {},
+    'estimated_time_minutes': 0,
+    'labor_cost_per_hour': 0,
+    'machine_cost_per_hour': 0,
+    'setup_time_minutes': None,
+    'time_min_minutes': None,
+    'time_max_minutes': None
+}
+
+def node_field_values(node_data, partial=False):
+    """把前端节点数据转换为模型字段；partial 时只返回出现的字段"""
+    values = {}
+    for field, default in NODE_FIELD_DEFAULTS.items():
+        if field in node_data:
+            values[field] = node_data[field]
+        elif not partial:
+            values[field] = default
+    if 'node_type' in node_data:
+        values['node_type'] = NodeType(node_data['node_type'])
+    if 'position' in node_data:
+        values['position_x'] = node_data['position']['x']
+        values['position_y'] = node_data['position']['y']
+    return values
+
+def apply_changes(obj, values):
+    """只对值发生变化的字段赋值，返回是否有变化"""
+    changed = False
+    for field, value in values.items():
+        if getattr(obj, field) != value:
+            setattr(obj, field, value)
+            changed = True
+    return changed
+
+def delete_nodes(template_id, node_ids):
+    """删除节点及与其相连的连接（按数据库ID批量删除）"""
+    if not node_ids:
+        return
+    NodeConnection.query.filter(
+        NodeConnection.workflow_id == template_id,
+        db.or_(NodeConnection.source_node_id.in_(node_ids),
+               NodeConnection.target_node_id.in_(node_ids))
+    ).delete(synchronize_session='fetch')
+    WorkflowNode.query.filter(WorkflowNode.id.in_(node_ids)).delete(synchronize_session='fetch')
+
+def sync_workflow_graph(template_id, nodes_data=None, connections_data=None):
+    """
+    把完整的节点/连接列表与数据库中的记录比对，只执行必要的插入、更新和删除。
+    nodes_data 为 None 时保留现有节点；connections_data 为 None 时只删除失效连接。
+    """
+    nodes = {node.node_id: node for node in WorkflowNode.query.filter_by(workflow_id=template_id)}
+    
+    if nodes_data is not None:
+        incoming = {node_data['node_id']: node_data for node_data in nodes_data}
+        delete_nodes(template_id, [node.id for node_id, node in nodes.items() if node_id not in incoming])
+        nodes = {node_id: node for node_id, node in nodes.items() if node_id in incoming}
+        
+        for node_id, node_data in incoming.items():
+            values = node_field_values(node_data)
+            if node_id in nodes:
+                apply_changes(nodes[node_id], values)
+            else:
+                node = WorkflowNode(workflow_id=template_id, node_id=node_id, **values)
+                db.session.add(node)
+                nodes[node_id] = node
+        db.session.flush()
+    
+    if connections_data is None:
+        return
+    
+    connections = {conn.connection_id: conn for conn in NodeConnection.query.filter_by(workflow_id=template_id)}
+    incoming_ids = set()
+    for conn_data in connections_data:
+        # 源节点和目标节点的数据库ID从内存映射中取得
+        source_node = nodes.get(conn_data['source_node_id'])
+        target_node = nodes.get(conn_data['target_node_id'])
+        if not (source_node and target_node):
+            continue
+        
+        incoming_ids.add(conn_data['connection_id'])
+        values = {
+            'source_node_id': source_node.id,
+            'target_node_id': target_node.id,
+            'conditions': conn_data.get('conditions', {})
+        }
+        connection = connections.get(conn_data['connection_id'])
+        if connection:
+            apply_changes(connection, values)
+        else:
+            db.session.add(NodeConnection(workflow_id=template_id,
+                                          connection_id=conn_data['connection_id'], **values))
+    
+    stale = [conn.id for connection_id, conn in connections.items() if connection_id not in incoming_ids]
+    if stale:
+        NodeConnection.query.filter(NodeConnection.id.in_(stale)).delete(synchronize_session='fetch')
+
+# 各增量操作必需的字段
+OPERATION_REQUIRED_KEYS = {
+    'move_node': ('node_id', 'position'),
+    'update_node': ('node_id',),
+    'add_node': ('node_id',),
+    'remove_node': ('node_id',),
+    'add_connection': ('connection_id', 'source_node_id', 'target_node_id'),
+    'remove_connection': ('connection_id',)
+}
+
+def validate_graph_operations(operations):
+    """执行前校验操作列表的结构，出错时抛出带操作序号（从 0 开始）的 ValueError"""
+    if not isinstance(operations, list):
+        raise ValueError('operations 必须是列表')
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise ValueError(f'第 {index} 个操作必须是对象')
+        op = operation.get('op')
+        if op not in OPERATION_REQUIRED_KEYS:
+            raise ValueError(f'第 {index} 个操作: 不支持的操作 {op}')
+        missing = [key for key in OPERATION_REQUIRED_KEYS[op] if operation.get(key) is None]
+        if op == 'add_node':
+            missing += [f'node.{key}' for key in ('node_type', 'name')
+                        if not isinstance(operation.get('node'), dict) or operation['node'].get(key) is None]
+        if missing:
+            raise ValueError(f"第 {index} 个操作 {op} 缺少字段: {', '.join(missing)}")
+        for key in ('node_id', 'connection_id', 'source_node_id', 'target_node_id'):
+            if key in operation and not isinstance(operation[key], (str, int)):
+                raise ValueError(f'第 {index} 个操作 {op} 的 {key} 必须是字符串')
+        for key in ('changes', 'node', 'conditions'):
+            if key in operation and not isinstance(operation[key], dict):
+                raise ValueError(f'第 {index} 个操作 {op} 的 {key} 必须是对象')
+        # 坐标可以出现在 move_node 本身或 add_node/update_node 的节点数据中
+        for data in (operation, operation.get('node') or {}, operation.get('changes') or {}):
+            position = data.get('position')
+            if 'position' in data and not (isinstance(position, dict) and 'x' in position and 'y' in position):
+                raise ValueError(f'第 {index} 个操作 {op} 的 position 需包含 x 和 y')
+
+def apply_graph_operations(template_id, operations):
+    """
+    执行增量操作，只加载操作涉及的节点和连接。
+    支持: move_node, update_node, add_node, remove_node, add_connection, remove_connection
+    操作结构在执行前统一校验，缺少字段时抛出 ValueError（不会执行其中任何操作）。
+    """
+    validate_graph_operations(operations)
+    node_keys = set()
+    connection_keys = set()
+    for operation in operations:
+        for key in ('node_id', 'source_node_id', 'target_node_id'):
+            if key in operation:
+                node_keys.add(operation[key])
+        if 'connection_id' in operation:
+            connection_keys.add(operation['connection_id'])
+    
+    nodes = {}
+    if node_keys:
+        nodes = {node.node_id: node for node in WorkflowNode.query.filter(
+            WorkflowNode.workflow_id == template_id, WorkflowNode.node_id.in_(node_keys))}
+    connections = {}
+    if connection_keys:
+        connections = {conn.connection_id: conn for conn in NodeConnection.query.filter(
+            NodeConnection.workflow_id == template_id, NodeConnection.connection_id.in_(connection_keys))}
+    
+    def get_node(node_id):
+        if node_id not in nodes:
+            raise ValueError(f'节点 {node_id} 不存在')
+        return nodes[node_id]
+    
+    for index, operation in enumerate(operations):
+        op = operation['op']
+        try:
+            if op == 'move_node':
+                node = get_node(operation['node_id'])
+                apply_changes(node, {'position_x': operation['position']['x'],
+                                     'position_y': operation['position']['y']})
+            elif op == 'update_node':
+                node = get_node(operation['node_id'])
+                apply_changes(node, node_field_values(operation.get('changes', {}), partial=True))
+            elif op == 'add_node':
+                if operation['node_id'] in nodes:
+                    raise ValueError(f"节点 {operation['node_id']} 已存在")
+                node_data = dict(operation.get('node', {}), node_id=operation['node_id'])
+                node = WorkflowNode(workflow_id=template_id, node_id=operation['node_id'],
+                                    **node_field_values(node_data))
+                db.session.add(node)
+                nodes[node.node_id] = node
+            elif op == 'remove_node':
+                node = get_node(operation['node_id'])
+                db.session.flush()
+                delete_nodes(template_id, [node.id])
+                del nodes[operation['node_id']]
+            elif op == 'add_connection':
+                if operation['connection_id'] in connections:
+                    raise ValueError(f"连接 {operation['connection_id']} 已存在")
+                source_node = get_node(operation['source_node_id'])
+                target_node = get_node(operation['target_node_id'])
+                db.session.flush()
+                connection = NodeConnection(
+                    workflow_id=template_id,
+                    source_node_id=source_node.id,
+                    target_node_id=target_node.id,
+                    connection_id=operation['connection_id'],
+                    conditions=operation.get('conditions', {})
+                )
+                db.session.add(connection)
+                connections[connection.connection_id] = connection
+            elif op == 'remove_connection':
+                connection = connections.pop(operation['connection_id'], None)
+                if connection is None:
+                    raise ValueError(f"连接 {operation['connection_id']} 不存在")
+                db.session.delete(connection)
+        except ValueError as e:
+            raise ValueError(f'第 {index} 个操作 {op}: {e}') from e
+
 # ============= 工艺节点管理 =============
 
 @workflow_bp.route('/node-types', methods=['GET'])
@@ -225,29 +512,39 @@ def get_materials():
         per_page = request.args.get('per_page', 20, type=int)
         category = request.args.get('category')
         search = request.args.get('search')
+        fields = parse_fields(request.args.get('fields'))
         
         query = Material.query
         
         if category:
             query = query.filter(Material.category == category)
         if search:
-            query = query.filter(
-                db.or_(
-                    Material.name.contains(search),
-                    Material.code.contains(search)
-                )
-            )
+            # 优先使用全文索引，不可用时退回 LIKE 查询
+            matched = search_index.match_ids('materials', search)
+            if matched is not None:
+                query = query.filter(Material.id.in_(matched))
+            else:
+                query = query.filter(search_index.like_filter('materials', search))
             
+        if wants_cursor():
+            return jsonify(cursor_listing(
+                query, MATERIAL_ORDER, 'materials', fields,
+                ('materials', category, search)
+            ))
+        
         materials = query.order_by(Material.created_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
+            page=page, per_page=per_page, error_out=False,
+            count=request.args.get('total') != 'none'
         )
         
         return jsonify({
-            'materials': [material.to_dict() for material in materials.items],
+            'materials': [material.to_dict(fields=fields) for material in materials.items],
             'total': materials.total,
             'pages': materials.pages,
             'current_page': page
         })
+    except CursorError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -267,10 +564,15 @@ def create_material():
             unit_price=data['unit_price'],
             unit=data.get('unit', '张'),
             supplier=data.get('supplier'),
-            waste_rate=data.get('waste_rate', 0.05)
+            waste_rate=data.get('waste_rate', 0.05),
+            price_std=data.get('price_std'),
+            waste_rate_std=data.get('waste_rate_std')
         )
         
         db.session.add(material)
+        db.session.flush()
+        # 初始单价作为第一条价格记录
+        material_prices.record_price(material, source='manual')
         db.session.commit()
         
         return jsonify({
@@ -281,6 +583,192 @@ def create_material():
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@workflow_bp.route('/materials/<int:material_id>', methods=['PUT'])
+def update_material(material_id):
+    """更新材料；单价或损耗率变化时记录价格历史，并为受影响的成本计算提交后台重算"""
+    try:
+        material = Material.query.get_or_404(material_id)
+        data = request.get_json() or {}
+        old_price, old_waste_rate = material.unit_price, material.waste_rate
+        
+        for field in ('code', 'name', 'category', 'thickness', 'width', 'length', 'unit_price',
+                      'unit', 'supplier', 'waste_rate', 'price_std', 'waste_rate_std'):
+            if field in data:
+                setattr(material, field, data[field])
+        
+        if material.unit_price != old_price:
+            material_prices.record_price(material, source='manual')
+        db.session.commit()
+        
+        result = {
+            'message': '材料更新成功',
+            'material': material.to_dict()
+        }
+        job = None
+        if material.unit_price != old_price or material.waste_rate != old_waste_rate:
+            job = recalculation.schedule_recalculation(material_ids=[material_id])
+        result['recalculation_job_id'] = job.id if job else None
+        return jsonify(result)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@workflow_bp.route('/materials/price-list', methods=['POST'])
+def import_material_price_list():
+    """
+    导入供应商价格表（上传 .xlsx 或 .csv，必需列 code、unit_price）。
+    按材料编码 upsert，价格写入历史表；文件中没有 effective_date 列时使用表单中的 effective_date（默认今天）。
+    dry_run=1 时只校验不写入；async=1 时保存文件后提交后台任务，立即返回任务ID。
+    """
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({'error': '请上传文件'}), 400
+    dry_run = request.form.get('dry_run', request.args.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+    run_async = request.form.get('async', request.args.get('async', '')).lower() in ('1', 'true', 'yes')
+    
+    try:
+        effective_date = material_prices.parse_date(
+            request.form.get('effective_date', request.args.get('effective_date'))
+        )
+        if run_async:
+            job = jobs.submit('price_list_import', {
+                'path': jobs.save_upload(upload), 'filename': upload.filename,
+                'effective_date': effective_date.isoformat() if effective_date else None, 'dry_run': dry_run
+            })
+            return jobs.job_response(job, 202)
+        recalculation_jobs = []
+        report = material_prices.import_price_list(
+            upload.stream, upload.filename, effective_date=effective_date, dry_run=dry_run,
+            on_materials_changed=lambda material_ids: recalculation_jobs.append(
+                recalculation.schedule_recalculation(material_ids)
+            )
+        )
+        result = report.to_dict(max_errors=MAX_REPORTED_IMPORT_ERRORS)
+        job = recalculation_jobs[0] if recalculation_jobs else None
+        result['recalculation_job_id'] = job.id if job else None
+        return jsonify(result)
+    except ValueError as e:
+        # ImportFormatError 也是 ValueError
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@workflow_bp.route('/materials/<int:material_id>/prices', methods=['GET'])
+def get_material_prices(material_id):
+    """获取材料价格历史；指定 as_of 时同时返回该日期生效的价格"""
+    try:
+        material = Material.query.get_or_404(material_id)
+        result = {
+            'material_id': material.id,
+            'current_price': material.unit_price,
+            'prices': [price.to_dict() for price in material_prices.price_history(material_id)]
+        }
+        as_of = material_prices.parse_date(request.args.get('as_of'))
+        if as_of:
+            result['as_of'] = as_of.isoformat()
+            result['price_as_of'] = material_prices.prices_as_of([material_id], as_of).get(material_id)
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ============= 城市工价 =============
+
+@workflow_bp.route('/wage-rates', methods=['GET'])
+def get_wage_rates():
+    """获取指定日期（as_of，默认今天）各城市生效的工价；指定 city 时返回该城市的工价历史"""
+    try:
+        city = request.args.get('city')
+        if city:
+            return jsonify({
+                'city': city,
+                'rates': [rate.to_dict() for rate in wage_rates.wage_rate_history(city)]
+            })
+        as_of = material_prices.parse_date(request.args.get('as_of')) or datetime.utcnow().date()
+        rates = wage_rates.wage_rates_as_of(as_of)
+        return jsonify({
+            'as_of': as_of.isoformat(),
+            'rates': [
+                {'city': city, 'rate_per_second': rate, 'rate_per_hour': rate * 3600}
+                for city, rate in rates.items()
+            ]
+        })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@workflow_bp.route('/wage-rates', methods=['POST'])
+def set_wage_rates():
+    """
+    写入城市工价，请求体: {rates: [{city, rate_per_second, effective_date}]}（也可直接提交单条）。
+    effective_date 默认今天；同一城市同一生效日期已有记录时覆盖。任一条校验失败时不写入。
+    """
+    try:
+        data = request.get_json() or {}
+        records = data['rates'] if 'rates' in data else [data]
+        rows = []
+        errors = []
+        for index, record in enumerate(records):
+            row, row_errors = wage_rates.validate_wage_rate(record)
+            if row_errors:
+                errors.append({'index': index, 'city': row['city'] or None, 'errors': row_errors})
+            rows.append(row)
+        if errors:
+            return jsonify({'error': '工价校验失败', 'errors': errors}), 400
+        
+        wage_rates.upsert_wage_rates(rows)
+        db.session.commit()
+        return jsonify({'message': f'已写入 {len(rows)} 条工价', 'count': len(rows)})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+def comparison_table(name, aliases):
+    """对比接口的 BOM/工艺路线：上传的 .xlsx/.csv 文件或 JSON 中的行列表"""
+    upload = request.files.get(name)
+    if upload is not None and upload.filename:
+        required = [column for column in dict.fromkeys(aliases.values())
+                    if column not in city_comparison.OPTIONAL_ROUTING_COLUMNS]
+        records = [record for _, record in iter_records(upload.stream, upload.filename, aliases, required)]
+    else:
+        records = (request.get_json(silent=True) or {}).get(name) or []
+    return city_comparison.table_from_records(records)
+
+@workflow_bp.route('/city-comparison', methods=['POST'])
+def compare_city_costs():
+    """
+    多城市工费对比（不保存结果）：按工艺路线计算整个 BOM 在各城市的工费。
+    JSON 请求体: {bom: [{Component, a, b, c, d}], routing: [{Component, Process Path, Process Parameters, Row}],
+    cities（默认全部城市）, as_of（工价日期，默认今天）, detail（是否返回每个部件的工费）}；
+    也可用表单上传 bom、routing 两个 .xlsx/.csv 文件，其余参数放在表单或查询参数中。
+    """
+    try:
+        options = request.get_json(silent=True) or request.form.to_dict() or request.args.to_dict()
+        bom = comparison_table('bom', city_comparison.BOM_ALIASES)
+        routing = comparison_table('routing', city_comparison.ROUTING_ALIASES)
+        cities = options.get('cities')
+        if isinstance(cities, str):
+            cities = [city.strip() for city in cities.split(',') if city.strip()]
+        detail = options.get('detail') in (True, 1, '1', 'true', 'yes')
+        as_of = material_prices.parse_date(options.get('as_of')) or datetime.utcnow().date()
+        
+        started = time.perf_counter()
+        rates = wage_rates.wage_rates_as_of(as_of, cities)
+        comparison = city_comparison.compare_cities(bom, routing, rates, cities=cities)
+        result = comparison.to_dict(detail=detail)
+        result['as_of'] = as_of.isoformat()
+        result['component_count'] = len(comparison.components)
+        result['elapsed_ms'] = (time.perf_counter() - started) * 1000
+        return jsonify(result)
+    except ValueError as e:
+        # ImportFormatError 也是 ValueError
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # ============= 成本计算 =============
 
 @workflow_bp.route('/cost-calculation', methods=['POST'])
@@ -291,124 +779,249 @@ def calculate_cost():
         workflow_id = data['workflow_id']
         quantity = data.get('quantity', 1)
         product_sku = data.get('product_sku')
+        # 按指定日期的历史价格计价，默认使用材料当前单价
+        price_date = material_prices.parse_date(data.get('price_date'))
         
         # 获取工艺流程模板
         template = WorkflowTemplate.query.get_or_404(workflow_id)
         
-        # 计算各项成本
-        material_cost = 0
-        labor_cost = 0
-        machine_cost = 0
-        overhead_cost = 0
-        
-        cost_breakdown = {
-            'nodes': [],
-            'materials': [],
-            'summary': {}
-        }
-        
-        # 计算每个节点的成本
-        for node in template.nodes:
-            node_labor_cost = (node.estimated_time_minutes / 60) * node.labor_cost_per_hour * quantity
-            node_machine_cost = (node.estimated_time_minutes / 60) * node.machine_cost_per_hour * quantity
-            
-            labor_cost += node_labor_cost
-            machine_cost += node_machine_cost
-            
-            cost_breakdown['nodes'].append({
-                'node_id': node.node_id,
-                'name': node.name,
-                'time_minutes': node.estimated_time_minutes,
-                'labor_cost': node_labor_cost,
-                'machine_cost': node_machine_cost,
-                'total_cost': node_labor_cost + node_machine_cost
-            })
-        
-        # 计算材料成本（从请求数据中获取）
-        if 'materials' in data:
-            for material_data in data['materials']:
-                material = Material.query.get(material_data['material_id'])
-                if material:
-                    planned_qty = material_data['quantity']
-                    waste_qty = planned_qty * material.waste_rate
-                    total_qty = planned_qty + waste_qty
-                    cost = total_qty * material.unit_price
-                    
-                    material_cost += cost
-                    
-                    cost_breakdown['materials'].append({
-                        'material_id': material.id,
-                        'name': material.name,
-                        'planned_quantity': planned_qty,
-                        'waste_quantity': waste_qty,
-                        'total_quantity': total_qty,
-                        'unit_price': material.unit_price,
-                        'total_cost': cost
-                    })
-        
-        # 计算间接成本（按总成本的一定比例）
-        overhead_rate = data.get('overhead_rate', 0.15)  # 默认15%
-        overhead_cost = (material_cost + labor_cost + machine_cost) * overhead_rate
-        
-        total_cost = material_cost + labor_cost + machine_cost + overhead_cost
-        
-        cost_breakdown['summary'] = {
-            'material_cost': material_cost,
-            'labor_cost': labor_cost,
-            'machine_cost': machine_cost,
-            'overhead_cost': overhead_cost,
-            'total_cost': total_cost,
-            'unit_cost': total_cost / quantity if quantity > 0 else 0,
-            'quantity': quantity
-        }
+        # 一次 IN 查询取出全部引用的材料
+        material_ids = cost_engine.referenced_material_ids(data.get('materials'))
+        materials = cost_engine.load_materials(material_ids)
+        prices = cost_engine.load_prices(material_ids, price_date)
         
-        # 保存成本计算结果
-        cost_calculation = CostCalculation(
-            workflow_id=workflow_id,
-            product_sku=product_sku,
-            quantity=quantity,
-            material_cost=material_cost,
-            labor_cost=labor_cost,
-            machine_cost=machine_cost,
-            overhead_cost=overhead_cost,
-            total_cost=total_cost,
-            cost_breakdown=cost_breakdown
+        # 计算间接成本比例，默认15%
+        overhead_rate = data.get('overhead_rate', cost_engine.DEFAULT_OVERHEAD_RATE)
+        # 单位成本来自按模板版本缓存的成本计划，无需遍历节点
+        plan = cost_engine.cost_plan_cache.get_plan(template)
+        result = cost_engine.compute_cost(
+            plan, quantity, data.get('materials'), materials, overhead_rate, prices
         )
+        cost_breakdown = result['cost_breakdown']
+        if price_date:
+            cost_breakdown['summary']['price_date'] = price_date.isoformat()
         
-        db.session.add(cost_calculation)
-        
-        # 保存材料用量记录
-        if 'materials' in data:
-            for material_data in data['materials']:
-                material = Material.query.get(material_data['material_id'])
-                if material:
-                    planned_qty = material_data['quantity']
-                    waste_qty = planned_qty * material.waste_rate
-                    total_qty = planned_qty + waste_qty
-                    cost = total_qty * material.unit_price
-                    
-                    usage = MaterialUsage(
-                        cost_calculation=cost_calculation,
-                        material_id=material.id,
-                        planned_quantity=planned_qty,
-                        waste_quantity=waste_qty,
-                        unit_cost=material.unit_price,
-                        total_cost=cost
-                    )
-                    db.session.add(usage)
+        # 保存成本计算结果，材料明细直接复用为用量记录并批量插入
+        cost_calculation = cost_engine.build_calculation(result, workflow_id, quantity, product_sku)
+        cost_engine.save_calculations([(cost_calculation, cost_breakdown['materials'])])
+        calculation_id = cost_calculation.id
         
         db.session.commit()
         
         return jsonify({
             'message': '成本计算完成',
-            'calculation_id': cost_calculation.id,
+            'calculation_id': calculation_id,
             'cost_breakdown': cost_breakdown
         })
         
+    except (WorkflowGraphError, ValueError) as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@workflow_bp.route('/cost-simulation', methods=['POST'])
+def simulate_cost():
+    """
+    成本风险模拟（不保存结果）：按节点加工时间、材料单价和损耗率的分布抽样，
+    返回单位成本的分位数、直方图和各因素对波动的贡献。
+    请求体同成本计算，另可指定 scenarios（默认 100000）、seed、bins、percentiles
+    """
+    try:
+        data = request.get_json()
+        workflow_id = data['workflow_id']
+        quantity = data.get('quantity', 1)
+        price_date = material_prices.parse_date(data.get('price_date'))
+        
+        template = WorkflowTemplate.query.get_or_404(workflow_id)
+        material_ids = cost_engine.referenced_material_ids(data.get('materials'))
+        materials = cost_engine.load_materials(material_ids)
+        prices = cost_engine.load_prices(material_ids, price_date)
+        plan = cost_engine.cost_plan_cache.get_plan(template)
+        overhead_rate = data.get('overhead_rate', cost_engine.DEFAULT_OVERHEAD_RATE)
+        
+        # 确定值估算（与成本计算接口一致），便于和分位数对照
+        point = cost_engine.compute_cost(plan, quantity, data.get('materials'), materials, overhead_rate, prices)
+        started = time.perf_counter()
+        result = cost_simulation.simulate_cost(
+            plan, quantity, data.get('materials'), materials, overhead_rate,
+            scenarios=int(data.get('scenarios', cost_simulation.DEFAULT_SCENARIOS)),
+            prices=prices,
+            seed=data.get('seed'),
+            bins=int(data.get('bins', cost_simulation.DEFAULT_BINS)),
+            percentiles=data.get('percentiles') or cost_simulation.DEFAULT_PERCENTILES
+        )
+        result['elapsed_ms'] = (time.perf_counter() - started) * 1000
+        result['point_estimate'] = point['cost_breakdown']['summary']['unit_cost']
+        result['workflow_id'] = workflow_id
+        if price_date:
+            result['price_date'] = price_date.isoformat()
+        return jsonify(result)
+    except (WorkflowGraphError, ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@workflow_bp.route('/cost-curve', methods=['POST'])
+def calculate_cost_curve():
+    """
+    数量-成本曲线（不保存结果），用于报价阶梯表。
+    请求体: {workflow_id, materials（quantity 为单件用量）, overhead_rate, price_date,
+    quantities: [1, 10, 50] 或 range: {start, stop, step} / {start, stop, num, log}}
+    节点准备时间每批计一次，其余成本随数量线性放大，全部数量点一次数组运算得到。
+    """
+    try:
+        data = request.get_json()
+        workflow_id = data['workflow_id']
+        price_date = material_prices.parse_date(data.get('price_date'))
+        quantity_range = data.get('range') or {}
+        quantities = cost_engine.curve_quantities(
+            data.get('quantities'), quantity_range.get('start'), quantity_range.get('stop'),
+            quantity_range.get('step'), quantity_range.get('num'), bool(quantity_range.get('log'))
+        )
+        
+        template = WorkflowTemplate.query.get_or_404(workflow_id)
+        material_ids = cost_engine.referenced_material_ids(data.get('materials'))
+        materials = cost_engine.load_materials(material_ids)
+        prices = cost_engine.load_prices(material_ids, price_date)
+        plan = cost_engine.cost_plan_cache.get_plan(template)
+        overhead_rate = data.get('overhead_rate', cost_engine.DEFAULT_OVERHEAD_RATE)
+        
+        started = time.perf_counter()
+        result = cost_engine.compute_cost_curve(
+            plan, quantities, data.get('materials'), materials, overhead_rate, prices
+        )
+        result['elapsed_ms'] = (time.perf_counter() - started) * 1000
+        result['workflow_id'] = workflow_id
+        if price_date:
+            result['price_date'] = price_date.isoformat()
+        return jsonify(result)
+    except (WorkflowGraphError, ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def calculate_batch_items(items, default_overhead_rate, price_date=None, start_index=0):
+    """
+    在当前事务中计算并保存一批成本计算，返回逐条结果（成功的含 calculation_id，失败的含 error）。
+    所有引用的模板、节点和材料各只加载一次。
+    """
+    templates = cost_engine.load_templates(
+        item['workflow_id'] for item in items if 'workflow_id' in item
+    )
+    material_ids = set()
+    for item in items:
+        material_ids |= cost_engine.referenced_material_ids(item.get('materials'))
+    materials = cost_engine.load_materials(material_ids)
+    prices = cost_engine.load_prices(material_ids, price_date)
+    plans = cost_engine.cost_plan_cache.get_plans(templates.values())
+
+    results = []
+    pairs = []
+    for index, item in enumerate(items, start_index):
+        try:
+            if 'workflow_id' not in item:
+                raise ValueError('缺少 workflow_id')
+            workflow_id = item['workflow_id']
+            template = templates.get(workflow_id)
+            if template is None:
+                raise LookupError(f'工艺流程模板 {workflow_id} 不存在')
+
+            quantity = item.get('quantity', 1)
+            result = cost_engine.compute_cost(
+                plans[workflow_id], quantity, item.get('materials'), materials,
+                item.get('overhead_rate', default_overhead_rate), prices
+            )
+            if price_date:
+                result['cost_breakdown']['summary']['price_date'] = price_date.isoformat()
+            calculation = cost_engine.build_calculation(
+                result, workflow_id, quantity, item.get('product_sku')
+            )
+            pairs.append((calculation, result['cost_breakdown']['materials']))
+            results.append({'index': index, 'calculation': calculation,
+                            'cost_breakdown': result['cost_breakdown']})
+        except Exception as e:
+            results.append({'index': index, 'error': str(e)})
+
+    # 提交前读取ID，避免提交后逐条刷新
+    cost_engine.save_calculations(pairs)
+    for result in results:
+        if 'calculation' in result:
+            result['calculation_id'] = result.pop('calculation').id
+    return results
+
+@job_handler('cost_batch')
+def run_cost_batch(context, params):
+    """批量成本计算任务：按批计算并提交，逐条结果写入 JSON 结果文件"""
+    items = params.get('calculations', [])
+    default_overhead_rate = params.get('overhead_rate', cost_engine.DEFAULT_OVERHEAD_RATE)
+    price_date = material_prices.parse_date(params.get('price_date'))
+    context.progress(0, len(items))
+
+    succeeded = 0
+    path = context.result_file('成本计算结果.json', 'application/json')
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write('[')
+        for start in range(0, len(items), MAX_BATCH_CALCULATIONS):
+            results = calculate_batch_items(
+                items[start:start + MAX_BATCH_CALCULATIONS], default_overhead_rate, price_date, start
+            )
+            db.session.commit()
+            db.session.expunge_all()
+            succeeded += sum(1 for result in results if 'calculation_id' in result)
+            for result in results:
+                out.write(',' if result['index'] else '')
+                json.dump(result, out, ensure_ascii=False, default=str)
+            context.progress(start + len(results))
+        out.write(']')
+    return {'succeeded': succeeded, 'failed': len(items) - succeeded}
+
+@workflow_bp.route('/cost-calculation/batch', methods=['POST'])
+def calculate_cost_batch():
+    """
+    批量计算工艺流程成本。
+    async=1（或请求体 async: true）时提交后台任务，立即返回任务ID，结果通过 /api/jobs 查询和下载
+    """
+    try:
+        data = request.get_json()
+        items = data.get('calculations', [])
+        default_overhead_rate = data.get('overhead_rate', cost_engine.DEFAULT_OVERHEAD_RATE)
+        try:
+            price_date = material_prices.parse_date(data.get('price_date'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        if data.get('async') or request.args.get('async') in ('1', 'true'):
+            if len(items) > MAX_ASYNC_BATCH_CALCULATIONS:
+                return jsonify({'error': f'单个任务最多计算 {MAX_ASYNC_BATCH_CALCULATIONS} 条'}), 400
+            job = jobs.submit('cost_batch', {key: value for key, value in data.items() if key != 'async'})
+            return jobs.job_response(job, 202)
+
+        if len(items) > MAX_BATCH_CALCULATIONS:
+            return jsonify({'error': f'单次最多计算 {MAX_BATCH_CALCULATIONS} 条，更多请使用 async=1'}), 400
+
+        # 全部结果在一个事务中保存
+        results = calculate_batch_items(items, default_overhead_rate, price_date)
+        db.session.commit()
+        succeeded = sum(1 for result in results if 'calculation_id' in result)
+
+        return jsonify({
+            'message': '批量成本计算完成',
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'results': results
+        })
+
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@workflow_bp.route('/cost-plan-cache', methods=['GET'])
+def get_cost_plan_cache_stats():
+    """获取成本计划缓存命中统计"""
+    return jsonify(cost_engine.cost_plan_cache.stats())
+
 @workflow_bp.route('/cost-calculations', methods=['GET'])
 def get_cost_calculations():
     """获取成本计算历史"""
@@ -417,27 +1030,82 @@ def get_cost_calculations():
         per_page = request.args.get('per_page', 20, type=int)
         workflow_id = request.args.get('workflow_id', type=int)
         product_sku = request.args.get('product_sku')
+        include_superseded = request.args.get('include_superseded', '').lower() in ('1', 'true', 'yes')
+        fields = parse_fields(request.args.get('fields'))
         
         query = CostCalculation.query
+        if not include_superseded:
+            # 默认只返回有效记录，被重算取代的旧记录通过详情中的 superseded_by_id 追溯
+            query = query.filter(CostCalculation.superseded_by_id.is_(None))
         
         if workflow_id:
             query = query.filter(CostCalculation.workflow_id == workflow_id)
         if product_sku:
             query = query.filter(CostCalculation.product_sku == product_sku)
             
+        if wants_cursor():
+            return jsonify(cursor_listing(
+                query, COST_CALCULATION_ORDER, 'calculations', fields,
+                ('cost_calculations', workflow_id, product_sku, include_superseded)
+            ))
+        
         calculations = query.order_by(CostCalculation.calculation_date.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
+            page=page, per_page=per_page, error_out=False,
+            count=request.args.get('total') != 'none'
         )
         
         return jsonify({
-            'calculations': [calc.to_dict() for calc in calculations.items],
+            'calculations': [calc.to_dict(fields=fields) for calc in calculations.items],
             'total': calculations.total,
             'pages': calculations.pages,
             'current_page': page
         })
+    except CursorError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@workflow_bp.route('/recalculations', methods=['POST'])
+def submit_recalculation():
+    """
+    材料或工艺参数变化后重算受影响的成本计算（后台执行）。
+    请求体: material_ids / workflow_ids / node_ids；dry_run 为 true 时只返回受影响的记录数
+    """
+    try:
+        data = request.get_json() or {}
+        material_ids = data.get('material_ids') or []
+        workflow_ids = data.get('workflow_ids') or []
+        node_ids = data.get('node_ids') or []
+        if not (material_ids or workflow_ids or node_ids):
+            return jsonify({'error': '请指定 material_ids、workflow_ids 或 node_ids'}), 400
+        
+        if data.get('dry_run'):
+            affected = recalculation.affected_calculation_ids(material_ids, workflow_ids, node_ids)
+            return jsonify({'affected': len(affected)})
+        
+        job = jobs.submit('recalculation', {
+            'material_ids': material_ids, 'workflow_ids': workflow_ids, 'node_ids': node_ids
+        })
+        return jobs.job_response(job, 202)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@workflow_bp.route('/recalculations', methods=['GET'])
+def get_recalculations():
+    """获取最近的重算任务（等同于 /api/jobs?kind=recalculation）"""
+    recent = (Job.query.filter(Job.kind == 'recalculation')
+              .order_by(Job.created_at.desc()).limit(jobs.DEFAULT_LIST_LIMIT).all())
+    return jsonify({'jobs': [job.to_dict() for job in recent]})
+
+@workflow_bp.route('/recalculations/<job_id>', methods=['GET'])
+def get_recalculation(job_id):
+    """获取重算任务进度"""
+    job = db.session.get(Job, job_id)
+    if job is None or job.kind != 'recalculation':
+        return jsonify({'error': '重算任务不存在'}), 404
+    return jobs.job_response(job)
+
 @workflow_bp.route('/cost-calculations/<int:calc_id>', methods=['GET'])
 def get_cost_calculation_detail(calc_id):
     """获取成本计算详情"""
@@ -455,54 +1123,71 @@ def get_cost_calculation_detail(calc_id):
 
 @workflow_bp.route('/statistics/cost-trend', methods=['GET'])
 def get_cost_trend():
-    """获取成本趋势分析"""
+    """
+    获取成本趋势分析（只读成本日汇总表）。
+    参数: days, product_sku, workflow_id, granularity=day|week|month, group_by=sku 按SKU拆分序列
+    """
     try:
         days = request.args.get('days', 30, type=int)
         product_sku = request.args.get('product_sku')
+        workflow_id = request.args.get('workflow_id', type=int)
+        granularity = request.args.get('granularity', 'day')
+        by_sku = request.args.get('group_by') == 'sku'
         
         # 计算日期范围
         from datetime import timedelta
-        end_date = datetime.utcnow()
+        end_date = datetime.utcnow().date()
         start_date = end_date - timedelta(days=days)
         
-        query = CostCalculation.query.filter(
-            CostCalculation.calculation_date >= start_date,
-            CostCalculation.calculation_date <= end_date
+        trend_data, series = cost_rollup.cost_trend(
+            start_date, end_date, granularity=granularity,
+            product_sku=product_sku, workflow_id=workflow_id, by_sku=by_sku
         )
         
-        if product_sku:
-            query = query.filter(CostCalculation.product_sku == product_sku)
-        
-        calculations = query.order_by(CostCalculation.calculation_date).all()
-        
-        # 按日期分组统计
-        trend_data = {}
-        for calc in calculations:
-            date_key = calc.calculation_date.strftime('%Y-%m-%d')
-            if date_key not in trend_data:
-                trend_data[date_key] = {
-                    'date': date_key,
-                    'total_cost': 0,
-                    'material_cost': 0,
-                    'labor_cost': 0,
-                    'machine_cost': 0,
-                    'overhead_cost': 0,
-                    'count': 0
-                }
-            
-            trend_data[date_key]['total_cost'] += calc.total_cost
-            trend_data[date_key]['material_cost'] += calc.material_cost
-            trend_data[date_key]['labor_cost'] += calc.labor_cost
-            trend_data[date_key]['machine_cost'] += calc.machine_cost
-            trend_data[date_key]['overhead_cost'] += calc.overhead_cost
-            trend_data[date_key]['count'] += 1
-        
-        return jsonify({
-            'trend_data': list(trend_data.values())
-        })
+        result = {
+            'granularity': granularity,
+            'trend_data': trend_data
+        }
+        if by_sku:
+            result['series'] = [
+                {'product_sku': sku, 'trend_data': points} for sku, points in series.items()
+            ]
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@workflow_bp.cli.command('rebuild-cost-rollup')
+def rebuild_cost_rollup_command():
+    """按全部成本计算记录重建成本日汇总表"""
+    rows = cost_rollup.rebuild_daily_rollup()
+    db.session.commit()
+    print(f"✅ 成本日汇总已重建，共 {rows} 行")
+
+@workflow_bp.cli.command('import-price-list')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--effective-date', help='文件中没有生效日期列时使用的日期（YYYY-MM-DD，默认今天）')
+@click.option('--dry-run', is_flag=True, help='只校验不写入')
+def import_price_list_command(path, effective_date, dry_run):
+    """从 Excel/CSV 导入供应商价格表（按材料编码 upsert，写入价格历史）"""
+    started = time.perf_counter()
+    try:
+        effective_date = material_prices.parse_date(effective_date)
+        with open(path, 'rb') as fileobj:
+            report = material_prices.import_price_list(
+                fileobj, path, effective_date=effective_date, dry_run=dry_run
+            )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    print(f"{'✅ 校验完成' if dry_run else '✅ 导入完成'}: 共 {report.total} 行，新增材料 {report.inserted}，"
+          f"更新价格 {report.updated}，失败 {report.failed}，用时 {time.perf_counter() - started:.2f}s")
+    for error in report.errors[:20]:
+        print(f"   - 第 {error['row']} 行 {error['code'] or ''}: {'; '.join(error['errors'])}")
+    if report.failed > 20:
+        print(f"   ... 另有 {report.failed - 20} 行错误")
+
 # 错误处理
 @workflow_bp.errorhandler(404)
 def not_found(error):
@@ -0,0 +1,165 @@
+"""
+工艺流程图引擎
+
+基于节点和连接构建有向图（邻接表只构建一次），提供拓扑排序、环检测、
+开始→结束可达性分析，以及关键路径（交期）和各节点松弛时间计算，均为线性复杂度。
+"""
+
+from collections import deque
+
+from models import NodeType
+
+EPSILON = 1e-9
+
+
+class WorkflowGraphError(ValueError):
+    """工艺流程图不合法（如存在环）"""
+
+
+class WorkflowGraph:
+    """
+    工艺流程有向图。
+    nodes: 节点列表（需有 id, node_id, name, node_type 属性）
+    edges: (源节点数据库ID, 目标节点数据库ID) 列表
+    """
+
+    def __init__(self, nodes, edges):
+        self.nodes = list(nodes)
+        self.index = {node.id: i for i, node in enumerate(self.nodes)}
+        self.successors = [[] for _ in self.nodes]
+        self.predecessors = [[] for _ in self.nodes]
+        self.edge_count = 0
+
+        for source_id, target_id in edges:
+            source = self.index.get(source_id)
+            target = self.index.get(target_id)
+            if source is None or target is None:
+                continue
+            self.successors[source].append(target)
+            self.predecessors[target].append(source)
+            self.edge_count += 1
+
+        self.order = self._topological_order()
+        self.reachable = self._reachable()
+
+    @property
+    def graph_defined(self):
+        """是否已连线且包含开始和结束节点"""
+        return bool(self.edge_count and self._starts() and self._ends())
+
+    def _starts(self):
+        return [i for i, node in enumerate(self.nodes) if node.node_type == NodeType.START]
+
+    def _ends(self):
+        return [i for i, node in enumerate(self.nodes) if node.node_type == NodeType.END]
+
+    def _topological_order(self):
+        """Kahn 算法拓扑排序，存在环时报错"""
+        in_degree = [len(preds) for preds in self.predecessors]
+        queue = deque(i for i, degree in enumerate(in_degree) if degree == 0)
+        order = []
+        while queue:
+            current = queue.popleft()
+            order.append(current)
+            for successor in self.successors[current]:
+                in_degree[successor] -= 1
+                if in_degree[successor] == 0:
+                    queue.append(successor)
+
+        if len(order) != len(self.nodes):
+            cyclic = [self.nodes[i].node_id for i, degree in enumerate(in_degree) if degree > 0]
+            raise WorkflowGraphError(f"工艺流程存在环路，涉及节点: {', '.join(cyclic)}")
+        return order
+
+    def _walk(self, sources, adjacency):
+        seen = set(sources)
+        queue = deque(sources)
+        while queue:
+            current = queue.popleft()
+            for neighbor in adjacency[current]:
+                if neighbor not in seen:
+                    seen.add(neighbor)
+                    queue.append(neighbor)
+        return seen
+
+    def _reachable(self):
+        """从开始可达且能到达结束的节点；未连线的流程视为全部节点有效"""
+        if not self.graph_defined:
+            return set(range(len(self.nodes)))
+        forward = self._walk(self._starts(), self.successors)
+        backward = self._walk(self._ends(), self.predecessors)
+        return forward & backward
+
+    def active_nodes(self):
+        """参与计算的节点（按拓扑顺序）"""
+        return [self.nodes[i] for i in self.order if i in self.reachable]
+
+    def unreachable_nodes(self):
+        """不在开始→结束路径上的节点"""
+        return [self.nodes[i] for i in self.order if i not in self.reachable]
+
+    def schedule(self, durations):
+        """
+        关键路径计算。
+        durations: {节点数据库ID: 工时(分钟)}
+        未连线的流程按节点顺序串行处理。
+        返回 dict: lead_time, critical_path, nodes(各节点最早/最迟开工完工及松弛时间)
+        """
+        active = [i for i in self.order if i in self.reachable]
+        if self.graph_defined:
+            predecessors = {i: [p for p in self.predecessors[i] if p in self.reachable] for i in active}
+            successors = {i: [s for s in self.successors[i] if s in self.reachable] for i in active}
+        else:
+            active = sorted(active)
+            predecessors = {i: [] for i in active}
+            successors = {i: [] for i in active}
+            for prev, i in zip(active, active[1:]):
+                predecessors[i].append(prev)
+                successors[prev].append(i)
+
+        duration = {i: durations.get(self.nodes[i].id, 0) or 0 for i in active}
+        earliest_start = {}
+        earliest_finish = {}
+        for i in active:
+            earliest_start[i] = max((earliest_finish[p] for p in predecessors[i]), default=0)
+            earliest_finish[i] = earliest_start[i] + duration[i]
+
+        lead_time = max(earliest_finish.values(), default=0)
+
+        latest_finish = {}
+        latest_start = {}
+        for i in reversed(active):
+            latest_finish[i] = min((latest_start[s] for s in successors[i]), default=lead_time)
+            latest_start[i] = latest_finish[i] - duration[i]
+
+        slack = {i: latest_start[i] - earliest_start[i] for i in active}
+
+        # 沿零松弛节点从头走到尾得到一条关键路径
+        critical_path = []
+        current = next((i for i in active if not predecessors[i] and abs(slack[i]) < EPSILON), None)
+        while current is not None:
+            critical_path.append(self.nodes[current].node_id)
+            current = next(
+                (s for s in successors[current]
+                 if abs(slack[s]) < EPSILON and abs(earliest_start[s] - earliest_finish[current]) < EPSILON),
+                None
+            )
+
+        return {
+            'lead_time_minutes': lead_time,
+            'critical_path': critical_path,
+            'nodes': [
+                {
+                    'node_id': self.nodes[i].node_id,
+                    'name': self.nodes[i].name,
+                    'duration_minutes': duration[i],
+                    'earliest_start': earliest_start[i],
+                    'earliest_finish': earliest_finish[i],
+                    'latest_start': latest_start[i],
+                    'latest_finish': latest_finish[i],
+                    'slack_minutes': slack[i],
+                    'critical': abs(slack[i]) < EPSILON
+                }
+                for i in active
+            ]
+        }
@@ -1,3 +1,4 @@
+import os
 import sys
 import numpy as np
 import matplotlib.pyplot as plt
@@ -16,6 +17,25 @@ from PyQt5.QtWidgets import QListWidget
 from PyQt5.QtGui import QStandardItemModel, QStandardItem, QIcon
 import pandas as pd
 
+from process_formulas import (PROCESS_FORMULAS, WORK_PRICES, DEFAULT_WORK_PRICE,
+                              PROCESS_PATHS_REQUIRE_PARAMETERS, compile_formula)
+from city_comparison import compare_cities, table_from_records
+
+# Web 端数据库（城市工价表），不存在时使用内置工价
+DATABASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'product_status.db')
+
+
+def loadWorkPrices():
+    """读取数据库中今天生效的城市工价（元/秒），读取失败时返回内置工价"""
+    if not os.path.exists(DATABASE_PATH):
+        return dict(WORK_PRICES)
+    try:
+        from wage_rates import read_wage_rates
+        return read_wage_rates('sqlite:///' + DATABASE_PATH) or dict(WORK_PRICES)
+    except Exception as e:
+        print(f"Warning: Failed to load work prices from database ({e}), using built-in prices")
+        return dict(WORK_PRICES)
+
 
 class AppDemo(QWidget):
     def __init__(self):
@@ -45,10 +65,9 @@ class AppDemo(QWidget):
 
         mainLayout.addLayout(excelLayout)
 
+        self.workPrices = loadWorkPrices()
         self.cityInput = QComboBox()
-        self.cityInput.addItems(
-            ['东莞', '惠州', '杭州', '苏州', '宁波', '无锡', '南京', '青岛', '保定', '佛山', '沈阳', '长春', '柳州',
-             '合肥'])  # 添加你需要的城市
+        self.cityInput.addItems(list(self.workPrices))  # 城市列表来自工价表
         excelLayout.addWidget(self.cityInput)
 
         # Functionality buttons area
@@ -81,6 +100,10 @@ class AppDemo(QWidget):
         self.btnSave.setIcon(QIcon('save_icon.png'))  # Set button icon
         buttonLayout.addWidget(self.btnSave)
 
+        self.btnCompareCities = QPushButton('Compare Cities')
+        self.btnCompareCities.clicked.connect(self.compareCities)
+        buttonLayout.addWidget(self.btnCompareCities)
+
         self.processList = QListWidget()
         buttonLayout.addWidget(self.processList)
 
@@ -94,50 +117,7 @@ class AppDemo(QWidget):
         self.setLayout(mainLayout)
 
         self.processData = {}
-        self.processFormulas = {
-            '电子锯开料': '(a+b)*2*5.76/1000*c/15*d',
-            'CNC开料': 'parameters/50+15*d',
-            '排钻': 'parameters*20*d',
-            '数控排钻': 'parameters*3+15*d',
-            '锣槽': 'parameters/180+12*d',
-            '铣型': 'parameters*d',
-            '机器封边': '(a+b)*2/1000*28.8*d',
-            '人工封边': 'parameters/1000*40*d',
-            '空心板': '864*d if (a+b) > 1600 else 720*d if (a+b) > 1100 else 576*d if (a+b) > 700 else 432*d',
-            '假厚板': '345*d if (a+b) > 1600 else 288*d if (a+b) > 1100 else 230*d if (a+b) > 700 else 172*d',
-            '栅格门': '445*d if (a+b) > 1600 else 388*d if (a+b) > 1100 else 330*d if (a+b) > 700 else 272*d',
-            '装饰件': 'parameters*d',
-            '芯板门': '167.8*d if (a+b) > 1600 else 152.8*d if (a+b) > 1100 else 137.8*d if (a+b) > 700 else 122.8*d',
-            '其他拼装': 'parameters*d',
-            '导轨': 'parameters*d',
-            '脚钉': 'parameters*10*d',
-            '002公扣': 'parameters*15*d',
-            '002母扣': 'parameters*10*d',
-            '螺丝': 'parameters*8*d',
-            '其他预装': 'parameters*d',
-            'logo': '12*d',
-            '字母标': '6*d',
-            '清洁': 'a*b/1000*20*d',
-            '修边': '(a+b)*2/1000*28.8*d',
-            '修色': '(a+b)*2/1000*28.8*d',
-            # ... 添加其他工艺路径的公式 ...
-        }
-        self.workPrices = {
-            '东莞': 0.006694444,
-            '惠州': 0.00625,
-            '杭州': 0.008138889,
-            '苏州': 0.008083333,
-            '宁波': 0.008027778,
-            '无锡': 0.008,
-            '南京': 0.007916667,
-            '青岛': 0.007277778,
-            '保定': 0.006861111,
-            '佛山': 0.006777778,
-            '沈阳': 0.006722222,
-            '长春': 0.006694444,
-            '柳州': 0.006416667,
-            '合肥': 0.006138889,
-        }
+        self.processFormulas = dict(PROCESS_FORMULAS)
 
     def loadExcel(self):
         try:
@@ -229,23 +209,6 @@ class AppDemo(QWidget):
             if component not in self.processData:
                 self.processData[component] = []
 
-            # Define the list of process paths that require parameters
-            processPathsRequireParameters = [
-                'CNC开料',
-                '排钻',
-                '数控排钻',
-                '锣槽',
-                '铣型',
-                '人工封边',
-                '其他拼装',
-                '导轨',
-                '脚钉',
-                '002公扣',
-                '002母扣',
-                '螺丝',
-                '其他预装'
-            ]
-
             for i in range(self.processPathLayout.count()):
                 group = self.processPathLayout.itemAt(i).widget()
                 layout = group.layout()
@@ -255,7 +218,7 @@ class AppDemo(QWidget):
                         processPath = widget.text()
                         processParameters = None
                         # Check if the current process path requires parameters
-                        if processPath in processPathsRequireParameters:
+                        if processPath in PROCESS_PATHS_REQUIRE_PARAMETERS:
                             processParameters, ok = QInputDialog.getText(self, 'Input Dialog',
                                                                          f'Enter parameters for {processPath}:')  # 弹出输入框
                             if not ok:  # 如果用户点击了取消按钮
@@ -263,38 +226,87 @@ class AppDemo(QWidget):
                         else:
                             processParameters = 0  # Set default parameters to 0 for process paths that do not require parameters
 
-                        # 计算工时
-                        formula = self.processFormulas[processPath]
+                        # 计算工时（公式只解析一次并缓存）
+                        formula = compile_formula(self.processFormulas[processPath])
                         a = self.df.iat[selectedRow, self.df.columns.get_loc('a')]
                         b = self.df.iat[selectedRow, self.df.columns.get_loc('b')]
                         c = self.df.iat[selectedRow, self.df.columns.get_loc('c')]
                         d = self.df.iat[selectedRow, self.df.columns.get_loc('d')]
                         parameters = float(processParameters)
-                        time = eval(formula.format(a=a, b=b, c=c, d=d, parameters=parameters))
+                        time = formula(a=a, b=b, c=c, d=d, parameters=parameters)
+                        if not np.isfinite(time):
+                            # 除以零得到 inf/nan（与整列计算一致），不加入工艺列表
+                            print(f"Warning: Process time of '{processPath}' is {time} (division by zero), skipped")
+                            continue
 
                         # 计算成本
                         city = self.df.iat[selectedRow, self.df.columns.get_loc('City')]
                         if city in self.workPrices:
                             cost = time * self.workPrices[city]
                         else:
-                            print(f"Warning: No work price for city '{city}', using default price 0.007")
-                            cost = time * 0.007  # 使用默认工价
+                            print(f"Warning: No work price for city '{city}', using default price {DEFAULT_WORK_PRICE}")
+                            cost = time * DEFAULT_WORK_PRICE  # 使用默认工价
 
-                        self.processData[component].append([processPath, processParameters, time, cost])
+                        # 记录 BOM 行号：工时按该行尺寸计算，对比和保存也只作用于该行
+                        self.processData[component].append([processPath, processParameters, time, cost, selectedRow])
             self.updateProcessList()
             self.updateBarChart()
         except Exception as e:
             print('Error:', e)
 
+    def compareCities(self):
+        """按已添加的工艺路径计算整个 BOM 在各城市的工费（一次向量化计算），并绘制对比图（工艺按添加时的行挂接）"""
+        try:
+            if not hasattr(self, 'df'):
+                print("No Excel file loaded")
+                return
+
+            routing = table_from_records([
+                {'Component': component, 'Process Path': processPath, 'Process Parameters': processParameters,
+                 'Row': row}
+                for component, data in self.processData.items()
+                for processPath, processParameters, time, cost, row in data
+            ])
+            if not routing:
+                print("No process path added")
+                return
+            comparison = compare_cities(self.df, routing, self.workPrices, formulas=self.processFormulas)
+            self.updateCityChart(comparison)
+        except Exception as e:
+            print('Error:', e)
+
+    def updateCityChart(self, comparison):
+        self.figure.clear()
+        ax = self.figure.add_subplot(111)
+        totals = comparison.totals
+        order = np.argsort(totals)
+        cities = [comparison.cities[i] for i in order]
+        current = self.cityInput.currentText()
+        bars = ax.bar(cities, totals[order], color=['red' if city == current else 'blue' for city in cities])
+
+        # Add data labels to the bars
+        for bar in bars:
+            yval = bar.get_height()
+            ax.text(bar.get_x() + bar.get_width() / 2, yval, round(yval, 2), va='bottom', ha='center')
+
+        ax.set_title('Total Process Cost for Each City')
+        ax.set_xlabel('City')
+        ax.set_ylabel('Cost')
+        self.canvas.draw()
+
     def saveExcel(self):
         fileName, _ = QFileDialog.getSaveFileName(self, 'Save file', '', 'Excel files (*.xlsx)')
         if fileName:
             for component, data in self.processData.items():
-                for i, (processPath, processParameters, time, cost) in enumerate(data):
-                    self.df.loc[self.df['Component'] == component, f'Process Path {i + 1}'] = processPath
-                    self.df.loc[self.df['Component'] == component, f'Process Parameters {i + 1}'] = processParameters
-                    self.df.loc[self.df['Component'] == component, f'Process Time {i + 1}'] = time
-                    self.df.loc[self.df['Component'] == component, f'Process Cost {i + 1}'] = cost
+                counts = {}
+                for processPath, processParameters, time, cost, row in data:
+                    # 写到添加工艺时所在的行，同名部件的其它行不受影响
+                    i = counts[row] = counts.get(row, 0) + 1
+                    index = self.df.index[row]
+                    self.df.loc[index, f'Process Path {i}'] = processPath
+                    self.df.loc[index, f'Process Parameters {i}'] = processParameters
+                    self.df.loc[index, f'Process Time {i}'] = time
+                    self.df.loc[index, f'Process Cost {i}'] = cost
             self.df.to_excel(fileName, index=False)
 
     def deleteProcessPath(self):
@@ -344,7 +356,7 @@ class AppDemo(QWidget):
         self.processList.clear()
         component = self.componentInput.currentText()
         if component in self.processData:
-            for processPath, processParameters, time, cost in self.processData[component]:
+            for processPath, processParameters, time, cost, row in self.processData[component]:
                 self.processList.addItem(
                     f"{component}: {processPath} - Parameters: {processParameters} - Time: {time} - Cost: {cost}")
 